@@ -0,0 +1,61 @@
+# bench/bench_broadcast.py
+"""
+Publish-to-last-delivery latency of a channel post as the subscriber count
+grows: one frame encoded once, the same object queued on every subscriber's
+Outbox, timed until the last copy is written (the writes only yield to the
+loop, so this is the server's share of the latency). Also prints the cost of
+the publish call itself.
+Run: python bench/bench_broadcast.py [posts]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from channels import FanoutStats, FanoutTimer  # noqa: E402
+from codec import JSON, RawPayload  # noqa: E402
+from outbox import Outbox, OutboxStats  # noqa: E402
+
+
+async def write(data):
+    await asyncio.sleep(0)
+
+
+def post(seq: int) -> dict:
+    payload = JSON.encode({"iv": os.urandom(12), "ct": os.urandom(256), "aad": '{"channel": "news"}'})
+    return {"payload": RawPayload(JSON, payload), "id": 361828853795712 + seq, "seq": seq,
+            "sender": "Maya", "sender_username": "user-3f2a9c1d", "channel": "news", "type": "broadcast"}
+
+
+async def run(subscribers: int, posts: int):
+    stats = FanoutStats()
+    outbox_stats = OutboxStats()
+    outboxes = [Outbox(write, JSON, stats=outbox_stats) for _ in range(subscribers)]
+    publish_s = 0.0
+    for seq in range(1, posts + 1):
+        start = time.perf_counter()
+        timer = FanoutTimer(stats)
+        data = JSON.encode(post(seq))
+        for outbox in outboxes:
+            outbox.put(data, "broadcast", False, timer)
+        timer.queued(len(outboxes))
+        publish_s += time.perf_counter() - start
+        while timer.pending:
+            await asyncio.sleep(0)
+    return publish_s / posts, stats.latency[stats.bucket(subscribers)]
+
+
+def main():
+    posts = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print(f"{'subscribers':<13}{'publish us':>12}{'mean ms':>10}{'p50 <= ms':>11}{'p99 <= ms':>11}")
+    for subscribers in (10, 100, 1000, 5000):
+        publish, hist = asyncio.run(run(subscribers, posts))
+        mean = hist.sum / hist.count * 1000 if hist.count else 0.0
+        print(f"{subscribers:<13}{publish * 1e6:>12.1f}{mean:>10.2f}{hist.quantile(0.5) * 1000:>11.2f}{hist.quantile(0.99) * 1000:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# bench/bench_envelope.py
+"""
+Server-side cost of relaying one message: the old flat frame (decode all of
+it, validate, re-encode iv/ct) against the envelope (decode the routing
+header, check the opaque payload is one flat map, splice it back in), per
+wire format and size. MessagePack decodes iv/ct as a copy of bytes, so the
+envelope only pays on JSON, and the bundled clients only send it there.
+Run: python bench/bench_envelope.py [iterations]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from codec import JSON, MSGPACK  # noqa: E402
+from schemas import parse_inbound  # noqa: E402
+
+HEADER = {"type": "message", "cid": "0b6f3c2e-8d1a-4f57-9c3b-2a7d5e1f0c9b",
+          "sender_username": "user-3f2a9c1d", "recipient": "user-8b7e6d5c"}
+SERVER_FIELDS = {"id": 361828853795712, "seq": 42, "sender": "Maya",
+                 "sender_username": "user-3f2a9c1d", "recipient": "user-8b7e6d5c", "type": "message", "ev": 7}
+
+
+def sample_payload(plaintext_len: int) -> dict:
+    return {
+        "iv": os.urandom(12),
+        "ct": os.urandom(plaintext_len + 16),
+        "aad": '{"sender": "user-3f2a9c1d", "recipient": "user-8b7e6d5c"}',
+        "timestamp": "2026-10-19T12:34:56.789Z",
+    }
+
+
+def inbound(codec, payload: dict, envelope: bool):
+    if not envelope:
+        return codec.encode({**HEADER, **payload})
+    if codec.binary:
+        return codec.encode(HEADER) + codec.encode(payload)
+    return codec.encode(HEADER) + "\n" + codec.encode(payload)
+
+
+def relay_flat(codec, data):
+    _, m = parse_inbound(codec.decode(data))
+    return codec.encode({"iv": m.iv, "ct": m.ct, "aad": m.aad, "timestamp": m.timestamp, **SERVER_FIELDS})
+
+
+def relay_envelope(codec, data):
+    header, payload = codec.decode_envelope(data)
+    _, m = parse_inbound(header, payload)
+    return codec.encode({"payload": m.payload, **SERVER_FIELDS})
+
+
+def per_call_us(fn, codec, data, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(codec, data)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    codecs = [JSON] + ([MSGPACK] if MSGPACK is not None else [])
+    print(f"{'plaintext':<12}{'codec':<9}{'flat us':>10}{'envelope us':>13}{'saving':>9}")
+    for size in (40, 1024, 16 * 1024, 60 * 1024):
+        payload = sample_payload(size)
+        n = max(1, iterations // 20) if size > 4096 else iterations
+        for codec in codecs:
+            flat = per_call_us(relay_flat, codec, inbound(codec, payload, False), n)
+            env = per_call_us(relay_envelope, codec, inbound(codec, payload, True), n)
+            print(f"{size:<12}{codec.name:<9}{flat:>10.2f}{env:>13.2f}{(1 - env / flat) * 100:>8.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# bench/bench_fanout.py
+"""
+Server-side cost of delivering one room message to N members: encoding the
+frame for every member (each copy differs only in its "ev" cursor) against
+encoding it once per wire format and appending each member's ev.
+Run: python bench/bench_fanout.py [iterations]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from codec import JSON, MSGPACK, RawPayload  # noqa: E402
+
+
+def room_frame(codec, plaintext_len: int) -> dict:
+    payload = {"iv": os.urandom(12), "ct": os.urandom(plaintext_len + 16),
+               "aad": '{"sender": "user-3f2a9c1d", "room": "team"}', "timestamp": "2026-10-19T12:34:56.789Z"}
+    return {"payload": RawPayload(codec, codec.encode(payload)), "id": 361828853795712, "seq": 42,
+            "sender": "Maya", "sender_username": "user-3f2a9c1d", "room": "team", "type": "message"}
+
+
+def per_member(codec, frame, members: int):
+    return [codec.encode({**frame, "ev": ev}) for ev in range(members)]
+
+
+def shared(codec, frame, members: int):
+    encoded = codec.encode(frame)
+    return [codec.append_field(encoded, "ev", ev) for ev in range(members)]
+
+
+def per_call_us(fn, codec, frame, members: int, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(codec, frame, members)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    codecs = [JSON] + ([MSGPACK] if MSGPACK is not None else [])
+    print(f"{'plaintext':<12}{'members':<9}{'codec':<9}{'per member us':>15}{'shared us':>11}{'saving':>9}")
+    for size in (40, 4096):
+        for members in (10, 100):
+            for codec in codecs:
+                frame = room_frame(codec, size)
+                each = per_call_us(per_member, codec, frame, members, iterations)
+                once = per_call_us(shared, codec, frame, members, iterations)
+                print(f"{size:<12}{members:<9}{codec.name:<9}{each:>15.1f}{once:>11.1f}{(1 - once / each) * 100:>8.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# bench/bench_json.py
+"""
+Stdlib json vs the fast JSON backends (orjson, msgspec) behind codec.JsonCodec,
+on the frame shapes the server encodes and decodes on its hot path.
+Run: python bench/bench_json.py [iterations]
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from bench_wire import SHAPES, bench  # noqa: E402
+from codec import JsonCodec, available_json_backends  # noqa: E402
+
+SHAPES = dict(SHAPES)
+SHAPES["user_list (50 users)"] = {
+    "type": "user_list",
+    "users": [{"username": f"user-{i:08x}", "label": f"Guest {i}", "anonymous": i % 3 == 0} for i in range(50)],
+}
+SHAPES["passphrase"] = {"type": "passphrase", "passphrase": "xQ9#kL2$pR7&mZ4!vW1@cN6^bV3*sY8"}
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    backends = available_json_backends()
+    if backends == ["stdlib"]:
+        print("no fast JSON backend installed (pip install orjson or msgspec); showing stdlib only")
+    print(f"{'frame':<26}{'backend':<9}{'encode us':>11}{'decode us':>11}{'speedup':>9}")
+    for name, frame in SHAPES.items():
+        n = max(1, iterations // 50) if len(frame.get("ct", b"")) > 4096 else iterations
+        baseline = None
+        for backend in reversed(backends):  # stdlib first, as the baseline
+            enc, dec, _ = bench(JsonCodec(backend), frame, n)
+            baseline = baseline or (enc + dec)
+            print(f"{name:<26}{backend:<9}{enc:>11.2f}{dec:>11.2f}{baseline / (enc + dec):>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# bench/bench_schemas.py
+"""
+Cost of decode + compiled schema validation per inbound message type,
+next to the bare decode, for each wire format.
+Run: python bench/bench_schemas.py [iterations]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from codec import JSON, MSGPACK  # noqa: E402
+from schemas import parse_inbound  # noqa: E402
+
+INBOUND = {
+    "register": {"type": "register", "username": "user-3f2a9c1d", "anonymous": False, "label": "Maya"},
+    "message": {
+        "type": "message",
+        "cid": "0b6f3c2e-8d1a-4f57-9c3b-2a7d5e1f0c9b",
+        "sender_username": "user-3f2a9c1d",
+        "recipient": "user-8b7e6d5c",
+        "sender": "Maya",
+        "iv": os.urandom(12),
+        "ct": os.urandom(256),
+        "aad": '{"sender": "user-3f2a9c1d", "recipient": "user-8b7e6d5c"}',
+        "timestamp": "2026-10-19T12:34:56.789Z",
+    },
+    "get_chat_history": {"type": "get_chat_history", "with_user": "user-8b7e6d5c", "after_seq": 40},
+    "update_label": {"type": "update_label", "label": "Maya", "anonymous": False},
+    "get_passphrase": {"type": "get_passphrase"},
+}
+
+
+def per_call_us(fn, data, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(data)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    codecs = [JSON] + ([MSGPACK] if MSGPACK is not None else [])
+    print(f"{'type':<18}{'codec':<9}{'decode us':>11}{'+validate us':>14}{'validate share':>16}")
+    for name, frame in INBOUND.items():
+        for codec in codecs:
+            data = codec.encode(frame)
+            parse_inbound(codec.decode(data))  # fail loudly if the sample doesn't validate
+            decode = per_call_us(codec.decode, data, iterations)
+            full = per_call_us(lambda d: parse_inbound(codec.decode(d)), data, iterations)
+            print(f"{name:<18}{codec.name:<9}{decode:>11.2f}{full:>14.2f}{(full - decode) / full * 100:>15.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# bench/bench_wire.py
+"""
+JSON vs MessagePack framing for the frames the chat server actually sends.
+Reports encode/decode time per frame and bytes on the wire.
+Run: python bench/bench_wire.py [iterations]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from codec import JSON, MSGPACK  # noqa: E402
+
+
+def sample_message(plaintext_len: int) -> dict:
+    # AES-GCM: 12-byte IV, ciphertext = plaintext + 16-byte tag
+    return {
+        "type": "message",
+        "id": 361828853795712,
+        "seq": 42,
+        "sender": "Maya",
+        "sender_username": "user-3f2a9c1d",
+        "recipient": "user-8b7e6d5c",
+        "iv": os.urandom(12),
+        "ct": os.urandom(plaintext_len + 16),
+        "aad": '{"sender": "user-3f2a9c1d", "recipient": "user-8b7e6d5c"}',
+        "timestamp": "2026-10-19T12:34:56.789Z",
+    }
+
+
+SHAPES = {
+    "message (40 B text)": sample_message(40),
+    "message (1 KiB text)": sample_message(1024),
+    "message (64 KiB text)": sample_message(64 * 1024),
+    "chat_history (20 msgs)": {"type": "chat_history", "with_user": "user-8b7e6d5c",
+                               "messages": [sample_message(80) for _ in range(20)], "last_seq": 20},
+    "ack": {"type": "ack", "id": 361828853795712, "cid": "0b6f3c2e-8d1a-4f57-9c3b-2a7d5e1f0c9b", "status": "delivered"},
+}
+
+
+def bench(codec, frame, iterations: int):
+    data = codec.encode(frame)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        codec.encode(frame)
+    encode_us = (time.perf_counter() - start) / iterations * 1e6
+    start = time.perf_counter()
+    for _ in range(iterations):
+        codec.decode(data)
+    decode_us = (time.perf_counter() - start) / iterations * 1e6
+    size = len(data.encode("utf-8")) if isinstance(data, str) else len(data)
+    return encode_us, decode_us, size
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    codecs = [JSON] + ([MSGPACK] if MSGPACK is not None else [])
+    if MSGPACK is None:
+        print("msgpack not installed; showing JSON only (pip install msgpack)")
+    print(f"{'frame':<26}{'codec':<9}{'encode us':>11}{'decode us':>11}{'bytes':>9}")
+    for name, frame in SHAPES.items():
+        n = max(1, iterations // 50) if len(frame.get("ct", b"")) > 4096 else iterations
+        rows = [(codec.name, *bench(codec, frame, n)) for codec in codecs]
+        for codec_name, enc, dec, size in rows:
+            print(f"{name:<26}{codec_name:<9}{enc:>11.2f}{dec:>11.2f}{size:>9}")
+        if len(rows) == 2:
+            (_, je, jd, js), (_, me, md, ms) = rows
+            print(f"{'':<26}{'saving':<9}{(1 - (me + md) / (je + jd)) * 100:>21.0f}%{(1 - ms / js) * 100:>8.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -114,6 +114,24 @@ body { background: var(--bg); color: var(--text); font-family: Inter, ui-sans-se
         <div><strong>Active chats:</strong></div>
         <div id="active-chats" style="margin-top:8px; max-height:200px; overflow-y:auto;"></div>
       </div>
+
+      <div style="margin-top:12px;">
+        <div><strong>Rooms:</strong></div>
+        <div class="input-row">
+          <input id="room-name" class="text-input" placeholder="Room name" />
+          <button id="join-room" class="send-btn">Join</button>
+        </div>
+        <button id="leave-room" class="send-btn" style="margin-top:8px; width:100%; display:none;">Leave room</button>
+      </div>
+
+      <div style="margin-top:12px;">
+        <div><strong>Channels:</strong></div>
+        <div class="input-row">
+          <input id="channel-name" class="text-input" placeholder="Channel name" />
+          <button id="follow-channel" class="send-btn">Follow</button>
+          <button id="create-channel" class="send-btn">Create</button>
+        </div>
+      </div>
     </div>
     <div class="left">
       <div class="header">
@@ -121,6 +139,7 @@ body { background: var(--bg); color: var(--text); font-family: Inter, ui-sans-se
         <div style="font-size:13px; color:var(--muted)">You: <strong id="me">{me_display}</strong></div>
       </div>
       <div id="chatbox" class="chatbox"></div>
+      <div id="typing" style="color:var(--muted); font-size:12px; min-height:16px; margin-top:4px;"></div>
       <div class="input-row">
         <input id="out" class="text-input" placeholder="Type a message and press Enter" />
         <button id="send" class="send-btn">Send</button>
@@ -148,6 +167,185 @@ let chatHistories = {};
 let currentPeer = null;
 let latestUsers = {};
 let defaultPassphrase = null;
+// Rooms and broadcast channels live in chatHistories too, keyed "#name" and "@name"
+// so they can't clash with a username
+let roomMembers = {};  // room name -> member usernames
+let channelInfo = {};  // channel name -> { publisher }
+
+// Typing indicators are best-effort: refreshed while typing, "stopped" after a pause,
+// and shown for a few seconds unless refreshed (the server may drop or coalesce them)
+const TYPING_REFRESH_MS = 2500;
+const TYPING_IDLE_MS = 3000;
+const TYPING_SHOW_MS = 6000;
+let typingTarget = null;
+let typingSentAt = 0;
+let typingIdle = null;
+let typingNow = {};  // peer -> { username: shown until }
+
+// Messages sent but not yet accepted by the server, oldest first (cid -> {msg, sentAt})
+const UNACKED_WINDOW = 32;
+const ACK_TIMEOUT_MS = 5000;
+// the server refuses ciphertext over MAX_CT_BYTES (64 KiB by default, AES-GCM adds a 16-byte tag)
+const MAX_TEXT_BYTES = 64 * 1024 - 16;
+// Flow control: the server sends at most CREDIT_WINDOW chat messages we haven't finished
+// handling (decrypting is slow); credit goes back in halves as they are processed
+const CREDIT_WINDOW = 8;
+let consumed = 0;
+let unacked = new Map();
+let sentByCid = {};  // cid -> message we sent (for ack status)
+let ackMarks = {};   // cid -> status element of the sent bubble
+let lastSeq = {};    // peer -> highest conversation seq seen
+
+// Resume token and last event cursor ("ev"), so a reconnect replays only what we missed
+let sessionToken = null;
+let lastEv = 0;
+let reconnectDelay = 500;
+const ACK_LABELS = { accepted: "✓", delivered: "✓✓", offline: "✓ (offline)", failed: "!" };
+
+// MessagePack, the subset the server speaks (nil, bool, numbers, str, bin, array, map); inline so
+// that no third-party script runs on a page that holds the passphrase and decrypted messages
+const MessagePack = (() => {
+  const te = new TextEncoder(), td = new TextDecoder();
+
+  function encode(value) {
+    const out = [];
+    const put = b => { for (let i = 0; i < b.length; i++) out.push(b[i]); };
+    const num = (tag, setter, n, v) => { const d = new DataView(new ArrayBuffer(n)); d[setter](0, v); out.push(tag); put(new Uint8Array(d.buffer)); };
+    const head = (n, fix, fixMax, t8, t16, t32) => {
+      if (fix !== null && n <= fixMax) out.push(fix | n);
+      else if (t8 !== null && n < 0x100) out.push(t8, n);
+      else if (n < 0x10000) num(t16, "setUint16", 2, n);
+      else num(t32, "setUint32", 4, n);
+    };
+    (function enc(v) {
+      if (v === null || v === undefined) out.push(0xc0);
+      else if (v === true || v === false) out.push(v ? 0xc3 : 0xc2);
+      else if (typeof v === "number") {
+        if (!Number.isSafeInteger(v)) num(0xcb, "setFloat64", 8, v);
+        else if (v >= 0 && v < 0x80) out.push(v);
+        else if (v < 0 && v >= -32) out.push(v & 0xff);
+        else if (v >= 0) { if (v < 0x100000000) num(0xce, "setUint32", 4, v); else num(0xcf, "setBigUint64", 8, BigInt(v)); }
+        else { if (v >= -0x80000000) num(0xd2, "setInt32", 4, v); else num(0xd3, "setBigInt64", 8, BigInt(v)); }
+      }
+      else if (typeof v === "string") { const b = te.encode(v); head(b.length, 0xa0, 31, 0xd9, 0xda, 0xdb); put(b); }
+      else if (v instanceof Uint8Array) { head(v.length, null, 0, 0xc4, 0xc5, 0xc6); put(v); }
+      else if (Array.isArray(v)) { head(v.length, 0x90, 15, null, 0xdc, 0xdd); v.forEach(enc); }
+      else { const keys = Object.keys(v); head(keys.length, 0x80, 15, null, 0xde, 0xdf); for (const k of keys) { enc(k); enc(v[k]); } }
+    })(value);
+    return Uint8Array.from(out);
+  }
+
+  function decode(buf) {
+    const d = new DataView(buf.buffer, buf.byteOffset, buf.byteLength);
+    let pos = 0;
+    const take = n => { if (pos + n > buf.length) throw new Error("truncated msgpack"); pos += n; return pos - n; };
+    const str = n => td.decode(buf.subarray(take(n), pos));
+    const bin = n => buf.slice(take(n), pos);
+    const arr = n => { const a = []; for (let i = 0; i < n; i++) a.push(item()); return a; };
+    const map = n => {
+      const m = {};
+      for (let i = 0; i < n; i++) {
+        const k = item();
+        if (typeof k !== "string" || k === "__proto__") throw new Error("bad msgpack map key");
+        m[k] = item();
+      }
+      return m;
+    };
+    function item() {
+      const t = buf[take(1)];
+      if (t < 0x80) return t;
+      if (t < 0x90) return map(t & 0x0f);
+      if (t < 0xa0) return arr(t & 0x0f);
+      if (t < 0xc0) return str(t & 0x1f);
+      if (t >= 0xe0) return t - 0x100;
+      switch (t) {
+        case 0xc0: return null;
+        case 0xc2: return false;
+        case 0xc3: return true;
+        case 0xc4: return bin(d.getUint8(take(1)));
+        case 0xc5: return bin(d.getUint16(take(2)));
+        case 0xc6: return bin(d.getUint32(take(4)));
+        case 0xca: return d.getFloat32(take(4));
+        case 0xcb: return d.getFloat64(take(8));
+        case 0xcc: return d.getUint8(take(1));
+        case 0xcd: return d.getUint16(take(2));
+        case 0xce: return d.getUint32(take(4));
+        case 0xcf: return Number(d.getBigUint64(take(8)));
+        case 0xd0: return d.getInt8(take(1));
+        case 0xd1: return d.getInt16(take(2));
+        case 0xd2: return d.getInt32(take(4));
+        case 0xd3: return Number(d.getBigInt64(take(8)));
+        case 0xd9: return str(d.getUint8(take(1)));
+        case 0xda: return str(d.getUint16(take(2)));
+        case 0xdb: return str(d.getUint32(take(4)));
+        case 0xdc: return arr(d.getUint16(take(2)));
+        case 0xdd: return arr(d.getUint32(take(4)));
+        case 0xde: return map(d.getUint16(take(2)));
+        case 0xdf: return map(d.getUint32(take(4)));
+      }
+      throw new Error("unsupported msgpack type 0x" + t.toString(16));
+    }
+    const value = item();
+    if (pos !== buf.length) throw new Error("trailing msgpack data");
+    return value;
+  }
+
+  return { encode, decode };
+})();
+
+// Wire format: MessagePack (raw iv/ct bytes) when the server agrees, else JSON
+const WIRE_PROTOCOLS = ["chat.msgpack.v1", "chat.json.v1"];
+
+function b64ToBytes(s) { return Uint8Array.from(atob(s), c => c.charCodeAt(0)); }
+
+function bytesToB64(b) {
+  let s = "";
+  for (let i = 0; i < b.length; i++) s += String.fromCharCode(b[i]);
+  return btoa(s);
+}
+
+function fromWire(v) {
+  // binary frames carry iv/ct as bytes; the rest of the client works with base64 strings
+  if (v instanceof Uint8Array) return bytesToB64(v);
+  if (Array.isArray(v)) return v.map(fromWire);
+  if (v && typeof v === "object") { for (const k in v) v[k] = fromWire(v[k]); }
+  return v;
+}
+
+function unwrap(m) {
+  // envelope messages carry iv/ct/aad/timestamp in an opaque payload; fields the server set win
+  if (!m || !m.payload) return m;
+  const { payload, ...rest } = m;
+  return { ...payload, ...rest };
+}
+
+function openFrame(obj) {
+  if (obj.messages) obj.messages = obj.messages.map(unwrap);
+  if (obj.chats) for (const k in obj.chats) obj.chats[k] = obj.chats[k].map(unwrap);
+  return unwrap(obj);
+}
+
+function decodeFrame(data) {
+  return openFrame(data instanceof ArrayBuffer ? fromWire(MessagePack.decode(new Uint8Array(data))) : JSON.parse(data));
+}
+
+// Messages go out flat on MessagePack (iv/ct as raw bytes, nothing to gain from splitting them off).
+// On JSON they go out as an envelope: a routing header line the server reads, then the encrypted
+// payload line, which it checks once and then stores and forwards as it came
+function sendFrame(obj) {
+  const isMessage = (obj.type === "message" || obj.type === "room_message" || obj.type === "publish") && obj.ct !== undefined;
+  if (ws.protocol === "chat.msgpack.v1") {
+    ws.send(MessagePack.encode(isMessage ? { ...obj, iv: b64ToBytes(obj.iv), ct: b64ToBytes(obj.ct) } : obj));
+    return;
+  }
+  if (!isMessage) { ws.send(JSON.stringify(obj)); return; }
+  const header = { type: obj.type, cid: obj.cid, sender_username: obj.sender_username };
+  if (obj.type === "room_message") header.room = obj.room;
+  else if (obj.type === "publish") header.channel = obj.channel;
+  else header.recipient = obj.recipient;
+  const payload = { iv: obj.iv, ct: obj.ct, aad: obj.aad, timestamp: obj.timestamp };
+  ws.send(JSON.stringify(header) + "\\n" + JSON.stringify(payload));
+}
 
 function fmtLocal(iso) {
   if (!iso) return "";
@@ -165,7 +363,7 @@ function clearChatbox() {
   const cb = document.getElementById("chatbox"); cb.innerHTML = "";
 }
 
-function appendBubble({from_label, sender_username, text, ts, mine=false}) {
+function appendBubble({from_label, sender_username, text, ts, mine=false, cid=null, ack=null, showName=false}) {
   const cb = document.getElementById("chatbox");
   const row = document.createElement("div");
   row.className = "bubble-row " + (mine ? "bubble-right" : "bubble-left");
@@ -181,10 +379,25 @@ function appendBubble({from_label, sender_username, text, ts, mine=false}) {
   bubble.style.color = mine ? "var(--bubble-sent-text)" : "var(--bubble-recv-text)";
   bubble.innerText = text;
 
+  if (showName && !mine) {
+    // rooms have several senders
+    const name = document.createElement("div");
+    name.className = "sender-name";
+    name.innerText = from_label || sender_username;
+    wrapper.appendChild(name);
+  }
+
   const meta = document.createElement("div");
   meta.className = "meta";
   // Only show timestamp
   meta.innerHTML = "<span class='ts'> " + (ts ? fmtLocal(ts) : "") + "</span>";
+  if (mine && cid) {
+    const mark = document.createElement("span");
+    mark.className = "ts";
+    mark.textContent = ack ? ACK_LABELS[ack] || "" : "…";
+    meta.appendChild(mark);
+    ackMarks[cid] = mark;
+  }
 
   wrapper.appendChild(bubble);
   wrapper.appendChild(meta);
@@ -193,12 +406,77 @@ function appendBubble({from_label, sender_username, text, ts, mine=false}) {
   cb.scrollTop = cb.scrollHeight;
 }
 
+function newClientId() {
+  // idempotency key: the server acks a resend of the same cid without storing it twice
+  if (crypto.randomUUID) return crypto.randomUUID();
+  return Array.from(crypto.getRandomValues(new Uint8Array(16)), b => b.toString(16).padStart(2, "0")).join("");
+}
+
+function isRoom(peer) { return peer && peer[0] === "#"; }
+function isChannel(peer) { return peer && peer[0] === "@"; }
+
+function peerOf(m) {
+  // the chatHistories key a message (received, or one we sent) belongs to
+  if (m.room !== undefined) return "#" + m.room;
+  if (m.channel !== undefined) return "@" + m.channel;
+  return m.sender_username === username ? m.recipient : m.sender_username;
+}
+
+function peerLabel(peer) {
+  if (isRoom(peer)) return peer + " (" + (roomMembers[peer.slice(1)] || []).length + ")";
+  if (isChannel(peer)) return peer + ((channelInfo[peer.slice(1)] || {}).publisher ? "" : " (read-only)");
+  return latestUsers[peer] ? latestUsers[peer].label : peer;
+}
+
+function historyRequest(peer, after) {
+  const req = isRoom(peer) ? { type: "get_room_history", room: peer.slice(1) }
+    : isChannel(peer) ? { type: "get_channel_history", channel: peer.slice(1) }
+    : { type: "get_chat_history", with_user: peer };
+  if (after) req.after_seq = after;
+  return req;
+}
+
+function noteSeq(peer, seq) {
+  // a jump in the conversation seq means we missed something: fetch only what came after
+  if (seq === undefined) return;
+  const prev = lastSeq[peer] || 0;
+  if (prev && seq > prev + 1 && ws && ws.readyState === 1) {
+    try { sendFrame(historyRequest(peer, prev)); } catch(_) {}
+  }
+  lastSeq[peer] = Math.max(prev, seq);
+}
+
+function mergeHistory(peer, msgs) {
+  if (!chatHistories[peer]) chatHistories[peer] = [];
+  const have = new Set(chatHistories[peer].map(m => m.id));
+  for (const m of msgs) {
+    if (!have.has(m.id)) chatHistories[peer].push(m);
+    if (m.seq !== undefined) lastSeq[peer] = Math.max(lastSeq[peer] || 0, m.seq);
+  }
+  chatHistories[peer].sort((a, b) => (a.seq ?? Number.MAX_SAFE_INTEGER) - (b.seq ?? Number.MAX_SAFE_INTEGER));
+}
+
+function resendUnacked(force = false) {
+  if (!ws || ws.readyState !== 1) return;
+  const now = Date.now();
+  for (const pending of unacked.values()) {
+    if (!force && now - pending.sentAt < ACK_TIMEOUT_MS) continue;
+    try { sendFrame(pending.msg); pending.sentAt = now; } catch(_) { return; }
+  }
+}
+
+function grantCredit(n) { try { sendFrame({ type: "credit", grant: n }); } catch(_) {} }
+
+function messageDone() {
+  if (++consumed >= CREDIT_WINDOW / 2) { grantCredit(consumed); consumed = 0; }
+}
+
 function updateActiveChats() {
   const activeChatsDiv = document.getElementById("active-chats");
   activeChatsDiv.innerHTML = "";
   for (const peer in chatHistories) {
     const chatBtn = document.createElement("button");
-    chatBtn.textContent = latestUsers[peer] ? latestUsers[peer].label : peer;
+    chatBtn.textContent = peerLabel(peer);
     chatBtn.style.width = "100%";
     chatBtn.style.marginBottom = "6px";
     chatBtn.onclick = () => switchToChat(peer);
@@ -206,13 +484,50 @@ function updateActiveChats() {
   }
 }
 
+function typingFrame(peer, active) {
+  return isRoom(peer) ? { type: "typing", room: peer.slice(1), active } : { type: "typing", to: peer, active };
+}
+
+function stopTyping() {
+  clearTimeout(typingIdle);
+  typingIdle = null;
+  if (typingTarget && ws && ws.readyState === 1) { try { sendFrame(typingFrame(typingTarget, false)); } catch(_) {} }
+  typingTarget = null;
+  typingSentAt = 0;
+}
+
+function noteTyping() {
+  if (!currentPeer || isChannel(currentPeer) || !ws || ws.readyState !== 1) return;
+  if (typingTarget !== currentPeer) stopTyping();
+  const now = Date.now();
+  if (now - typingSentAt > TYPING_REFRESH_MS) {
+    try { sendFrame(typingFrame(currentPeer, true)); } catch(_) {}
+    typingSentAt = now;
+    typingTarget = currentPeer;
+  }
+  clearTimeout(typingIdle);
+  typingIdle = setTimeout(stopTyping, TYPING_IDLE_MS);
+}
+
+function renderTyping() {
+  const now = Date.now();
+  const who = Object.entries(typingNow[currentPeer] || {}).filter(([_, until]) => until > now)
+    .map(([u]) => latestUsers[u] ? latestUsers[u].label : u);
+  document.getElementById("typing").textContent = who.length ? who.join(", ") + (who.length > 1 ? " are typing…" : " is typing…") : "";
+}
+
 function switchToChat(peer) {
+  if (typingTarget && typingTarget !== peer) stopTyping();
   currentPeer = peer;
-  document.getElementById("current-peer").textContent = latestUsers[peer] ? latestUsers[peer].label : peer;
+  renderTyping();
+  document.getElementById("current-peer").textContent = peerLabel(peer);
+  const leave = document.getElementById("leave-room");
+  leave.style.display = isRoom(peer) || isChannel(peer) ? "block" : "none";
+  leave.textContent = isChannel(peer) ? "Unfollow channel" : "Leave room";
   clearChatbox();
   if (!defaultPassphrase) {
     setStatus("[Waiting for encryption key from server...]");
-    try { ws && ws.send(JSON.stringify({ type: "get_passphrase" })); } catch(_) {}
+    try { ws && sendFrame({ type: "get_passphrase" }); } catch(_) {}
     return;
   }
   if (chatHistories[peer]) { decryptAndDisplayChatHistory(peer); }
@@ -271,7 +586,7 @@ async function decryptAndDisplayChatHistory(peer) {
   for (const msg of msgs) {
     const decrypted = await decrypt(key, msg);
     const mine = (msg.sender_username === username);
-    appendBubble({ from_label: msg.sender, sender_username: msg.sender_username, text: decrypted, ts: msg.timestamp, mine });
+    appendBubble({ from_label: msg.sender, sender_username: msg.sender_username, text: decrypted, ts: msg.timestamp, mine, cid: msg.cid, ack: msg.ack, showName: isRoom(peer) || isChannel(peer) });
   }
 }
 
@@ -279,7 +594,8 @@ async function decryptAndDisplayChatHistory(peer) {
 function attemptWebSocket(url, timeoutMs = 4000) {
   return new Promise((resolve, reject) => {
     let settled = false;
-    const sock = new WebSocket(url);
+    const sock = new WebSocket(url, WIRE_PROTOCOLS);
+    sock.binaryType = "arraybuffer";
     const timer = setTimeout(() => {
       if (!settled) { settled = true; try { sock.close(); } catch(_){}; reject(new Error("timeout")); }
     }, timeoutMs);
@@ -295,19 +611,35 @@ function attemptWebSocket(url, timeoutMs = 4000) {
   });
 }
 
+// a refused upgrade looks like any failed connect to the browser; ask the server why and for how long to wait
+async function admissionDelay(base) {
+  try {
+    let url = base.replace(/^ws/, "http") + "/admission?username=" + encodeURIComponent(username);
+    if (sessionToken) url += "&resume=" + encodeURIComponent(sessionToken);
+    const r = await (await fetch(url)).json();
+    if (!r.open) {
+      setStatus(r.reason === "username_taken" ? "[username in use — waiting...]" : "[server busy — waiting...]");
+      return r.retry_after * 1000 * (1 + Math.random() / 2);
+    }
+  } catch(_) {}
+  return 0;
+}
+
 async function connectWithFallback(maxAttempts = 8) {
   let base = (wsBaseUrl || "").trim();
   if (!base) { base = "wss://chat-app-4b0u.onrender.com"; }
   base = base.replace(/\/$/, "");
-  const url = base + "/ws/" + encodeURIComponent(username);
+  // batch=1: we unpack "batch" frames, so the server may coalesce bursts of frames into one
+  let url = base + "/ws/" + encodeURIComponent(username) + "?batch=1";
+  if (sessionToken) url += "&resume=" + encodeURIComponent(sessionToken) + "&cursor=" + lastEv;
 
   for (let attempt = 1; attempt <= maxAttempts; attempt++) {
     try {
       const sock = await attemptWebSocket(url);
       return sock;
     } catch (error) {
-      const delay = Math.min(500 * Math.pow(2, attempt - 1), 4000);
       setStatus(`Connecting... attempt ${attempt}/${maxAttempts}`);
+      const delay = Math.max(Math.min(500 * Math.pow(2, attempt - 1), 4000), await admissionDelay(base));
       await new Promise(r => setTimeout(r, delay));
     }
   }
@@ -317,12 +649,51 @@ async function connectWithFallback(maxAttempts = 8) {
 
 // Main init
 (async () => {
-  ws = await connectWithFallback();
-  if (!ws) return;
+  const reg = {
+    type: "register",
+    username: username,
+    anonymous: anonymous,
+    label: anonymous ? anon_label : (displayLabel || username)
+  };
 
-  ws.onmessage = async evt => {
+  const handleFrame = async evt => {
     let obj;
-    try { obj = JSON.parse(evt.data); } catch(_) { return; }
+    try { obj = decodeFrame(evt.data); } catch(_) { return; }
+    for (const ev of obj.type === "batch" ? obj.events.map(openFrame) : [obj]) {
+      await handleEvent(ev);
+      if (ev.type === "message") messageDone();
+    }
+  };
+
+  const handleEvent = async obj => {
+    if (obj.ev) lastEv = obj.ev;
+
+    if (obj.type === "session") {
+      // fresh session (first connect, or the server couldn't resume): register and flush pending sends
+      sessionToken = obj.token;
+      lastEv = obj.cursor;
+      reconnectDelay = 500;
+      try { sendFrame(reg); } catch(_) {}
+      consumed = 0;
+      grantCredit(CREDIT_WINDOW);
+      resendUnacked(true);
+      return;
+    }
+
+    if (obj.type === "resumed") {
+      reconnectDelay = 500;
+      setStatus("[reconnected]");
+      consumed = 0;
+      grantCredit(CREDIT_WINDOW);
+      resendUnacked(true);
+      return;
+    }
+
+    // the server pings quiet connections and reaps the ones that stop answering
+    if (obj.type === "ping") {
+      try { sendFrame({ type: "pong" }); } catch(_) {}
+      return;
+    }
 
     if (obj.type === "passphrase") {
       defaultPassphrase = obj.passphrase;
@@ -360,82 +731,246 @@ async function connectWithFallback(maxAttempts = 8) {
       // Rebuild active chats with latest labels and keep selection
       updateActiveChats();
       if (currentPeer) {
-        document.getElementById("current-peer").textContent = latestUsers[currentPeer] ? latestUsers[currentPeer].label : currentPeer;
+        document.getElementById("current-peer").textContent = peerLabel(currentPeer);
+      }
+    }
+
+    // throttled: the send stays unacked and is retried once retry_after has passed
+    if (obj.type === "rate_limited") {
+      const pending = unacked.get(obj.cid);
+      if (pending) pending.sentAt = Date.now() + obj.retry_after * 1000 - ACK_TIMEOUT_MS;
+      setStatus(obj.reason === "quota" ? "[daily quota used up]" : "[sending too fast — slowing down]");
+      return;
+    }
+
+    if (obj.type === "ack") {
+      // accepted: stored, the outcome is still to come (channel posts have none, so that ends them);
+      // delivered/queued/offline: done; failed: the server forgot it, so it is resent after ACK_TIMEOUT_MS
+      const pending = unacked.get(obj.cid);
+      if (pending && obj.status === "failed") pending.sentAt = Date.now();
+      else if (pending && (obj.status !== "accepted" || pending.msg.type === "publish")) unacked.delete(obj.cid);
+      const sent = sentByCid[obj.cid];
+      if (!sent) return;
+      if (obj.seq !== undefined) {
+        sent.id = obj.id;
+        sent.seq = obj.seq;
+        noteSeq(peerOf(sent), obj.seq);
       }
+      // a re-ack of a resend must not downgrade delivered back to accepted
+      if (obj.status !== "accepted" || !sent.ack) sent.ack = obj.status;
+      if (ackMarks[obj.cid]) ackMarks[obj.cid].textContent = ACK_LABELS[sent.ack] || "";
+      return;
     }
 
-    if (!obj.type || obj.type === "message") {
-      if (obj.recipient === username) {
-        if (!chatHistories[obj.sender_username]) chatHistories[obj.sender_username] = [];
-        chatHistories[obj.sender_username].push(obj);
-        if (currentPeer === obj.sender_username) {
+    if (!obj.type || obj.type === "message" || obj.type === "broadcast") {
+      // room messages carry "room" instead of "recipient", channel posts "channel"
+      const peer = obj.room !== undefined || obj.channel !== undefined || obj.recipient === username ? peerOf(obj) : null;
+      if (peer) {
+        if (!chatHistories[peer]) chatHistories[peer] = [];
+        if (obj.id !== undefined && chatHistories[peer].some(m => m.id === obj.id)) return;
+        chatHistories[peer].push(obj);
+        noteSeq(peer, obj.seq);
+        if (typingNow[peer]) { delete typingNow[peer][obj.sender_username]; renderTyping(); }
+        if (currentPeer === peer) {
           if (!defaultPassphrase) { setStatus("[Waiting for encryption key...]"); return; }
           const key = await deriveKey(defaultPassphrase);
           const decrypted = await decrypt(key, obj);
-          appendBubble({ from_label: obj.sender, sender_username: obj.sender_username, text: decrypted, ts: obj.timestamp, mine:false });
+          appendBubble({ from_label: obj.sender, sender_username: obj.sender_username, text: decrypted, ts: obj.timestamp, mine:false, showName: isRoom(peer) || isChannel(peer) });
         }
         updateActiveChats();
       }
     }
 
+    if (obj.type === "rooms" || obj.type === "room_joined") {
+      // rooms we are in, with the newest seq: fetch whatever we haven't seen
+      if (obj.type === "rooms") {
+        const names = new Set(obj.rooms.map(r => "#" + r.room));
+        for (const peer in chatHistories) { if (isRoom(peer) && !names.has(peer)) delete chatHistories[peer]; }
+      }
+      for (const r of obj.type === "rooms" ? obj.rooms : [obj]) {
+        const peer = "#" + r.room;
+        roomMembers[r.room] = r.members;
+        if (!chatHistories[peer]) chatHistories[peer] = [];
+        if (r.last_seq > (lastSeq[peer] || 0)) { try { sendFrame(historyRequest(peer, lastSeq[peer])); } catch(_) {} }
+      }
+      if (obj.type === "room_joined") switchToChat("#" + obj.room);
+      updateActiveChats();
+      return;
+    }
+
+    if (obj.type === "typing") {
+      const peer = obj.room !== undefined ? "#" + obj.room : obj.from;
+      if (!typingNow[peer]) typingNow[peer] = {};
+      if (obj.active) typingNow[peer][obj.from] = Date.now() + TYPING_SHOW_MS;
+      else delete typingNow[peer][obj.from];
+      if (peer === currentPeer) renderTyping();
+      return;
+    }
+
+    if (obj.type === "channels" || obj.type === "subscribed") {
+      // we only keep a cursor (lastSeq) per channel; page whatever is newer than it
+      if (obj.type === "channels") {
+        const names = new Set(obj.channels.map(c => "@" + c.channel));
+        for (const peer in chatHistories) { if (isChannel(peer) && !names.has(peer)) delete chatHistories[peer]; }
+      }
+      for (const c of obj.type === "channels" ? obj.channels : [obj]) {
+        const peer = "@" + c.channel;
+        channelInfo[c.channel] = { publisher: c.publisher };
+        if (!chatHistories[peer]) chatHistories[peer] = [];
+        // a subscribe with after_seq already brings what we missed
+        if (obj.type === "channels" || !lastSeq[peer]) {
+          if (c.last_seq > (lastSeq[peer] || 0)) { try { sendFrame(historyRequest(peer, lastSeq[peer])); } catch(_) {} }
+        }
+      }
+      if (obj.type === "subscribed") switchToChat("@" + obj.channel);
+      updateActiveChats();
+      return;
+    }
+
+    if (obj.type === "unsubscribed") {
+      delete channelInfo[obj.channel];
+      delete chatHistories["@" + obj.channel];
+      delete lastSeq["@" + obj.channel];
+      if (currentPeer === "@" + obj.channel) {
+        currentPeer = null;
+        clearChatbox();
+        document.getElementById("current-peer").textContent = "Select a user";
+        document.getElementById("leave-room").style.display = "none";
+      }
+      updateActiveChats();
+      return;
+    }
+
+    if (obj.type === "room_members") {
+      roomMembers[obj.room] = obj.members;
+      updateActiveChats();
+      if (currentPeer === "#" + obj.room) document.getElementById("current-peer").textContent = peerLabel(currentPeer);
+      return;
+    }
+
+    if (obj.type === "room_left") {
+      delete roomMembers[obj.room];
+      delete chatHistories["#" + obj.room];
+      delete lastSeq["#" + obj.room];
+      if (currentPeer === "#" + obj.room) {
+        currentPeer = null;
+        clearChatbox();
+        document.getElementById("current-peer").textContent = "Select a user";
+        document.getElementById("leave-room").style.display = "none";
+      }
+      updateActiveChats();
+      return;
+    }
+
     if (obj.type === "chat_history") {
       // received initial chat_history structure: { chats: { otherUser: [msgs...] } }
       if (obj.chats) {
         for (const other in obj.chats) {
-          chatHistories[other] = obj.chats[other];
+          mergeHistory(other, obj.chats[other]);
         }
       }
+      const peer = obj.room !== undefined ? "#" + obj.room : obj.channel !== undefined ? "@" + obj.channel : obj.with_user;
+      if (peer && obj.messages) {
+        const behind = obj.messages.length > 0;
+        mergeHistory(peer, obj.messages);
+        // pages are HISTORY_PAGE_SIZE long: keep paging forward until we reach last_seq
+        if (behind && !obj.more && obj.last_seq > (lastSeq[peer] || 0)) { try { sendFrame(historyRequest(peer, lastSeq[peer])); } catch(_) {} }
+        // long histories arrive in chunks; more=true on all but the last, so render once at the end
+        if (currentPeer === peer && !obj.more) { try { await decryptAndDisplayChatHistory(currentPeer); } catch(_){} }
+      }
     }
   };
 
-  const reg = {
-    type: "register",
-    username: username,
-    anonymous: anonymous,
-    label: anonymous ? anon_label : (displayLabel || username)
-  };
+  async function connect() {
+    ws = await connectWithFallback();
+    if (!ws) return;
+    ws.onmessage = handleFrame;
+    ws.onclose = () => {
+      setStatus("[connection lost — reconnecting...]");
+      setTimeout(connect, reconnectDelay);
+      reconnectDelay = Math.min(reconnectDelay * 2, 8000);
+    };
+  }
 
-  ws.onopen = () => {
-    try { ws.send(JSON.stringify(reg)); } catch(_) {}
-    try { ws.send(JSON.stringify({ type: "get_passphrase" })); } catch(_) {}
-  };
+  await connect();
+  if (!ws) return;
+
+  // resend anything the server hasn't accepted within ACK_TIMEOUT_MS (server dedups by cid)
+  setInterval(() => resendUnacked(), 1000);
+  // expire typing indicators that stopped being refreshed
+  setInterval(renderTyping, 1000);
 
   // keep requesting passphrase periodically if missing
   const _passphraseTicker = setInterval(() => {
     if (defaultPassphrase) { clearInterval(_passphraseTicker); return; }
     if (ws && ws.readyState === 1) {
-      try { ws.send(JSON.stringify({ type: "get_passphrase" })); } catch(_) {}
+      try { sendFrame({ type: "get_passphrase" }); } catch(_) {}
     }
   }, 1500);
 
   document.getElementById("send").onclick = async () => {
     if (!currentPeer) { setStatus("[select a user first]"); return; }
     if (!defaultPassphrase) { setStatus("[Waiting for encryption key from server...]"); return; }
+    if (isChannel(currentPeer) && !(channelInfo[currentPeer.slice(1)] || {}).publisher) { setStatus("[read-only channel]"); return; }
     const out = document.getElementById("out").value;
     if (!out) return;
+    if (new TextEncoder().encode(out).length > MAX_TEXT_BYTES) { setStatus("[message too long]"); return; }
+    stopTyping();
+    if (unacked.size >= UNACKED_WINDOW) { setStatus("[waiting for the server to acknowledge earlier messages]"); return; }
     const key = await deriveKey(defaultPassphrase);
-    const aadJson = JSON.stringify({ sender: username, recipient: currentPeer });
+    const target = isRoom(currentPeer) ? { room: currentPeer.slice(1) }
+      : isChannel(currentPeer) ? { channel: currentPeer.slice(1) } : { recipient: currentPeer };
+    const aadJson = JSON.stringify({ sender: username, ...target });
     const enc = await encrypt(key, out, aadJson);
     // include timestamp
     const ts = new Date().toISOString();
     const msg = {
-      type: "message",
+      type: isRoom(currentPeer) ? "room_message" : isChannel(currentPeer) ? "publish" : "message",
+      cid: newClientId(),
       sender_username: username,
-      recipient: currentPeer,
+      ...target,
       sender: displayLabel || username,
       iv: enc.iv,
       ct: enc.ct,
       aad: aadJson,
       timestamp: ts
     };
-    try { ws.send(JSON.stringify(msg)); } catch(e) { setStatus("[send failed]"); }
+    unacked.set(msg.cid, { msg, sentAt: Date.now() });
+    sentByCid[msg.cid] = msg;
+    try { sendFrame(msg); } catch(e) { setStatus("[send failed — will retry]"); }
     if (!chatHistories[currentPeer]) chatHistories[currentPeer] = [];
     chatHistories[currentPeer].push(msg);
-    appendBubble({ from_label: null, sender_username: username, text: out, ts: ts, mine:true });
+    appendBubble({ from_label: null, sender_username: username, text: out, ts: ts, mine:true, cid: msg.cid });
     document.getElementById("out").value = "";
     updateActiveChats();
   };
 
+  document.getElementById("join-room").onclick = () => {
+    const name = document.getElementById("room-name").value.trim();
+    if (!name) return;
+    try { sendFrame({ type: "join_room", room: name }); } catch(_) { setStatus("[not connected]"); }
+    document.getElementById("room-name").value = "";
+  };
+
+  document.getElementById("leave-room").onclick = () => {
+    if (!isRoom(currentPeer) && !isChannel(currentPeer)) return;
+    const frame = isRoom(currentPeer) ? { type: "leave_room", room: currentPeer.slice(1) } : { type: "unsubscribe", channel: currentPeer.slice(1) };
+    try { sendFrame(frame); } catch(_) { setStatus("[not connected]"); }
+  };
+
+  const channelAction = type => () => {
+    const name = document.getElementById("channel-name").value.trim();
+    if (!name) return;
+    const frame = { type, channel: name };
+    if (type === "subscribe" && lastSeq["@" + name]) frame.after_seq = lastSeq["@" + name];
+    try { sendFrame(frame); } catch(_) { setStatus("[not connected]"); }
+    document.getElementById("channel-name").value = "";
+  };
+  document.getElementById("follow-channel").onclick = channelAction("subscribe");
+  document.getElementById("create-channel").onclick = channelAction("create_channel");
+
+  document.getElementById("out").addEventListener("input", noteTyping);
+
   document.getElementById("out").addEventListener("keypress", e => {
     if (e.key === "Enter") {
       e.preventDefault();
@@ -0,0 +1,110 @@
+# server/admission.py
+import asyncio
+import os
+import resource
+import time
+from typing import Callable, Dict, Optional
+
+from jsonlog import log
+from timers import TimerWheel
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> int:
+    """Resident set size in bytes; where /proc is missing, the peak RSS is the best available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak if peak > 1 << 32 else peak * 1024
+
+
+class LoadShedder:
+    """
+    Decides whether there is headroom for another connection from three
+    inputs sampled every interval seconds on the timer wheel: event-loop lag
+    (how long a callback waits in the ready queue, smoothed), frames queued
+    in connection outboxes, and RSS. Over any limit it sheds; it resumes
+    admitting only once every input is back under resume_ratio of its limit,
+    so it doesn't flap at the edge. A limit of 0 disables that input.
+
+    admit() only reads the last decision, so the admission path stays O(1).
+    """
+
+    def __init__(self, timers: TimerWheel, backlog: Callable[[], int], interval: float = 0.5,
+                 max_lag: float = 0.1, max_backlog: int = 10000, max_rss: int = 0,
+                 resume_ratio: float = 0.8, smoothing: float = 0.3):
+        self.timers = timers
+        self.backlog = backlog
+        self.interval = interval
+        self.limits = {"lag": max_lag, "backlog": max_backlog, "rss": max_rss}
+        self.resume_ratio = resume_ratio
+        self.smoothing = smoothing
+        self.inputs = {"lag": 0.0, "backlog": 0, "rss": 0}
+        self.max_lag = 0.0
+        self.shedding: Optional[str] = None  # the input that is over its limit
+        self.admitted = 0
+        self.shed: Dict[str, int] = {}
+        self.transitions = 0
+        self.samples = 0
+        self._started = False
+
+    def start(self) -> None:
+        if not self._started and self.interval > 0:
+            self._started = True
+            self.timers.call_later(self.interval, self._sample)
+
+    def _sample(self) -> None:
+        loop = asyncio.get_running_loop()
+        loop.call_soon(self._measured, time.perf_counter())
+
+    def _measured(self, queued_at: float) -> None:
+        lag = time.perf_counter() - queued_at
+        self.max_lag = max(self.max_lag, lag)
+        self.inputs["lag"] += self.smoothing * (lag - self.inputs["lag"])
+        self.inputs["backlog"] = self.backlog()
+        if self.limits["rss"]:
+            self.inputs["rss"] = current_rss()
+        self.samples += 1
+        self._decide()
+        self.timers.call_later(self.interval, self._sample)
+
+    def _decide(self) -> None:
+        over = next((k for k, limit in self.limits.items() if limit and self.inputs[k] > limit), None)
+        if self.shedding is None:
+            if over is not None:
+                self.shedding = over
+                self.transitions += 1
+                log.warning("shedding", over=over, value=self.inputs[over], limit=self.limits[over])
+        elif over is None and all(not limit or self.inputs[k] <= limit * self.resume_ratio
+                                  for k, limit in self.limits.items()):
+            self.shedding = None
+            self.transitions += 1
+            log.info("admitting")
+        elif over is not None:
+            self.shedding = over
+
+    def admit(self) -> Optional[str]:
+        """None to accept, else the reason for shedding."""
+        if self.shedding is None:
+            self.admitted += 1
+            return None
+        self.shed[self.shedding] = self.shed.get(self.shedding, 0) + 1
+        return "overloaded"
+
+    def snapshot(self) -> Dict:
+        return {
+            "state": "shedding" if self.shedding else "admitting",
+            "over": self.shedding,
+            "inputs": {"loop_lag_seconds": self.inputs["lag"], "max_loop_lag_seconds": self.max_lag,
+                       "outbound_backlog": self.inputs["backlog"], "rss_bytes": self.inputs["rss"] or current_rss()},
+            "limits": {"loop_lag_seconds": self.limits["lag"], "outbound_backlog": self.limits["backlog"],
+                       "rss_bytes": self.limits["rss"]},
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "transitions": self.transitions,
+            "samples": self.samples,
+        }
@@ -35,8 +35,10 @@ class ConnectionManager:
         ws = self.active.get(user)
         if ws:
             await ws.send_text(message)
+            return True
         else:
             print(f"[server] send_personal: user {user} not connected")
+            return False
 
     async def broadcast(self, message: str, exclude_user: str = None):
         for u, ws in list(self.active.items()):
@@ -67,9 +69,10 @@ async def websocket_endpoint(websocket: WebSocket, username: str):
             if payload and isinstance(payload, dict) and payload.get("recipient"):
                 recipient = payload.get("recipient")
                 # send to recipient (if connected)
-                await manager.send_personal(recipient, data)
-                # optional: also echo to sender as ack
-                await manager.send_personal(username, data)
+                delivered = await manager.send_personal(recipient, data)
+                # compact ack instead of echoing the whole payload back
+                status = "delivered" if delivered else "offline"
+                await manager.send_personal(username, json.dumps({"type": "ack", "cid": payload.get("cid"), "status": status}))
             else:
                 # if payload invalid or no recipient, broadcast to everyone (except sender)
                 await manager.broadcast(data, exclude_user=username)
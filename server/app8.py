@@ -14,6 +14,8 @@ from typing import Dict, List
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 import uvicorn
 
+from registry import HandlerRegistry, StopConnection
+
 app = FastAPI()
 
 # username -> WebSocket
@@ -25,6 +27,8 @@ chat_history: Dict[str, List[Dict]] = {}
 
 MAX_USERS = 10
 
+# message type -> handler(ws, username, msg), with per-type count/errors/latency
+handlers = HandlerRegistry()
 
 def get_chat_key(user1: str, user2: str) -> str:
     a, b = sorted([user1, user2])
@@ -72,6 +76,130 @@ def _other_user_from_chat_key(chat_key: str, me: str):
     return None
 
 
+# registration (initial)
+@handlers.on("register")
+async def handle_register(ws: WebSocket, username: str, msg: Dict):
+    incoming_username = msg.get("username", username)
+    if incoming_username != username:
+        await ws.send_text(json.dumps({"type": "register_failed", "reason": "username_mismatch"}))
+        await ws.close()
+        raise StopConnection()
+
+    anon_flag = bool(msg.get("anonymous", False))
+    label = msg.get("label")
+    if anon_flag:
+        if not label:
+            import secrets
+            label = "Anon-" + secrets.token_hex(3)
+    else:
+        label = username
+
+    meta[username] = {"label": label, "anonymous": anon_flag}
+
+    try:
+        await ws.send_text(json.dumps({"type": "register_ok", "username": username, "label": label}))
+    except Exception:
+        pass
+
+    await broadcast_user_list()
+
+
+# update_label (runtime alias change WITHOUT reconnect)
+@handlers.on("update_label")
+async def handle_update_label(ws: WebSocket, username: str, msg: Dict):
+    # expected: {type:"update_label", label:..., anonymous:bool}
+    new_label = msg.get("label")
+    anon_flag = bool(msg.get("anonymous", False))
+    if anon_flag and not new_label:
+        import secrets
+        new_label = "Anon-" + secrets.token_hex(3)
+    if not anon_flag:
+        new_label = username
+    meta[username] = {"label": new_label, "anonymous": anon_flag}
+    # ack and broadcast
+    try:
+        await ws.send_text(json.dumps({"type": "update_ok", "label": new_label, "anonymous": anon_flag}))
+    except Exception:
+        pass
+    await broadcast_user_list()
+
+
+# chat message
+@handlers.on("message")
+async def handle_message(ws: WebSocket, username: str, msg: Dict):
+    sender_username = msg.get("sender_username") or username
+    recipient = msg.get("recipient")
+    if not recipient or not isinstance(recipient, str):
+        try:
+            await ws.send_text(json.dumps({"type": "error", "reason": "invalid_recipient"}))
+        except Exception:
+            pass
+        return
+
+    # store history (stable usernames only)
+    try:
+        chat_key = get_chat_key(sender_username, recipient)
+        entry = {
+            "sender_username": sender_username,
+            "recipient": recipient,
+            "iv": msg.get("iv"),
+            "ct": msg.get("ct"),
+            "aad": msg.get("aad"),
+            "timestamp": msg.get("timestamp")
+        }
+        chat_history.setdefault(chat_key, []).append(entry)
+        if len(chat_history[chat_key]) > 100:
+            chat_history[chat_key] = chat_history[chat_key][-100:]
+    except Exception as e:
+        print(f"[server] error storing message: {e}")
+
+    # forward enriched with current label
+    forwarded = {
+        "type": "message",
+        "sender_username": sender_username,
+        "sender": meta.get(sender_username, {}).get("label", sender_username),
+        "recipient": recipient,
+        "iv": msg.get("iv"),
+        "ct": msg.get("ct"),
+        "aad": msg.get("aad"),
+        "timestamp": msg.get("timestamp")
+    }
+
+    if recipient in connections:
+        try:
+            await connections[recipient].send_text(json.dumps(forwarded))
+        except Exception as e:
+            print(f"[server] forward error to {recipient}: {e}")
+            try:
+                await ws.send_text(json.dumps({"type": "error", "reason": "delivery_failed", "recipient": recipient}))
+            except Exception:
+                pass
+    else:
+        try:
+            await ws.send_text(json.dumps({"type": "error", "reason": "recipient_offline", "recipient": recipient}))
+        except Exception:
+            pass
+
+
+# request chat history for a specific user
+@handlers.on("get_chat_history")
+async def handle_get_chat_history(ws: WebSocket, username: str, msg: Dict):
+    other_user = msg.get("with_user")
+    if other_user and isinstance(other_user, str):
+        chat_key = get_chat_key(username, other_user)
+        history = chat_history.get(chat_key, [])
+        enriched = []
+        for m in history[-20:]:
+            enriched.append({
+                **m,
+                "sender": meta.get(m["sender_username"], {}).get("label", m["sender_username"])
+            })
+        try:
+            await ws.send_text(json.dumps({"type": "chat_history", "with_user": other_user, "messages": enriched}))
+        except Exception:
+            pass
+
+
 @app.websocket("/ws/{username}")
 async def ws_endpoint(ws: WebSocket, username: str):
     await ws.accept()
@@ -131,129 +259,11 @@ async def ws_endpoint(ws: WebSocket, username: str):
                 continue
 
             mtype = msg.get("type")
-
-            # registration (initial)
-            if mtype == "register":
-                incoming_username = msg.get("username", username)
-                if incoming_username != username:
-                    await ws.send_text(json.dumps({"type": "register_failed", "reason": "username_mismatch"}))
-                    await ws.close()
-                    return
-
-                anon_flag = bool(msg.get("anonymous", False))
-                label = msg.get("label")
-                if anon_flag:
-                    if not label:
-                        import secrets
-                        label = "Anon-" + secrets.token_hex(3)
-                else:
-                    label = username
-
-                meta[username] = {"label": label, "anonymous": anon_flag}
-
-                try:
-                    await ws.send_text(json.dumps({"type": "register_ok", "username": username, "label": label}))
-                except Exception:
-                    pass
-
-                await broadcast_user_list()
-                continue
-
-            # update_label (runtime alias change WITHOUT reconnect)
-            if mtype == "update_label":
-                # expected: {type:"update_label", label:..., anonymous:bool}
-                new_label = msg.get("label")
-                anon_flag = bool(msg.get("anonymous", False))
-                if anon_flag and not new_label:
-                    import secrets
-                    new_label = "Anon-" + secrets.token_hex(3)
-                if not anon_flag:
-                    new_label = username
-                meta[username] = {"label": new_label, "anonymous": anon_flag}
-                # ack and broadcast
-                try:
-                    await ws.send_text(json.dumps({"type": "update_ok", "label": new_label, "anonymous": anon_flag}))
-                except Exception:
-                    pass
-                await broadcast_user_list()
-                continue
-
-            # chat message
-            if mtype == "message":
-                sender_username = msg.get("sender_username") or username
-                recipient = msg.get("recipient")
-                if not recipient or not isinstance(recipient, str):
-                    try:
-                        await ws.send_text(json.dumps({"type": "error", "reason": "invalid_recipient"}))
-                    except Exception:
-                        pass
-                    continue
-
-                # store history (stable usernames only)
-                try:
-                    chat_key = get_chat_key(sender_username, recipient)
-                    entry = {
-                        "sender_username": sender_username,
-                        "recipient": recipient,
-                        "iv": msg.get("iv"),
-                        "ct": msg.get("ct"),
-                        "aad": msg.get("aad"),
-                        "timestamp": msg.get("timestamp")
-                    }
-                    chat_history.setdefault(chat_key, []).append(entry)
-                    if len(chat_history[chat_key]) > 100:
-                        chat_history[chat_key] = chat_history[chat_key][-100:]
-                except Exception as e:
-                    print(f"[server] error storing message: {e}")
-
-                # forward enriched with current label
-                forwarded = {
-                    "type": "message",
-                    "sender_username": sender_username,
-                    "sender": meta.get(sender_username, {}).get("label", sender_username),
-                    "recipient": recipient,
-                    "iv": msg.get("iv"),
-                    "ct": msg.get("ct"),
-                    "aad": msg.get("aad"),
-                    "timestamp": msg.get("timestamp")
-                }
-
-                if recipient in connections:
-                    try:
-                        await connections[recipient].send_text(json.dumps(forwarded))
-                    except Exception as e:
-                        print(f"[server] forward error to {recipient}: {e}")
-                        try:
-                            await ws.send_text(json.dumps({"type": "error", "reason": "delivery_failed", "recipient": recipient}))
-                        except Exception:
-                            pass
-                else:
-                    try:
-                        await ws.send_text(json.dumps({"type": "error", "reason": "recipient_offline", "recipient": recipient}))
-                    except Exception:
-                        pass
-                continue
-
-            # request chat history for a specific user
-            if mtype == "get_chat_history":
-                other_user = msg.get("with_user")
-                if other_user and isinstance(other_user, str):
-                    chat_key = get_chat_key(username, other_user)
-                    history = chat_history.get(chat_key, [])
-                    enriched = []
-                    for m in history[-20:]:
-                        enriched.append({
-                            **m,
-                            "sender": meta.get(m["sender_username"], {}).get("label", m["sender_username"])
-                        })
-                    try:
-                        await ws.send_text(json.dumps({"type": "chat_history", "with_user": other_user, "messages": enriched}))
-                    except Exception:
-                        pass
-                continue
-
             # unknown types are ignored
+            await handlers.dispatch(mtype, ws, username, msg)
 
+    except StopConnection:
+        return
     except WebSocketDisconnect:
         print(f"[server] {username} disconnected")
         connections.pop(username, None)
@@ -272,6 +282,11 @@ async def ws_endpoint(ws: WebSocket, username: str):
         await broadcast_user_list()
 
 
+@app.get("/stats/handlers")
+async def handler_stats():
+    return handlers.snapshot()
+
+
 if __name__ == "__main__":
     SSL_CERT = "certs/server.crt"
     SSL_KEY = "certs/server.key"
@@ -0,0 +1,127 @@
+# server/channels.py
+import time
+from typing import Dict, List, Optional, Set
+
+from metrics import Histogram
+from rooms import Room
+
+# Subscriber counts that publish latency is reported by
+FANOUT_SIZES = (10, 100, 1000, 10000)
+
+
+class Channel(Room):
+    """
+    One-to-many broadcast: a few publishers, any number of read-only
+    subscribers (members). Posts are not recorded per subscriber; a
+    subscriber only remembers the last seq it saw and pages the shared
+    history for anything it missed.
+    """
+
+    __slots__ = ("owner", "publishers")
+
+    def __init__(self, name: str, epoch: int, owner: str):
+        super().__init__(name, epoch)
+        # with Redis, a channel created on another instance is followed here with a copy that carries
+        # the owner registered there
+        self.owner = owner
+        self.publishers: Set[str] = {owner}
+
+
+class FanoutStats:
+    __slots__ = ("publishes", "deliveries", "lagged", "latency")
+
+    def __init__(self):
+        self.publishes = 0
+        self.deliveries = 0  # frames queued to subscriber connections
+        self.lagged = 0      # skipped because the subscriber's queue was too deep; it catches up by seq
+        # publish -> frame written to the last subscriber, by subscriber count
+        self.latency: Dict[str, Histogram] = {self.bucket(n): Histogram() for n in FANOUT_SIZES + (FANOUT_SIZES[-1] + 1,)}
+
+    @staticmethod
+    def bucket(subscribers: int) -> str:
+        for size in FANOUT_SIZES:
+            if subscribers <= size:
+                return f"<={size}"
+        return f">{FANOUT_SIZES[-1]}"
+
+    def snapshot(self) -> Dict:
+        return {
+            "publishes": self.publishes,
+            "deliveries": self.deliveries,
+            "lagged": self.lagged,
+            "publish_to_last_delivery_seconds": {k: h.snapshot() for k, h in self.latency.items()},
+        }
+
+
+class FanoutTimer:
+    """Passed as on_sent for every copy of one publish; the last write records the latency."""
+
+    __slots__ = ("stats", "started", "pending", "bucket")
+
+    def __init__(self, stats: FanoutStats):
+        self.stats = stats
+        self.started = time.perf_counter()
+        self.pending = 0
+        self.bucket = None
+
+    def queued(self, n: int) -> None:
+        # called once every copy is queued; none can have been written yet
+        self.pending = n
+        self.bucket = self.stats.bucket(n)
+
+    def __call__(self) -> None:
+        self.pending -= 1
+        if self.pending == 0:
+            self.stats.latency[self.bucket].observe(time.perf_counter() - self.started)
+
+
+class ChannelStore:
+    def __init__(self, max_subscribers: int, history_size: int):
+        self.max_subscribers = max_subscribers
+        self.history_size = history_size
+        self.channels: Dict[str, Channel] = {}
+        self._by_user: Dict[str, Set[str]] = {}
+        self._epochs = 0
+
+    def get(self, name: str) -> Optional[Channel]:
+        return self.channels.get(name)
+
+    def create(self, name: str, owner: str) -> Channel:
+        channel = self.channels.get(name)
+        if channel is not None:
+            # followed copies included: ownership is never taken over locally
+            if channel.owner != owner:
+                raise ValueError("channel_exists")
+            return channel
+        self._epochs += 1
+        channel = self.channels[name] = Channel(name, self._epochs, owner)
+        return channel
+
+    def subscribe(self, name: str, username: str, remote_owner: Optional[str] = None) -> Channel:
+        """remote_owner: owner of a channel created on another instance, for a name unknown here; it is followed with a local copy."""
+        channel = self.channels.get(name)
+        if channel is None:
+            if remote_owner is None:
+                raise ValueError("unknown_channel")
+            channel = self.create(name, remote_owner)
+        if username not in channel.members:
+            if len(channel.members) >= self.max_subscribers:
+                raise ValueError("channel_full")
+            channel.members.add(username)
+            self._by_user.setdefault(username, set()).add(name)
+        return channel
+
+    def unsubscribe(self, name: str, username: str) -> Optional[Channel]:
+        channel = self.channels.get(name)
+        if channel is None or username not in channel.members:
+            return None
+        channel.members.discard(username)
+        names = self._by_user.get(username)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self._by_user[username]
+        return channel
+
+    def of(self, username: str) -> List[Channel]:
+        return [self.channels[name] for name in sorted(self._by_user.get(username, ()))]
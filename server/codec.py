@@ -0,0 +1,415 @@
+# server/codec.py
+import base64
+import binascii
+import json
+import math
+import os
+import re
+import secrets
+from typing import Callable, Container, Dict, List, Optional, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:  # binary framing is optional; JSON always works
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# Ciphertext fields travel as raw bytes inside the server and on binary connections;
+# JSON connections carry them base64-encoded.
+BINARY_FIELDS = ("iv", "ct")
+
+Frame = Union[str, bytes]
+
+
+class CodecError(ValueError):
+    pass
+
+
+class RawPayload:
+    """
+    The encrypted part of a message envelope, kept exactly as the sender's
+    codec produced it. Encoding a frame that contains one splices these bytes
+    in verbatim; they are only decoded and re-encoded (once per codec, then
+    cached) when the recipient speaks the other wire format.
+    """
+
+    __slots__ = ("codec", "data", "_transcoded")
+
+    def __init__(self, codec, data: Frame):
+        self.codec = codec
+        self.data = data
+        self._transcoded = None
+
+    def encoded_for(self, codec) -> Frame:
+        if codec is self.codec:
+            return self.data
+        if self._transcoded is None:
+            self._transcoded = {}
+        data = self._transcoded.get(codec.name)
+        if data is None:
+            # check_payload() let it in, so it decodes and fits the other format
+            data = codec.encode(self.codec.decode_payload(self.data))
+            self._transcoded[codec.name] = data
+        return data
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+_SCALARS = (str, bytes, int, float, bool, type(None))
+
+
+def check_payload(obj) -> None:
+    """
+    An envelope payload must be exactly one flat map of scalars: it is spliced
+    verbatim into frames (and stored history) other clients parse, and may be
+    transcoded to the other wire format.
+    """
+    if type(obj) is not dict:
+        raise CodecError("malformed_payload")
+    for key, value in obj.items():
+        if type(key) is not str or not isinstance(value, _SCALARS) or not _encodable(key):
+            raise CodecError("malformed_payload")
+        kind = type(value)
+        # the stdlib JSON parser accepts all of these, but JSON.parse or MessagePack can't carry them
+        if ((kind is float and not math.isfinite(value)) or (kind is int and not -2 ** 63 <= value < 2 ** 64)
+                or (kind is str and not _encodable(value))):
+            raise CodecError("malformed_payload")
+
+
+def _encodable(text: str) -> bool:
+    # lone surrogates ("\ud800") decode from JSON but can't be written as UTF-8
+    if text.isascii():
+        return True
+    try:
+        text.encode("utf-8")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def wire_size(data: Frame) -> int:
+    """Bytes a frame took on the wire; len() of a text frame counts characters."""
+    if isinstance(data, str):
+        # isascii() reads a flag CPython keeps on the string, so ASCII text is never copied
+        return len(data) if data.isascii() else len(data.encode("utf-8", "surrogatepass"))
+    return len(data)
+
+
+# "type" as the first key of a flat frame, read without parsing the rest of it
+_JSON_LEADING_TYPE = re.compile(r'\s*\{\s*"type"\s*:\s*"(\w{1,32})"')
+
+
+def _is_one_of(mtype, types: Container[str]) -> bool:
+    return type(mtype) is str and mtype in types
+
+
+def _msgpack_leading_type(data: bytes) -> Optional[str]:
+    first = data[0] if data else 0
+    skip = 1 if 0x80 <= first <= 0x8f else 3 if first == 0xde else 5 if first == 0xdf else 0
+    if not skip or data[skip:skip + 5] != b"\xa4type" or len(data) <= skip + 5:
+        return None
+    size = data[skip + 5] - 0xa0  # fixstr
+    if not 0 <= size < 32:
+        return None
+    try:
+        return bytes(data[skip + 6:skip + 6 + size]).decode("ascii")
+    except UnicodeDecodeError:
+        return None
+
+
+# Stand-in emitted for each RawPayload while encoding, then replaced by the payload bytes.
+# Random per process so no client-supplied string can collide with it.
+RAW_MARK = "raw-" + secrets.token_hex(16)
+
+
+def _b64_default(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(value).decode("ascii")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _raw_collector(raws: List, fallback=None):
+    # serializers call default() in document order, so the marks line up with raws
+    def default(value):
+        if isinstance(value, RawPayload):
+            raws.append(value)
+            return RAW_MARK
+        if fallback is None:
+            raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+        return fallback(value)
+    return default
+
+
+def _splice(encoded, mark, raws: List, codec):
+    if len(raws) == 1:
+        # the common case: one message frame
+        head, found, tail = encoded.partition(mark)
+        if not found or mark in tail:
+            raise CodecError("raw_payload_mismatch")
+        return encoded[:0].join((head, raws[0].encoded_for(codec), tail))
+    parts = encoded.split(mark)
+    if len(parts) != len(raws) + 1:
+        raise CodecError("raw_payload_mismatch")
+    out = [parts[0]]
+    for raw, part in zip(raws, parts[1:]):
+        out.append(raw.encoded_for(codec))
+        out.append(part)
+    return encoded[:0].join(out)
+
+
+def _stdlib_backend() -> Tuple[Callable, Callable]:
+    def dumps(obj, default=_b64_default) -> str:
+        return json.dumps(obj, default=default, separators=(",", ":"))
+    return dumps, json.loads
+
+
+def _orjson_backend() -> Tuple[Callable, Callable]:
+    def dumps(obj, default=_b64_default) -> str:
+        return orjson.dumps(obj, default=default).decode("utf-8")
+    return dumps, orjson.loads
+
+
+def _msgspec_backend() -> Tuple[Callable, Callable]:
+    # msgspec writes bytes as base64 on its own
+    encoder = msgspec.json.Encoder()
+    decoder = msgspec.json.Decoder()
+
+    def dumps(obj, default=None) -> str:
+        if default is None:
+            return encoder.encode(obj).decode("utf-8")
+        return msgspec.json.encode(obj, enc_hook=default).decode("utf-8")
+    return dumps, decoder.decode
+
+
+# Fastest first; JSON_BACKEND=orjson|msgspec|stdlib pins one
+JSON_BACKENDS = {
+    "orjson": (orjson, _orjson_backend),
+    "msgspec": (msgspec, _msgspec_backend),
+    "stdlib": (json, _stdlib_backend),
+}
+
+
+def available_json_backends() -> List[str]:
+    return [name for name, (module, _) in JSON_BACKENDS.items() if module is not None]
+
+
+class JsonCodec:
+    name = "json"
+    subprotocol = "chat.json.v1"
+    binary = False
+
+    def __init__(self, backend: str = "auto"):
+        available = available_json_backends()
+        if backend not in available:
+            backend = available[0]
+        self.backend = backend
+        self._dumps, self._loads = JSON_BACKENDS[backend][1]()
+
+    def encode(self, obj) -> str:
+        raws: List[RawPayload] = []
+        default = _raw_collector(raws, None if self.backend == "msgspec" else _b64_default)
+        text = self._dumps(obj, default)
+        return _splice(text, '"%s"' % RAW_MARK, raws, self) if raws else text
+
+    def encode_batch(self, frames: List[str]) -> str:
+        """{"type":"batch","events":[...]} built from frames that are already encoded."""
+        return '{"type":"batch","events":[' + ",".join(frames) + "]}"
+
+    def append_field(self, encoded: str, key: str, value) -> str:
+        """Add one key to an already encoded object (it ends up last) without re-encoding the rest."""
+        field = self._dumps(key) + ":" + self._dumps(value)
+        return "".join((encoded[:-1], "," if len(encoded) > 2 else "", field, "}"))
+
+    def decode_envelope(self, data: Frame, max_header: int = None,
+                        message_types: Container[str] = None) -> Tuple[Dict, Optional[RawPayload]]:
+        """
+        A message envelope is two lines: the routing header, then the payload
+        object, which is kept as text (parsed once here to check it, then
+        discarded). A single line is a plain frame.
+
+        With max_header, nothing longer is parsed as a header, except a plain
+        frame whose leading "type" is one of message_types (a flat message).
+        With message_types, an envelope of any other type is refused before
+        its payload is parsed.
+        """
+        if isinstance(data, bytes):
+            try:
+                data = data.decode("utf-8")
+            except UnicodeDecodeError as e:
+                raise CodecError("malformed_json") from e
+        header, newline, payload = data.partition("\n")
+        if max_header is not None and wire_size(header) > max_header:
+            leading = None if newline else _JSON_LEADING_TYPE.match(header)
+            if leading is None or message_types is None or leading.group(1) not in message_types:
+                raise CodecError("oversized_frame")
+        if not newline:
+            return self.decode(data), None
+        header = self.decode(header)
+        if message_types is not None and not _is_one_of(header.get("type"), message_types):
+            raise CodecError("unexpected_payload")
+        payload = payload.strip()
+        # one parse, for the shape only: iv/ct stay base64 text until a MessagePack recipient needs them
+        try:
+            obj = self._loads(payload)
+        except Exception as e:
+            raise CodecError("malformed_payload") from e
+        check_payload(obj)
+        return header, RawPayload(self, payload)
+
+    def decode_payload(self, data: str) -> Dict:
+        """A checked envelope payload, for transcoding; iv/ct that aren't base64 are passed on as text."""
+        obj = self._loads(data)
+        for field in BINARY_FIELDS:
+            value = obj.get(field)
+            if isinstance(value, str):
+                try:
+                    obj[field] = base64.b64decode(value, validate=True)
+                except (binascii.Error, ValueError):
+                    pass  # the recipient can't decrypt this one message, but its frame stays well-formed
+        return obj
+
+    def decode(self, data: Frame) -> Dict:
+        try:
+            obj = self._loads(data)
+        except Exception as e:
+            raise CodecError("malformed_json") from e
+        if not isinstance(obj, dict):
+            raise CodecError("malformed_json")
+        for field in BINARY_FIELDS:
+            value = obj.get(field)
+            if isinstance(value, str):
+                try:
+                    obj[field] = base64.b64decode(value, validate=True)
+                except (binascii.Error, ValueError) as e:
+                    raise CodecError("malformed_base64") from e
+        return obj
+
+
+class MsgpackCodec:
+    name = "msgpack"
+    subprotocol = "chat.msgpack.v1"
+    binary = True
+
+    def __init__(self):
+        self._mark = msgpack.packb(RAW_MARK, use_bin_type=True)
+        # one long-lived Packer; building one per call (as packb does) costs more than packing a small frame
+        self._raws: List[RawPayload] = []
+        self._packer = msgpack.Packer(use_bin_type=True, default=_raw_collector(self._raws))
+        self._batch_prefix = self._packer.pack_map_header(2) + b"".join(
+            msgpack.packb(v, use_bin_type=True) for v in ("type", "batch", "events"))
+
+    def encode(self, obj) -> bytes:
+        raws = self._raws
+        try:
+            data = self._packer.pack(obj)
+        except Exception:
+            self._packer.reset()
+            raws.clear()
+            raise
+        if not raws:
+            return data
+        # detach before splicing: transcoding a payload re-enters encode()
+        seen = raws.copy()
+        raws.clear()
+        return _splice(data, self._mark, seen, self)
+
+    def encode_batch(self, frames: List[bytes]) -> bytes:
+        """{"type":"batch","events":[...]} built from frames that are already encoded."""
+        return b"".join([self._batch_prefix, self._packer.pack_array_header(len(frames)), *frames])
+
+    def append_field(self, encoded: bytes, key: str, value) -> bytes:
+        """Add one key to an already encoded map (it ends up last) without re-encoding the rest."""
+        first = encoded[0]
+        if 0x80 <= first <= 0x8f:
+            size, skip = first & 0x0f, 1
+        elif first == 0xde:
+            size, skip = int.from_bytes(encoded[1:3], "big"), 3
+        elif first == 0xdf:
+            size, skip = int.from_bytes(encoded[1:5], "big"), 5
+        else:
+            raise CodecError("not_a_map")
+        packer = self._packer
+        return b"".join((packer.pack_map_header(size + 1), memoryview(encoded)[skip:], packer.pack(key), packer.pack(value)))
+
+    def decode_envelope(self, data: Frame, max_header: int = None,
+                        message_types: Container[str] = None) -> Tuple[Dict, Optional[RawPayload]]:
+        """
+        A message envelope is the header map followed by the payload map in
+        the same binary frame. max_header and message_types bound the header
+        and the payload types as for JSON.
+        """
+        if isinstance(data, str):
+            raise CodecError("expected_binary")
+        if max_header is not None and len(data) > max_header:
+            # only the first max_header bytes are handed to the unpacker, so a long header is never parsed
+            unpacker = msgpack.Unpacker(raw=False)
+            unpacker.feed(data[:max_header])
+            try:
+                header = unpacker.unpack()
+            except msgpack.OutOfData:
+                if message_types is None or _msgpack_leading_type(data) not in message_types:
+                    raise CodecError("oversized_frame") from None
+                return self.decode(data), None
+            except Exception as e:
+                raise CodecError("malformed_msgpack") from e
+            payload = data[unpacker.tell():]
+        else:
+            try:
+                header, payload = msgpack.unpackb(data, raw=False), None
+            except msgpack.ExtraData as extra:
+                # unpackb stops after the first object and hands back the rest undecoded
+                header, payload = extra.unpacked, extra.extra
+            except Exception as e:
+                raise CodecError("malformed_msgpack") from e
+        if not isinstance(header, dict):
+            raise CodecError("malformed_msgpack")
+        if payload is None:
+            return header, None
+        if message_types is not None and not _is_one_of(header.get("type"), message_types):
+            raise CodecError("unexpected_payload")
+        # exactly one well-formed map; the decoded copy is only checked, then discarded
+        try:
+            check_payload(self.decode(payload))
+        except CodecError as e:
+            raise CodecError("malformed_payload") from e
+        return header, RawPayload(self, payload)
+
+    def decode_payload(self, data: bytes) -> Dict:
+        """A checked envelope payload, for transcoding."""
+        return msgpack.unpackb(data, raw=False)
+
+    def decode(self, data: Frame) -> Dict:
+        if isinstance(data, str):
+            raise CodecError("expected_binary")
+        try:
+            obj = msgpack.unpackb(data, raw=False)
+        except Exception as e:
+            raise CodecError("malformed_msgpack") from e
+        if not isinstance(obj, dict):
+            raise CodecError("malformed_msgpack")
+        return obj
+
+
+JSON = JsonCodec(os.getenv("JSON_BACKEND", "auto"))
+MSGPACK = MsgpackCodec() if msgpack is not None else None
+
+# Server preference order when a client offers several
+CODECS: List = [c for c in (MSGPACK, JSON) if c is not None]
+
+
+def negotiate(offered: List[str]) -> Optional[object]:
+    """Pick the codec for a connection from its Sec-WebSocket-Protocol offer (None = no offer, plain JSON)."""
+    for codec in CODECS:
+        if codec.subprotocol in offered:
+            return codec
+    return None
@@ -0,0 +1,72 @@
+# server/dedup.py
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class DedupWindow:
+    """
+    Remembers recently seen (sender, client message ID) pairs so resends can
+    be answered with the original ack instead of being stored again.
+
+    Memory is fixed: at most max_senders senders, each holding at most
+    max_per_sender IDs, both evicted least-recently-used first. Entries older
+    than window_seconds are treated as unseen.
+    """
+
+    def __init__(self, window_seconds: float = 300.0, max_per_sender: int = 256, max_senders: int = 1024):
+        self.window_seconds = window_seconds
+        self.max_per_sender = max_per_sender
+        self.max_senders = max_senders
+        self._senders: "OrderedDict[str, OrderedDict[str, tuple]]" = OrderedDict()
+        self.hits = 0
+
+    def get(self, sender: str, client_id: str) -> Optional[Dict]:
+        seen = self._senders.get(sender)
+        if seen is None:
+            return None
+        item = seen.get(client_id)
+        if item is None:
+            return None
+        stored_at, ack = item
+        if time.monotonic() - stored_at > self.window_seconds:
+            del seen[client_id]
+            return None
+        self.hits += 1
+        return ack
+
+    def remember(self, sender: str, client_id: str, ack: Dict) -> None:
+        seen = self._senders.get(sender)
+        if seen is None:
+            seen = OrderedDict()
+            self._senders[sender] = seen
+            if len(self._senders) > self.max_senders:
+                self._senders.popitem(last=False)
+        else:
+            self._senders.move_to_end(sender)
+        seen[client_id] = (time.monotonic(), ack)
+        seen.move_to_end(client_id)
+        # expire from the old end first, then enforce the size cap
+        now = time.monotonic()
+        while seen:
+            oldest_at, _ = next(iter(seen.values()))
+            if now - oldest_at <= self.window_seconds and len(seen) <= self.max_per_sender:
+                break
+            seen.popitem(last=False)
+
+    def update(self, sender: str, client_id: str, **fields) -> None:
+        """Change the ack a remembered ID is answered with (e.g. to its final status); not a hit."""
+        seen = self._senders.get(sender)
+        item = seen.get(client_id) if seen is not None else None
+        if item is not None:
+            stored_at, ack = item
+            seen[client_id] = (stored_at, {**ack, **fields})
+
+    def forget(self, sender: str, client_id: str) -> None:
+        """Treat the ID as unseen again, so its next resend is taken as new."""
+        seen = self._senders.get(sender)
+        if seen is not None:
+            seen.pop(client_id, None)
+
+    def __len__(self) -> int:
+        return sum(len(seen) for seen in self._senders.values())
@@ -0,0 +1,86 @@
+# server/ephemeral.py
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable
+
+from timers import TimerWheel
+
+
+class EphemeralStats:
+    __slots__ = ("received", "sent", "coalesced", "dropped")
+
+    def __init__(self):
+        self.received = 0
+        self.sent = 0       # frames queued to recipients (a room typing event counts once per member)
+        self.coalesced = 0  # events folded into a later one for the same (sender, peer)
+        self.dropped = 0    # recipient backlogged or unreachable
+
+    def snapshot(self) -> Dict:
+        return {"received": self.received, "sent": self.sent, "coalesced": self.coalesced, "dropped": self.dropped}
+
+
+class _Slot:
+    __slots__ = ("sent_at", "state", "pending", "handle")
+
+    def __init__(self):
+        self.sent_at = 0.0
+        self.state = None
+        self.pending = None
+        self.handle = None
+
+
+class Coalescer:
+    """
+    Lets through at most one event per key per interval. Events arriving
+    inside the interval only replace a pending state, which is emitted when
+    the interval ends unless it equals what was last emitted, so a burst of
+    keystrokes costs one frame but a final "stopped" is never lost. At most
+    max_keys keys are tracked; the least recently used is forgotten.
+    """
+
+    def __init__(self, interval: float, emit: Callable[[Hashable, object], None], stats: EphemeralStats,
+                 timers: TimerWheel, max_keys: int = 10000):
+        self.interval = interval
+        self.timers = timers
+        self.emit = emit
+        self.stats = stats
+        self.max_keys = max_keys
+        self._slots: "OrderedDict[Hashable, _Slot]" = OrderedDict()
+
+    def offer(self, key: Hashable, state) -> None:
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _Slot()
+            if len(self._slots) > self.max_keys:
+                _, old = self._slots.popitem(last=False)
+                if old.handle is not None:
+                    old.handle.cancel()
+        else:
+            self._slots.move_to_end(key)
+        wait = slot.sent_at + self.interval - time.monotonic()
+        if wait <= 0 and slot.handle is None:
+            self._emit(key, slot, state)
+            return
+        if slot.pending is not None:
+            self.stats.coalesced += 1
+        slot.pending = state
+        if slot.handle is None:
+            slot.handle = self.timers.call_later(max(wait, 0), self._flush, key, slot)
+
+    def _flush(self, key, slot: _Slot) -> None:
+        slot.handle = None
+        state, slot.pending = slot.pending, None
+        if state is None:
+            return
+        if state == slot.state:
+            self.stats.coalesced += 1
+            return
+        self._emit(key, slot, state)
+
+    def _emit(self, key, slot: _Slot, state) -> None:
+        slot.sent_at = time.monotonic()
+        slot.state = state
+        self.emit(key, state)
+
+    def __len__(self) -> int:
+        return len(self._slots)
@@ -0,0 +1,49 @@
+# server/framecache.py
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Tuple
+
+
+class FrameCache:
+    """
+    Encoded frames for state that changes far less often than it is sent.
+    Each entry is stored under (key, codec) together with the version of the
+    state it was built from; a lookup with the same version returns the very
+    same str/bytes object, a newer version rebuilds it. build() may return a
+    list of frames, cached and returned as a list of encodings. Keys are
+    tuples whose first element names the kind of frame, which is what hit
+    rates are reported by. Least recently used entries are evicted past
+    max_entries.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[Hashable, object]]" = OrderedDict()
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+    def get(self, key: Tuple, version: Hashable, codec, build: Callable[[], Dict]):
+        slot = (key, codec.name)
+        entry = self._entries.get(slot)
+        kind = key[0]
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(slot)
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+            return entry[1]
+        self.misses[kind] = self.misses.get(kind, 0) + 1
+        frame = build()
+        data = [codec.encode(f) for f in frame] if isinstance(frame, list) else codec.encode(frame)
+        self._entries[slot] = (version, data)
+        self._entries.move_to_end(slot)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return data
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def snapshot(self) -> Dict:
+        stats = {}
+        for kind in sorted(set(self.hits) | set(self.misses)):
+            hits, misses = self.hits.get(kind, 0), self.misses.get(kind, 0)
+            stats[kind] = {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses)}
+        return {"entries": len(self._entries), "kinds": stats}
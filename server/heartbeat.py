@@ -0,0 +1,103 @@
+# server/heartbeat.py
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from jsonlog import log
+from timers import TimerWheel
+
+
+class HeartbeatStats:
+    __slots__ = ("ticks", "pings", "zombies_reaped", "reap_batches", "last_tick_seconds")
+
+    def __init__(self):
+        self.ticks = 0
+        self.pings = 0
+        self.zombies_reaped = 0  # connection slots recovered from clients that went silent
+        self.reap_batches = 0
+        self.last_tick_seconds = 0.0
+
+    def snapshot(self) -> Dict:
+        return {
+            "ticks": self.ticks,
+            "pings": self.pings,
+            "zombies_reaped": self.zombies_reaped,
+            "reap_batches": self.reap_batches,
+            "last_tick_seconds": self.last_tick_seconds,
+        }
+
+
+class Heartbeat:
+    """
+    One sweep for every connection's liveness, instead of a ping task per
+    socket, scheduled every interval on the shared timer wheel. Each sweep it walks the connections once: a connection that has
+    been quiet for interval seconds is pinged, one that has been quiet for
+    timeout seconds (it ignored at least one ping) is a zombie. Zombies are
+    handed to reap() at most batch at a time.
+
+    Connections are objects with a last_seen monotonic timestamp in
+    ws.state, which the receive loop refreshes on every frame.
+    """
+
+    def __init__(self, interval: float, timeout: float, batch: int, connections: Dict,
+                 ping: Callable[[object], None], reap: Callable[[List[Tuple[str, object]]], Awaitable[None]],
+                 timers: TimerWheel):
+        self.interval = interval
+        self.timeout = max(timeout, interval)
+        self.batch = batch
+        self.connections = connections
+        self.ping = ping
+        self.reap = reap
+        self.timers = timers
+        self.stats = HeartbeatStats()
+        self._started = False
+
+    def start(self) -> None:
+        if not self._started and self.interval > 0:
+            self._started = True
+            self.timers.call_later(self.interval, self._due)
+
+    def zombies(self, now: float) -> List[Tuple[str, object]]:
+        return [(u, ws) for u, ws in list(self.connections.items()) if now - ws.state.last_seen >= self.timeout]
+
+    async def reap_now(self) -> int:
+        """Reap whatever is already past the timeout (e.g. before refusing a new connection)."""
+        zombies = self.zombies(time.monotonic())
+        for i in range(0, len(zombies), self.batch):
+            await self._reap(zombies[i:i + self.batch])
+        return len(zombies)
+
+    async def _reap(self, zombies):
+        self.stats.zombies_reaped += len(zombies)
+        self.stats.reap_batches += 1
+        await self.reap(zombies)
+
+    async def tick(self) -> None:
+        started = time.monotonic()
+        zombies = []
+        for username, ws in list(self.connections.items()):
+            idle = started - ws.state.last_seen
+            if idle >= self.timeout:
+                zombies.append((username, ws))
+            elif idle >= self.interval:
+                try:
+                    self.ping(ws)
+                    self.stats.pings += 1
+                except Exception:
+                    zombies.append((username, ws))
+        # the rest wait for the next tick
+        if zombies:
+            await self._reap(zombies[:self.batch])
+        self.stats.ticks += 1
+        self.stats.last_tick_seconds = time.monotonic() - started
+
+    def _due(self):
+        asyncio.get_running_loop().create_task(self._sweep())
+
+    async def _sweep(self):
+        try:
+            await self.tick()
+        except Exception:
+            log.exception("heartbeat_failed")
+        finally:
+            self.timers.call_later(self.interval, self._due)
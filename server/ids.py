@@ -0,0 +1,61 @@
+# server/ids.py
+import time
+from typing import Dict
+
+# Custom epoch (2024-01-01T00:00:00Z) keeps the time component small.
+ID_EPOCH_MS = 1704067200000
+
+# 41 bits of milliseconds + 6 bits of node + 6 bits of counter = 53 bits,
+# so IDs stay exact when the browser clients parse them as JS Numbers.
+NODE_BITS = 6
+COUNTER_BITS = 6
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+MAX_COUNTER = (1 << COUNTER_BITS) - 1
+
+
+class MessageIdGenerator:
+    """
+    Compact, sortable message IDs: (time_ms << 12) | (node << 6) | counter.
+    IDs from one node are strictly increasing even if the wall clock steps
+    backwards or more than 64 IDs are issued in one millisecond (we borrow
+    from the next millisecond instead of sleeping).
+    """
+
+    def __init__(self, node_id: int):
+        if not 0 <= node_id <= MAX_NODE_ID:
+            raise ValueError(f"node_id must be in [0, {MAX_NODE_ID}]")
+        self.node_id = node_id
+        self._last_ms = 0
+        self._counter = 0
+
+    def next_id(self) -> int:
+        now_ms = int(time.time() * 1000) - ID_EPOCH_MS
+        if now_ms > self._last_ms:
+            self._last_ms = now_ms
+            self._counter = 0
+        else:
+            self._counter += 1
+            if self._counter > MAX_COUNTER:
+                self._last_ms += 1
+                self._counter = 0
+        return (self._last_ms << (NODE_BITS + COUNTER_BITS)) | (self.node_id << COUNTER_BITS) | self._counter
+
+
+def id_timestamp_ms(message_id: int) -> int:
+    """Unix time in ms encoded in a message ID."""
+    return (message_id >> (NODE_BITS + COUNTER_BITS)) + ID_EPOCH_MS
+
+
+class ConversationSequencer:
+    """Per-conversation sequence numbers, starting at 1."""
+
+    def __init__(self):
+        self._seq: Dict[str, int] = {}
+
+    def next_seq(self, chat_key: str) -> int:
+        seq = self._seq.get(chat_key, 0) + 1
+        self._seq[chat_key] = seq
+        return seq
+
+    def current(self, chat_key: str) -> int:
+        return self._seq.get(chat_key, 0)
@@ -0,0 +1,161 @@
+# server/jsonlog.py
+import atexit
+import json
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional, Tuple
+
+from ratelimit import TokenBucket
+
+
+class JsonLogger:
+    """
+    Structured logging off the event loop: a record is a dict put on a
+    bounded queue; a daemon thread serializes the records as JSON lines and
+    writes them. When the queue is full the record is dropped and counted,
+    never waited for.
+
+    Noisy events can be sampled (keep a fraction) or rate limited (a token
+    bucket per event name). The next record of an event that gets through
+    carries how many were suppressed before it.
+    """
+
+    def __init__(self, stream=None, max_queue: int = 10000):
+        self.stream = stream
+        self._queue: "queue.Queue[Optional[Dict]]" = queue.Queue(max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.sample: Dict[str, float] = {}
+        self._limits: Dict[str, TokenBucket] = {}
+        self._suppressed: Dict[str, int] = {}
+        self.written = 0
+        self.dropped = 0  # queue full
+        self.sampled_out = 0
+        self.rate_limited: Dict[str, int] = {}
+
+    def configure(self, sample: Dict[str, float] = None, rate_limits: Dict[str, Tuple[float, float]] = None,
+                  max_queue: int = None) -> None:
+        """sample: event -> fraction kept; rate_limits: event -> (records per second, burst)."""
+        if sample is not None:
+            self.sample = dict(sample)
+        if rate_limits is not None:
+            self._limits = {event: TokenBucket(rate, burst) for event, (rate, burst) in rate_limits.items()}
+        if max_queue is not None and self._thread is None:
+            self._queue = queue.Queue(max_queue)
+
+    def _allow(self, event: str) -> bool:
+        fraction = self.sample.get(event)
+        if fraction is not None and random.random() >= fraction:
+            self.sampled_out += 1
+            return False
+        bucket = self._limits.get(event)
+        if bucket is not None and not bucket.take():
+            self.rate_limited[event] = self.rate_limited.get(event, 0) + 1
+            self._suppressed[event] = self._suppressed.get(event, 0) + 1
+            return False
+        return True
+
+    def _emit(self, level: str, event: str, fields: Dict, trace: bool = False) -> None:
+        if not self._allow(event):
+            return
+        record = {"ts": time.time(), "level": level, "event": event, **fields}
+        suppressed = self._suppressed.pop(event, 0)
+        if suppressed:
+            record["suppressed"] = suppressed
+        if trace:
+            record["trace"] = traceback.format_exc()
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def info(self, event: str, **fields) -> None:
+        self._emit("info", event, fields)
+
+    def warning(self, event: str, **fields) -> None:
+        self._emit("warning", event, fields)
+
+    def error(self, event: str, **fields) -> None:
+        self._emit("error", event, fields)
+
+    def exception(self, event: str, **fields) -> None:
+        """error with the traceback of the exception being handled."""
+        self._emit("error", event, fields, trace=True)
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="jsonlog", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 512:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            lines = "".join(json.dumps(r, default=str, ensure_ascii=False) + "\n" for r in batch if r is not None)
+            try:
+                stream = self.stream or sys.stdout
+                stream.write(lines)
+                stream.flush()
+                self.written += len(batch) - stop
+            except Exception:
+                self.dropped += len(batch) - stop
+            if stop:
+                return
+
+    def close(self, timeout: float = 2.0) -> None:
+        """Write out what is queued (called at exit)."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def snapshot(self) -> Dict:
+        return {
+            "written": self.written,
+            "queued": self._queue.qsize(),
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+            "rate_limited": self.rate_limited,
+        }
+
+
+def _pairs(spec: str):
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() and value.strip():
+            yield name.strip(), value.strip()
+
+
+def parse_sample(spec: str) -> Dict[str, float]:
+    """LOG_SAMPLE: "event=fraction,..." -> {event: fraction kept}."""
+    return {name: float(value) for name, value in _pairs(spec)}
+
+
+def parse_rates(spec: str) -> Dict[str, Tuple[float, float]]:
+    """LOG_RATE_LIMITS: "event=rate[:burst],..." -> {event: (rate, burst)}; burst defaults to ten seconds' worth."""
+    out = {}
+    for name, value in _pairs(spec):
+        rate, _, burst = value.partition(":")
+        out[name] = (float(rate), float(burst) if burst else max(1.0, float(rate) * 10))
+    return out
+
+
+# One logger for the whole server process
+log = JsonLogger()
@@ -0,0 +1,94 @@
+# server/metrics.py
+from bisect import bisect_left
+from typing import Dict, Sequence
+
+# Seconds; tuned for an event loop where anything above a few ms is a stall
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    """Fixed-bucket histogram: observe() is one bisect and two adds."""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (inf if it is in the overflow bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": {str(b): n for b, n in zip(self.buckets + ("+Inf",), self.counts)},
+        }
+
+
+def _number(value) -> str:
+    # exact: %g would round large counters
+    return str(value) if type(value) is int else repr(float(value))
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+class Exposition:
+    """
+    Builds a Prometheus text-format (0.0.4) page. Values are read from the
+    counters and histograms the server keeps anyway, so scraping costs
+    nothing on the message path. Samples of one family must be added
+    together, after its family() line.
+    """
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+        self._lines = []
+
+    def family(self, name: str, kind: str, help_text: str) -> "Exposition":
+        name = self.prefix + name
+        self._lines.append(f"# HELP {name} {help_text}")
+        self._lines.append(f"# TYPE {name} {kind}")
+        return self
+
+    def sample(self, name: str, value, **labels) -> "Exposition":
+        self._lines.append(f"{self.prefix}{name}{_labels(labels)} {_number(value)}")
+        return self
+
+    def histogram(self, name: str, hist: Histogram, **labels) -> "Exposition":
+        # Histogram counts are per bucket; Prometheus buckets are cumulative
+        name = self.prefix + name
+        seen = 0
+        for bound, n in zip(hist.buckets + (float("inf"),), hist.counts):
+            seen += n
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            self._lines.append(f"{name}_bucket{_labels({**labels, 'le': le})} {seen}")
+        self._lines.append(f"{name}_sum{_labels(labels)} {_number(hist.sum)}")
+        self._lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+        return self
+
+    def render(self) -> str:
+        return "\n".join(self._lines) + "\n"
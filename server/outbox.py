@@ -0,0 +1,162 @@
+# server/outbox.py
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from jsonlog import log
+from metrics import Histogram
+
+# Drained highest first. Everything recorded for session replay (messages, acks) must share
+# one lane so the client sees "ev" cursors in order. Channel broadcasts (no ev) queue behind chat;
+# ephemeral frames (typing) go last and are the ones callers skip when a connection is backed up.
+LANES = ("control", "chat", "broadcast", "presence", "bulk", "ephemeral")
+
+
+class OutboxStats:
+    __slots__ = ("messages", "frames", "latency", "credit_stalls", "overflows")
+
+    def __init__(self):
+        self.messages = 0  # WebSocket messages written
+        self.frames = 0    # server frames carried by them
+        self.credit_stalls = 0  # times a writer stopped with metered frames waiting for credit
+        self.overflows = 0      # metered frames refused because the held backlog was full
+        # queued -> written, per lane
+        self.latency: Dict[str, Histogram] = {lane: Histogram() for lane in LANES}
+
+    def snapshot(self):
+        return {
+            "messages": self.messages,
+            "frames": self.frames,
+            "frames_per_message": self.frames / self.messages if self.messages else 0.0,
+            "credit_stalls": self.credit_stalls,
+            "overflows": self.overflows,
+            "lanes": {lane: h.snapshot() for lane, h in self.latency.items()},
+        }
+
+
+class Outbox:
+    """
+    Per-connection writer. Frames are queued in priority lanes and a single
+    task writes them, always taking from the highest non-empty lane, so a
+    queued history dump can't hold up an ack or a chat message. Order within
+    a lane is preserved.
+
+    With batching on (clients that accept "batch" frames), frames queued
+    within max_delay of the first one go out together as one WebSocket
+    message, at most max_frames per message; a frame that is alone when the
+    window closes is sent as is.
+
+    Flow control is opt-in: once the client grants credit, each metered
+    frame (a chat message) uses one, and when it runs out metered frames wait
+    at the head of their lane until more is granted. Other lanes keep
+    flowing. At most max_held frames may wait; beyond that put() refuses.
+
+    put() may pass on_sent, called once the frame has been written.
+    """
+
+    def __init__(self, write: Callable[[object], Awaitable[None]], codec, batch: bool = False,
+                 max_frames: int = 32, max_delay: float = 0.005, stats: Optional[OutboxStats] = None,
+                 max_held: int = 1000):
+        self._write = write
+        self.codec = codec
+        self.batch = batch
+        self.max_frames = max_frames if batch else 1
+        self.max_delay = max_delay
+        self.stats = stats or OutboxStats()
+        self._lanes: Dict[str, Deque[Tuple[float, object, bool, Optional[Callable[[], None]]]]] = {
+            lane: deque() for lane in LANES}
+        self._queued = 0
+        self.credit: Optional[int] = None  # None until the client opts in: unlimited
+        self.max_held = max_held
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def put(self, data, lane: str = "chat", metered: bool = False, on_sent: Callable[[], None] = None) -> None:
+        if self.closed:
+            raise ConnectionError("outbox closed")
+        queue = self._lanes[lane]
+        if metered and self.credit is not None and len(queue) >= self.max_held:
+            self.stats.overflows += 1
+            raise ConnectionError("backlog_full")
+        queue.append((time.perf_counter(), data, metered, on_sent))
+        self._queued += 1
+        self._wake()
+
+    def grant(self, n: int) -> None:
+        self.credit = (self.credit or 0) + n
+        if self._queued:
+            self._wake()
+
+    def _wake(self):
+        if self._task is None and not self.closed:
+            self._task = asyncio.get_running_loop().create_task(self._drain())
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def held(self) -> int:
+        """Frames stuck behind a metered frame that has no credit."""
+        if self.credit != 0:
+            return 0
+        return sum(len(q) for q in self._lanes.values() if q and q[0][2])
+
+    def _take(self, n: int):
+        taken = []
+        for lane in LANES:
+            queue = self._lanes[lane]
+            while queue and len(taken) < n:
+                if queue[0][2] and self.credit is not None:
+                    if self.credit == 0:
+                        break
+                    self.credit -= 1
+                queued_at, data, _, on_sent = queue.popleft()
+                taken.append((lane, queued_at, data, on_sent))
+            if len(taken) == n:
+                break
+        self._queued -= len(taken)
+        return taken
+
+    async def _drain(self):
+        try:
+            while self._queued:
+                if self.batch and self._queued < self.max_frames:
+                    # let everything else this tick (and the next few ms) produce queue up behind it
+                    await asyncio.sleep(self.max_delay)
+                taken = self._take(self.max_frames)
+                if not taken:
+                    # only metered frames left and no credit; grant() restarts us
+                    self.stats.credit_stalls += 1
+                    break
+                frames = [data for _, _, data, _ in taken]
+                await self._write(frames[0] if len(frames) == 1 else self.codec.encode_batch(frames))
+                now = time.perf_counter()
+                self.stats.messages += 1
+                self.stats.frames += len(taken)
+                for lane, queued_at, _, on_sent in taken:
+                    self.stats.latency[lane].observe(now - queued_at)
+                    if on_sent is not None:
+                        on_sent()
+        except Exception as e:
+            log.warning("send_failed", frame="queued", error=str(e))
+            self.closed = True
+            for queue in self._lanes.values():
+                queue.clear()
+            self._queued = 0
+        finally:
+            self._task = None
+
+    async def flush(self):
+        """Wait until everything queued so far has been written (e.g. before closing the socket)."""
+        while self._task is not None:
+            await asyncio.shield(self._task)
+
+    def close(self):
+        self.closed = True
+        for queue in self._lanes.values():
+            queue.clear()
+        self._queued = 0
+        if self._task is not None:
+            self._task.cancel()
@@ -0,0 +1,237 @@
+# server/ratelimit.py
+import json
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from starlette.responses import Response
+
+
+class TokenBucket:
+    """rate tokens per second up to burst; refilled lazily on use, so O(1) and no timer."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, n: float = 1.0, now: float = None) -> bool:
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens < n:
+            return False
+        self.tokens -= n
+        return True
+
+    def wait(self, n: float = 1.0) -> float:
+        """Seconds until n tokens will be available."""
+        self._refill(time.monotonic())
+        return max(0.0, (n - self.tokens) / self.rate) if self.rate > 0 else math.inf
+
+
+class _Peer:
+    __slots__ = ("handshakes", "open")
+
+    def __init__(self, rate: float, burst: float):
+        self.handshakes = TokenBucket(rate, burst)
+        self.open = 0
+
+
+class IPLimiter:
+    """
+    Handshake rate and concurrent sockets per client IP. At most max_ips
+    addresses are tracked, least recently seen forgotten first, so a flood of
+    distinct addresses can't grow it without bound (a forgotten address just
+    starts over with a full bucket).
+    """
+
+    def __init__(self, rate: float, burst: float, max_open: int, max_ips: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_open = max_open
+        self.max_ips = max_ips
+        self._peers: "OrderedDict[str, _Peer]" = OrderedDict()
+        self.rejected: Dict[str, int] = {}
+        self.evicted = 0
+
+    def _peer(self, ip: str) -> _Peer:
+        peer = self._peers.get(ip)
+        if peer is None:
+            peer = self._peers[ip] = _Peer(self.rate, self.burst)
+            if len(self._peers) > self.max_ips:
+                self._peers.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._peers.move_to_end(ip)
+        return peer
+
+    def check(self, ip: str) -> Tuple[Optional[str], int]:
+        """(reason, retry_after) a new connection from ip would be refused with, without using a token."""
+        peer = self._peers.get(ip)
+        if peer is None:
+            return None, 0
+        if peer.open >= self.max_open:
+            return "too_many_connections", 0
+        wait = peer.handshakes.wait()
+        if wait > 0:
+            return "rate_limited", max(1, math.ceil(wait))
+        return None, 0
+
+    def admit(self, ip: str) -> Tuple[Optional[str], int]:
+        """Counts ip's socket as open and returns (None, 0), or (reason, retry_after) if refused."""
+        peer = self._peer(ip)
+        if peer.open >= self.max_open:
+            reason, retry = "too_many_connections", 0
+        elif not peer.handshakes.take():
+            reason, retry = "rate_limited", max(1, math.ceil(peer.handshakes.wait()))
+        else:
+            peer.open += 1
+            return None, 0
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return reason, retry
+
+    def release(self, ip: str) -> None:
+        peer = self._peers.get(ip)
+        if peer is not None and peer.open > 0:
+            peer.open -= 1
+
+    def snapshot(self) -> Dict:
+        return {
+            "rejected": self.rejected,
+            "tracked_ips": len(self._peers),
+            "evicted": self.evicted,
+            "open": sum(p.open for p in self._peers.values()),
+        }
+
+
+class _Usage:
+    __slots__ = ("messages", "bytes", "day", "used", "unsynced")
+
+    def __init__(self, limiter: "UserLimiter", day: int):
+        self.messages = TokenBucket(limiter.message_rate, limiter.message_burst)
+        self.bytes = TokenBucket(limiter.byte_rate, limiter.byte_burst)
+        self.day = day
+        self.used = 0      # bytes accepted today (all instances, as of the last sync)
+        self.unsynced = 0  # of which not yet reported to the other instances
+
+
+class UserLimiter:
+    """
+    Per-user message rate and byte rate (token buckets) and an optional daily
+    byte quota (0: off). charge() is a handful of float operations per
+    message. Rate buckets are per instance, like the connection they meter;
+    quota usage can be reconciled across instances with take_unsynced() and
+    set_used(). At most max_users users are tracked, least recent forgotten.
+    """
+
+    def __init__(self, message_rate: float, message_burst: float, byte_rate: float, byte_burst: float,
+                 daily_quota: int = 0, max_users: int = 10000):
+        self.message_rate = message_rate
+        self.message_burst = message_burst
+        self.byte_rate = byte_rate
+        self.byte_burst = byte_burst
+        self.daily_quota = daily_quota
+        self.max_users = max_users
+        self._users: "OrderedDict[str, _Usage]" = OrderedDict()
+        self.allowed = 0
+        self.rejected: Dict[str, int] = {}
+
+    def _usage(self, username: str, day: int) -> _Usage:
+        usage = self._users.get(username)
+        if usage is None:
+            usage = self._users[username] = _Usage(self, day)
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(username)
+            if usage.day != day:
+                usage.day, usage.used, usage.unsynced = day, 0, 0
+        return usage
+
+    def charge(self, username: str, size: int) -> Tuple[Optional[str], float]:
+        """Accounts one message of size bytes; (None, 0) if allowed, else (reason, retry_after seconds)."""
+        wall = time.time()
+        day = int(wall // 86400)
+        usage = self._usage(username, day)
+        if self.daily_quota and usage.used + size > self.daily_quota:
+            return self._reject("quota", (day + 1) * 86400 - wall)
+        now = time.monotonic()
+        if not usage.messages.take(1, now):
+            return self._reject("messages", usage.messages.wait())
+        # a frame bigger than the burst would never fit; size limits are enforced elsewhere
+        cost = min(size, self.byte_burst)
+        if not usage.bytes.take(cost, now):
+            usage.messages.tokens += 1
+            return self._reject("bytes", usage.bytes.wait(cost))
+        usage.used += size
+        usage.unsynced += size
+        self.allowed += 1
+        return None, 0.0
+
+    def _reject(self, reason: str, retry: float) -> Tuple[str, float]:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return reason, retry
+
+    def take_unsynced(self) -> Dict[str, Tuple[int, int]]:
+        """{username: (day, bytes)} accepted here since the last call."""
+        pending = {}
+        for username, usage in self._users.items():
+            if usage.unsynced:
+                pending[username] = (usage.day, usage.unsynced)
+                usage.unsynced = 0
+        return pending
+
+    def set_used(self, username: str, day: int, used: int) -> None:
+        """Adopt the usage total shared by all instances."""
+        usage = self._users.get(username)
+        if usage is not None and usage.day == day:
+            # plus what was accepted here while the sync was in flight
+            usage.used = used + usage.unsynced
+
+    def snapshot(self) -> Dict:
+        return {"allowed": self.allowed, "rejected": self.rejected, "tracked_users": len(self._users)}
+
+
+class ConnectionLimitMiddleware:
+    """
+    Applies an IPLimiter to WebSocket upgrades before the app sees them, so a
+    client reconnecting in a loop is refused before any per-connection state,
+    roster broadcast or passphrase. The client address is scope["client"],
+    which uvicorn's proxy-headers handling has already rewritten from
+    X-Forwarded-For for trusted proxies (PROXY_HEADERS / FORWARDED_ALLOW_IPS).
+    """
+
+    def __init__(self, app, limiter: IPLimiter, retry_after: int = 5):
+        self.app = app
+        self.limiter = limiter
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "websocket":
+            await self.app(scope, receive, send)
+            return
+        ip = (scope.get("client") or ("unknown",))[0]
+        reason, retry = self.limiter.admit(ip)
+        if reason is not None:
+            await self.deny(scope, receive, send, reason, retry or self.retry_after)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release(ip)
+
+    @staticmethod
+    async def deny(scope, receive, send, reason: str, retry: int):
+        if "websocket.http.response" in scope.get("extensions", {}):
+            body = {"type": "register_failed", "reason": reason, "retry_after": retry}
+            await Response(json.dumps(body), 429, {"Retry-After": str(retry)},
+                           media_type="application/json")(scope, receive, send)
+        else:
+            await send({"type": "websocket.close", "code": 1013})
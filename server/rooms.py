@@ -0,0 +1,84 @@
+# server/rooms.py
+import itertools
+from bisect import bisect_right
+from typing import Dict, List, Optional, Set, Tuple
+
+
+class Room:
+    """
+    A named group conversation. Members are usernames, so membership
+    outlives connections. The history is kept once for the room (not per
+    member pair) in seq order, trimmed to the newest history_size entries.
+    """
+
+    __slots__ = ("name", "epoch", "members", "history", "last_seq", "version")
+
+    def __init__(self, name: str, epoch: int):
+        self.name = name
+        self.epoch = epoch  # tells a recreated room apart from an earlier one with the same name
+        self.members: Set[str] = set()
+        self.history: List[Dict] = []
+        self.last_seq = 0
+        self.version = 0  # bumped on membership changes
+
+    def next_seq(self) -> int:
+        # a single instance's counter; with Redis the server takes seqs from a shared one instead
+        self.last_seq += 1
+        return self.last_seq
+
+    def store(self, entry: Dict, history_size: int) -> None:
+        seq = entry.get("seq", 0)
+        if self.history and seq < self.history[-1].get("seq", 0):
+            # relayed from another instance after a newer local message
+            seqs = [m.get("seq", 0) for m in self.history]
+            self.history.insert(bisect_right(seqs, seq), entry)
+        else:
+            self.history.append(entry)
+        if len(self.history) > history_size:
+            del self.history[:-history_size]
+        self.last_seq = max(self.last_seq, seq)
+
+
+class RoomStore:
+    def __init__(self, max_members: int, history_size: int):
+        self.max_members = max_members
+        self.history_size = history_size
+        self.rooms: Dict[str, Room] = {}
+        self._by_user: Dict[str, Set[str]] = {}
+        self._counter = itertools.count(1)
+
+    def get(self, name: str) -> Optional[Room]:
+        return self.rooms.get(name)
+
+    def join(self, name: str, username: str) -> Tuple[Room, bool]:
+        """Add username to the room, creating it; returns (room, whether membership changed)."""
+        room = self.rooms.get(name)
+        if room is None:
+            room = self.rooms[name] = Room(name, next(self._counter))
+        if username in room.members:
+            return room, False
+        if len(room.members) >= self.max_members:
+            raise ValueError("room_full")
+        room.members.add(username)
+        room.version = next(self._counter)
+        self._by_user.setdefault(username, set()).add(name)
+        return room, True
+
+    def leave(self, name: str, username: str) -> Optional[Room]:
+        """Remove username; returns the room, or None if they weren't in it. An emptied room is dropped."""
+        room = self.rooms.get(name)
+        if room is None or username not in room.members:
+            return None
+        room.members.discard(username)
+        room.version = next(self._counter)
+        names = self._by_user.get(username)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self._by_user[username]
+        if not room.members:
+            del self.rooms[name]
+        return room
+
+    def of(self, username: str) -> List[Room]:
+        return [self.rooms[name] for name in sorted(self._by_user.get(username, ()))]
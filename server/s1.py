@@ -1,13 +1,35 @@
-import json
 import os
 import asyncio
-import traceback
-from typing import Dict, List
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import json
+import math
+import time
+from typing import Callable, Dict, List, Optional
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 import redis.asyncio as aioredis
 import uvicorn
 import secrets
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+
+from ids import MessageIdGenerator, ConversationSequencer
+from dedup import DedupWindow
+from sessions import SessionStore
+from codec import JSON, CODECS, CodecError, RawPayload, negotiate, wire_size
+from schemas import (FRAME_LIMITS, MAX_CONTROL_FRAME_BYTES, MAX_FRAME_BYTES, MessageEnvelope, PublishEnvelope,
+                     RoomMessageEnvelope, SchemaError, parse_inbound)
+from registry import HandlerRegistry, StopConnection
+from framecache import FrameCache
+from metrics import Exposition, Histogram
+from outbox import Outbox, OutboxStats
+from rooms import RoomStore
+from channels import ChannelStore, FanoutStats, FanoutTimer
+from ephemeral import Coalescer, EphemeralStats
+from heartbeat import Heartbeat
+from timers import TimerWheel
+from admission import LoadShedder
+from ratelimit import ConnectionLimitMiddleware, IPLimiter, UserLimiter
+from jsonlog import log, parse_rates, parse_sample
 
 app = FastAPI()
 
@@ -36,11 +58,132 @@ SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
 SERVER_PORT = int(os.getenv("SERVER_PORT") or os.getenv("PORT", "8765"))
 RELOAD = os.getenv("RELOAD", "false").lower() in ("1", "true", "yes", "on")
 PROXY_HEADERS = os.getenv("PROXY_HEADERS", "true").lower() in ("1", "true", "yes", "on")
-FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "*")
+# Proxies whose X-Forwarded-For is believed (comma-separated IPs). Never "*": uvicorn then takes the
+# leftmost entry, which the client writes, and the per-IP limits see whatever IP it makes up
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
 USE_REDIS = os.getenv("USE_REDIS", "false").lower() in ("1", "true", "yes", "on")
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Distinguishes message IDs minted by different instances (0-63). Each instance sharing a Redis needs its
+# own: two with the same one mint the same IDs, and clients drop real messages as duplicates
+if USE_REDIS and not os.getenv("NODE_ID"):
+    raise SystemExit("NODE_ID must be set, and unique per instance, when USE_REDIS is on")
+NODE_ID = int(os.getenv("NODE_ID") or 0)
+HISTORY_PAGE_SIZE = 20
+# chat_history replies are split into frames of roughly this many bytes so they can't hold up other lanes
+HISTORY_CHUNK_BYTES = int(os.getenv("HISTORY_CHUNK_BYTES", str(32 * 1024)))
+# Resends carrying a client message ID ("cid") seen within this window are acked, not re-stored
+DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", "300"))
+DEDUP_PER_SENDER = int(os.getenv("DEDUP_PER_SENDER", "256"))
+DEDUP_MAX_SENDERS = int(os.getenv("DEDUP_MAX_SENDERS", "1024"))
+# Reconnects presenting a resume token within the grace window get only the events they missed
+RESUME_GRACE_SECONDS = float(os.getenv("RESUME_GRACE_SECONDS", "60"))
+REPLAY_BUFFER_SIZE = int(os.getenv("REPLAY_BUFFER_SIZE", "200"))
+RESUME_MAX_DETACHED = int(os.getenv("RESUME_MAX_DETACHED", "1000"))
+# Encoded passphrase / user_list / chat_history frames kept for reuse (LRU beyond this many)
+FRAME_CACHE_SIZE = int(os.getenv("FRAME_CACHE_SIZE", "1024"))
+# Outbound frames go through a per-connection priority writer (control > chat > broadcast > presence > bulk > ephemeral).
+# Clients connecting with ?batch=1 also get frames queued within this window coalesced into one "batch" frame
+BATCH_MAX_DELAY_MS = float(os.getenv("BATCH_MAX_DELAY_MS", "5"))
+BATCH_MAX_FRAMES = int(os.getenv("BATCH_MAX_FRAMES", "32"))
+# Clients that send {"type":"credit"} get chat messages only as fast as they grant credit;
+# at most this many wait server-side, and one grant can add at most MAX_CREDIT_GRANT
+MAX_HELD_MESSAGES = int(os.getenv("MAX_HELD_MESSAGES", "1000"))
+MAX_CREDIT_GRANT = 1000
+# Group conversations: members per room, and messages kept per room (once, not per member pair)
+MAX_ROOM_MEMBERS = int(os.getenv("MAX_ROOM_MEMBERS", "256"))
+ROOM_HISTORY_SIZE = 100
+# Broadcast channels: subscribers per channel, posts kept per channel, and how deep a subscriber's
+# queue may get before posts skip it (it notices the seq gap and pages the history)
+MAX_CHANNEL_SUBSCRIBERS = int(os.getenv("MAX_CHANNEL_SUBSCRIBERS", "10000"))
+CHANNEL_HISTORY_SIZE = int(os.getenv("CHANNEL_HISTORY_SIZE", "200"))
+CHANNEL_MAX_QUEUED = int(os.getenv("CHANNEL_MAX_QUEUED", "256"))
+# Typing indicators: at most one per (sender, peer) per interval, and none to a connection with more
+# than TYPING_MAX_QUEUED frames waiting
+TYPING_INTERVAL_MS = float(os.getenv("TYPING_INTERVAL_MS", "1000"))
+TYPING_MAX_QUEUED = int(os.getenv("TYPING_MAX_QUEUED", "32"))
+# Connections silent for PING_INTERVAL_SECONDS get a ping; silent for IDLE_TIMEOUT_SECONDS (a tab that
+# vanished without closing) they are reaped, at most REAP_BATCH_SIZE per tick, so the slot is free again
+PING_INTERVAL_SECONDS = float(os.getenv("PING_INTERVAL_SECONDS", "20"))
+IDLE_TIMEOUT_SECONDS = float(os.getenv("IDLE_TIMEOUT_SECONDS", "60"))
+REAP_BATCH_SIZE = int(os.getenv("REAP_BATCH_SIZE", "100"))
+# Refused upgrades tell clients to wait this long (Retry-After) when the server is full; GET /admission
+# is recomputed at most once per ADMISSION_CACHE_SECONDS
+ADMISSION_RETRY_SECONDS = int(os.getenv("ADMISSION_RETRY_SECONDS", "5"))
+ADMISSION_CACHE_SECONDS = float(os.getenv("ADMISSION_CACHE_SECONDS", "1"))
+# Per client IP (after proxy-header rewriting): WebSocket handshakes per second with a burst allowance,
+# and sockets open at once. Checked by middleware before the endpoint allocates anything.
+IP_HANDSHAKE_RATE = float(os.getenv("IP_HANDSHAKE_RATE", "1"))
+IP_HANDSHAKE_BURST = float(os.getenv("IP_HANDSHAKE_BURST", "10"))
+IP_MAX_CONNECTIONS = int(os.getenv("IP_MAX_CONNECTIONS", "8"))
+IP_LIMIT_MAX_TRACKED = int(os.getenv("IP_LIMIT_MAX_TRACKED", "10000"))
+# Below the MAX_USERS ceiling, new connections are shed (503 overloaded) while the event loop lags more
+# than LOAD_MAX_LAG_MS, more than LOAD_MAX_BACKLOG frames wait in outboxes, or RSS is above LOAD_MAX_RSS_MB
+# (0 disables an input); sampled every LOAD_SAMPLE_SECONDS
+LOAD_SAMPLE_SECONDS = float(os.getenv("LOAD_SAMPLE_SECONDS", "0.5"))
+LOAD_MAX_LAG_MS = float(os.getenv("LOAD_MAX_LAG_MS", "100"))
+LOAD_MAX_BACKLOG = int(os.getenv("LOAD_MAX_BACKLOG", "10000"))
+LOAD_MAX_RSS_MB = int(os.getenv("LOAD_MAX_RSS_MB", "0"))
+# Per user: messages/second and inbound bytes/second (with burst allowances) for the frames that get
+# stored and forwarded, and an optional daily byte quota (0: off), shared through Redis when it is on
+USER_MESSAGE_RATE = float(os.getenv("USER_MESSAGE_RATE", "5"))
+USER_MESSAGE_BURST = float(os.getenv("USER_MESSAGE_BURST", "20"))
+USER_BYTE_RATE = float(os.getenv("USER_BYTE_RATE", str(64 * 1024)))
+USER_BYTE_BURST = float(os.getenv("USER_BYTE_BURST", str(512 * 1024)))
+USER_DAILY_QUOTA_BYTES = int(os.getenv("USER_DAILY_QUOTA_BYTES", "0"))
+QUOTA_SYNC_SECONDS = float(os.getenv("QUOTA_SYNC_SECONDS", "5"))
+RATE_LIMITED_TYPES = frozenset(("message", "room_message", "publish"))
+# Logs are JSON lines written by a background thread from a queue of LOG_QUEUE_SIZE records (overflow is
+# dropped and counted). LOG_SAMPLE keeps a fraction of an event ("connected=0.1,disconnected=0.1");
+# LOG_RATE_LIMITS caps events per second, with an optional burst ("send_failed=5:50")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
+LOG_RATE_LIMITS = os.getenv("LOG_RATE_LIMITS", "send_failed=10,forward_failed=10,redis_error=5,connection_error=5")
+log.configure(parse_sample(LOG_SAMPLE), parse_rates(LOG_RATE_LIMITS), LOG_QUEUE_SIZE)
+# Resolution of the shared timer wheel every server-side timeout runs on (grace windows, typing
+# flushes, heartbeat sweeps); timers fire up to one tick late
+TIMER_TICK_MS = float(os.getenv("TIMER_TICK_MS", "50"))
+# Tags this process's room/channel publishes so its own listener skips them
+INSTANCE_ID = secrets.token_hex(8)
+
+message_ids = MessageIdGenerator(NODE_ID)
+# Sequences are per instance, matching the in-memory chat_history they index
+conversation_seq = ConversationSequencer()
+sent_dedup = DedupWindow(DEDUP_WINDOW_SECONDS, DEDUP_PER_SENDER, DEDUP_MAX_SENDERS)
+# One task ticks every timer in the process instead of an asyncio handle or sleeping task per timeout
+timers = TimerWheel(TIMER_TICK_MS / 1000)
+sessions = SessionStore(RESUME_GRACE_SECONDS, REPLAY_BUFFER_SIZE, RESUME_MAX_DETACHED, timers)
+load_shedder = LoadShedder(
+    timers, lambda: sum(ws.state.outbox.queued for ws in connections.values() if ws.state.outbox is not None),
+    LOAD_SAMPLE_SECONDS, LOAD_MAX_LAG_MS / 1000, LOAD_MAX_BACKLOG, LOAD_MAX_RSS_MB * 1024 * 1024)
+# One decorated handler per inbound message type; counted and timed per type
+handlers = HandlerRegistry()
+# Bumped on every roster broadcast so a resumed client only gets user_list if it missed one
+roster_version = 0
+# Frames resent far more often than they change, encoded once per state version and codec
+frame_cache = FrameCache(FRAME_CACHE_SIZE)
+outbox_stats = OutboxStats()
+rooms = RoomStore(MAX_ROOM_MEMBERS, ROOM_HISTORY_SIZE)
+channels = ChannelStore(MAX_CHANNEL_SUBSCRIBERS, CHANNEL_HISTORY_SIZE)
+fanout_stats = FanoutStats()
+ephemeral_stats = EphemeralStats()
+ip_limiter = IPLimiter(IP_HANDSHAKE_RATE, IP_HANDSHAKE_BURST, IP_MAX_CONNECTIONS, IP_LIMIT_MAX_TRACKED)
+app.add_middleware(ConnectionLimitMiddleware, limiter=ip_limiter, retry_after=ADMISSION_RETRY_SECONDS)
+user_limits = UserLimiter(USER_MESSAGE_RATE, USER_MESSAGE_BURST, USER_BYTE_RATE, USER_BYTE_BURST,
+                          USER_DAILY_QUOTA_BYTES)
+_quota_sync_started = False
+
+# Instrumentation for /metrics beyond what the stats objects above already keep
+connection_events = {"connects": 0, "resumes": 0, "disconnects": 0}
+frames_out: Dict[str, int] = {}  # by frame type (channel posts and typing are counted by their own stats)
+redis_publish_latency = Histogram()
+redis_delivery_latency = Histogram()  # publish -> received by the subscribing instance (wall clocks)
+redis_errors = {"publish": 0, "subscribe": 0}
+# frames from other instances dropped for a connected user whose outbox refused them (out of credit)
+redis_skipped = {"backlog_full": 0}
+presence_broadcast_latency = Histogram()  # one user_list to every connection
 
 _redis_client = None
+_fanout_listener = None
 
 async def get_redis():
     global _redis_client
@@ -48,6 +191,236 @@ async def get_redis():
         _redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
     return _redis_client
 
+def ack_frame(message_id: int, client_id, status: str, seq: int = None) -> Dict:
+    # Compact delivery receipt: accepted (stored), delivered, queued (held for resume), offline or failed
+    ack = {"type": "ack", "id": message_id, "cid": client_id, "status": status}
+    if seq is not None:
+        ack["seq"] = seq
+    return ack
+
+async def write_encoded(ws: WebSocket, data):
+    if isinstance(data, bytes):
+        await ws.send_bytes(data)
+    else:
+        await ws.send_text(data)
+
+async def send_encoded(ws: WebSocket, data, lane: str = "control", metered: bool = False,
+                       on_sent: Callable[[], None] = None):
+    outbox = ws.state.outbox
+    if outbox is not None:
+        # queued in its lane; the connection's writer sends higher lanes first
+        outbox.put(data, lane, metered, on_sent)
+    else:
+        await write_encoded(ws, data)
+        if on_sent is not None:
+            on_sent()
+
+async def close_socket(ws: WebSocket):
+    # let queued frames (e.g. the reason for closing) reach the client first
+    if ws.state.outbox is not None:
+        await ws.state.outbox.flush()
+    await ws.close()
+
+def count_out(kind: str):
+    frames_out[kind] = frames_out.get(kind, 0) + 1
+
+async def send_frame(ws: WebSocket, frame: Dict, lane: str = "control"):
+    # Encoded with whatever wire format this connection negotiated
+    await send_encoded(ws, ws.state.codec.encode(frame), lane)
+    count_out(frame["type"])
+
+async def send_error(ws: WebSocket, reason: str):
+    try:
+        await send_frame(ws, {"type": "error", "reason": reason})
+    except Exception:
+        pass
+
+async def send_cached(ws: WebSocket, key, version, build, lane: str = "control"):
+    # Same bytes as the last send of this key at this version; build() only runs on a miss
+    data = frame_cache.get(key, version, ws.state.codec, build)
+    for chunk in (data if isinstance(data, list) else [data]):
+        await send_encoded(ws, chunk, lane)
+        count_out(key[0])
+
+def passphrase_frame() -> Dict:
+    return {"type": "passphrase", "passphrase": DEFAULT_PASSPHRASE}
+
+async def send_passphrase(ws: WebSocket):
+    await send_cached(ws, ("passphrase",), DEFAULT_PASSPHRASE, passphrase_frame)
+
+async def receive_frame(ws: WebSocket):
+    message = await ws.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    text = message.get("text")
+    return text if text is not None else message.get("bytes")
+
+def redis_message(frame: Dict, header: Dict = None) -> str:
+    # Redis payload is one header line (routing info for the receiving instance), then the JSON frame,
+    # then the message's opaque payload, if any, as its sender's JSON text
+    # ts: lets the receiving instance time the trip through Redis
+    lines = [JSON.encode({**(header or {}), "ts": time.time()})]
+    payload = frame.get("payload")
+    if isinstance(payload, RawPayload):
+        lines.append(JSON.encode({k: v for k, v in frame.items() if k != "payload"}))
+        lines.append(payload.encoded_for(JSON))
+    else:
+        lines.append(JSON.encode(frame))
+    return "\n".join(lines)
+
+def parse_redis_message(data: str):
+    """(header, frame) from redis_message() output, or (None, None) if it is unreadable."""
+    header_text, _, rest = data.partition("\n")
+    frame_text, _, payload_text = rest.partition("\n")
+    try:
+        header = JSON.decode(header_text)
+        frame = JSON.decode(frame_text)
+    except CodecError:
+        return None, None
+    if type(header.get("ts")) is float:
+        redis_delivery_latency.observe(max(0.0, time.time() - header["ts"]))
+    if payload_text:
+        frame = {"payload": RawPayload(JSON, payload_text), **frame}
+    return header, frame
+
+async def redis_publish(channel: str, data: str) -> int:
+    redis = await get_redis()
+    started = time.perf_counter()
+    try:
+        return await redis.publish(channel, data)
+    except Exception:
+        redis_errors["publish"] += 1
+        raise
+    finally:
+        redis_publish_latency.observe(time.perf_counter() - started)
+
+async def publish_frame(recipient: str, frame: Dict, header: Dict = None) -> int:
+    return await redis_publish(f"chat:deliver:{recipient}", redis_message(frame, header))
+
+async def deliver(username: str, frame: Dict, shared: Dict = None, on_sent: Callable[[], None] = None) -> str:
+    """
+    Send a replayable frame to a user of this instance, recording it in their
+    session so a resumed connection can catch up. Returns the delivery status:
+    "sending" once it is queued on their connection (on_sent runs when it has
+    actually been written, which may wait for flow-control credit), "queued"
+    if only their detached session holds it, "offline" or "failed" (nothing
+    was recorded). When the same frame goes to many users, pass one shared
+    dict for all of them: it collects the frame's encoding per wire format,
+    so each user only adds their own "ev".
+    """
+    session = sessions.get(username)
+    ws = connections.get(username)
+    encoded = None
+    if shared is not None and (session is not None or ws is not None):
+        codec = session.codec if session is not None else ws.state.codec
+        encoded = shared.get(codec.name)
+        if encoded is None:
+            encoded = shared[codec.name] = codec.encode(frame)
+    if session is not None:
+        data = session.stamp(frame, encoded)
+    elif ws is not None:
+        data = encoded or ws.state.codec.encode(frame)
+    if ws is None:
+        if session is None:
+            return "offline"
+        session.record(frame, data)
+        return "queued"
+    try:
+        # every replayable frame shares the chat lane so "ev" cursors reach the client in order;
+        # messages count against the client's flow-control credit
+        await send_encoded(ws, data, "chat", frame.get("type") == "message", on_sent)
+    except Exception as e:
+        log.warning("forward_failed", user=username, error=str(e))
+        return "failed"
+    # only now: a frame the outbox refused must not take up an ev the client never sees
+    if session is not None:
+        session.record(frame, data)
+    count_out(frame.get("type", "message"))
+    return "sending"
+
+def ack_when_sent(username: str, ack: Dict) -> Callable[[], None]:
+    """An on_sent hook for deliver() that sends ack the first time it runs."""
+    pending = [ack]
+
+    def sent():
+        if pending:
+            asyncio.get_running_loop().create_task(send_ack(username, pending.pop()))
+    return sent
+
+def settle_ack(username: str, ack: Dict):
+    # Keep the sender's dedup entry in step with the outcome: a resend is answered with the final
+    # status, and a message that failed was never delivered, so its resend is taken as new
+    client_id = ack.get("cid")
+    if not client_id or ack.get("status") == "accepted":
+        return
+    if ack.get("status") == "failed":
+        sent_dedup.forget(username, client_id)
+    else:
+        sent_dedup.update(username, client_id, status=ack.get("status"))
+
+async def send_ack(username: str, ack: Dict):
+    if USE_REDIS and username not in connections:
+        # a detached session here may be stale, its user live on another instance: that one goes first
+        try:
+            if await publish_frame(username, ack):
+                return
+        except Exception as e:
+            log.error("redis_error", op="ack_publish", error=str(e))
+    if username in connections or sessions.get(username) is not None:
+        settle_ack(username, ack)
+        await deliver(username, ack)
+
+def send_ephemeral(username: str, frame: Dict, shared: Dict = None) -> bool:
+    """
+    Queue a lossy frame (typing) for a user of this instance: lowest lane, never
+    recorded for resume, and dropped rather than queued behind a backlog or
+    frames held for credit. shared works as in deliver().
+    """
+    ws = connections.get(username)
+    outbox = ws.state.outbox if ws is not None else None
+    if outbox is None or outbox.closed or outbox.queued >= TYPING_MAX_QUEUED or outbox.held:
+        ephemeral_stats.dropped += 1
+        return False
+    data = shared.get(outbox.codec.name) if shared is not None else None
+    if data is None:
+        data = outbox.codec.encode(frame)
+        if shared is not None:
+            shared[outbox.codec.name] = data
+    outbox.put(data, "ephemeral")
+    ephemeral_stats.sent += 1
+    return True
+
+async def publish_ephemeral(username: str, frame: Dict):
+    try:
+        if not await publish_frame(username, frame, {"ephemeral": True}):
+            ephemeral_stats.dropped += 1
+    except Exception:
+        ephemeral_stats.dropped += 1
+
+def emit_typing(key, active: bool):
+    # called by the coalescer with the (sender, kind, target) it let through
+    sender, kind, target = key
+    if kind == "room":
+        room = rooms.get(target)
+        if room is None:
+            return
+        frame = {"type": "typing", "from": sender, "room": target, "active": active}
+        shared = {}
+        for member in list(room.members):
+            if member != sender:
+                send_ephemeral(member, frame, shared)
+        return
+    frame = {"type": "typing", "from": sender, "active": active}
+    if target in connections:
+        send_ephemeral(target, frame)
+    elif USE_REDIS:
+        # not connected here (a detached session can't take it anyway): the peer may be on another instance
+        asyncio.create_task(publish_ephemeral(target, frame))
+    else:
+        ephemeral_stats.dropped += 1
+
+typing_events = Coalescer(TYPING_INTERVAL_MS / 1000, emit_typing, ephemeral_stats, timers)
+
 def get_chat_key(user1: str, user2: str) -> str:
     a, b = sorted([user1, user2])
     return f"{a}_{b}"
@@ -60,17 +433,170 @@ def build_user_list():
     return users
 
 async def broadcast_user_list():
+    global roster_version
+    roster_version += 1
+    started = time.perf_counter()
     payload = {"type": "user_list", "users": build_user_list()}
-    text = json.dumps(payload)
     for uname, ws in list(connections.items()):
         try:
-            await ws.send_text(text)
+            # one encoding per wire format, shared by every connection and by later resumes
+            await send_cached(ws, ("user_list",), roster_version, lambda: payload, "presence")
+            session = sessions.get(uname)
+            if session is not None:
+                session.roster_version = roster_version
         except Exception as e:
-            print(f"[server] userlist send failed to {uname}: {e}")
+            log.warning("send_failed", frame="user_list", user=uname, error=str(e))
             try: await ws.close()
             except Exception: pass
             connections.pop(uname, None)
             meta.pop(uname, None)
+    presence_broadcast_latency.observe(time.perf_counter() - started)
+
+async def fan_out(room, frame: Dict, skip: str = None, on_sent: Callable[[], None] = None) -> Dict[str, int]:
+    """
+    Deliver a replayable frame to every member of a room on this instance
+    (except skip), encoded once per wire format. Delivery only queues on each
+    member's writer, so members are written to concurrently and a slow one
+    holds up nobody else. Returns how many deliveries ended in each status;
+    on_sent is passed to each of them.
+    """
+    shared = {}
+    counts: Dict[str, int] = {}
+    for member in list(room.members):
+        if member != skip:
+            status = await deliver(member, frame, shared, on_sent)
+            counts[status] = counts.get(status, 0) + 1
+    return counts
+
+def room_members_frame(room) -> Dict:
+    return {"type": "room_members", "room": room.name, "members": sorted(room.members)}
+
+async def broadcast_room_members(room):
+    # same bytes for every member, rebuilt only when membership changes
+    for member in list(room.members):
+        ws = connections.get(member)
+        if ws is None:
+            continue
+        try:
+            await send_cached(ws, ("room_members", room.name), room.version, lambda: room_members_frame(room), "presence")
+        except Exception as e:
+            log.warning("send_failed", frame="room_members", user=member, error=str(e))
+
+def broadcast_channel(channel, frame: Dict) -> int:
+    """
+    Queue one channel post on every subscriber connection on this instance:
+    encoded once per wire format, and the very same object handed to each
+    outbox. Nothing is recorded per subscriber. Returns how many were queued.
+    """
+    timer = FanoutTimer(fanout_stats)
+    shared = {}
+    queued = 0
+    for username in list(channel.members):
+        ws = connections.get(username)
+        outbox = ws.state.outbox if ws is not None else None
+        if outbox is None or outbox.closed:
+            continue
+        if outbox.queued >= CHANNEL_MAX_QUEUED:
+            fanout_stats.lagged += 1
+            continue
+        data = shared.get(outbox.codec.name)
+        if data is None:
+            data = shared[outbox.codec.name] = outbox.codec.encode(frame)
+        outbox.put(data, "broadcast", False, timer)
+        queued += 1
+    timer.queued(queued)
+    fanout_stats.publishes += 1
+    fanout_stats.deliveries += queued
+    return queued
+
+async def publish_room(room_name: str, frame: Dict) -> int:
+    # one publish per room message; every instance gets it once, however many members it serves
+    return await redis_publish(f"chat:room:{room_name}", redis_message(frame, {"origin": INSTANCE_ID}))
+
+async def publish_channel(channel_name: str, frame: Dict) -> int:
+    return await redis_publish(f"chat:channel:{channel_name}", redis_message(frame, {"origin": INSTANCE_ID}))
+
+async def next_post_seq(key: str, room) -> int:
+    # Posts relayed from other instances land in the same room/channel history, which clients page by
+    # seq, so with Redis the seq comes from one counter per name shared by every instance (INCR at key)
+    if not USE_REDIS:
+        return room.next_seq()
+    redis = await get_redis()
+    return await redis.incr(key)
+
+# Channel ownership across instances: each name is claimed once (HSETNX) in CHANNEL_OWNERS_KEY, and the
+# publishers its owner adds are kept next to it, so no instance grants rights it only assumed locally
+CHANNEL_OWNERS_KEY = "chat:channels"
+
+async def claim_channel(name: str, owner: str) -> bool:
+    """Registers owner as the channel's owner; False if someone else already owns that name."""
+    redis = await get_redis()
+    if await redis.hsetnx(CHANNEL_OWNERS_KEY, name, owner):
+        return True
+    return await redis.hget(CHANNEL_OWNERS_KEY, name) == owner
+
+async def registered_owner(name: str) -> Optional[str]:
+    redis = await get_redis()
+    return await redis.hget(CHANNEL_OWNERS_KEY, name)
+
+async def register_publisher(name: str, username: str) -> None:
+    redis = await get_redis()
+    await redis.sadd(f"chat:channel_publishers:{name}", username)
+
+async def registered_publisher(channel, username: str) -> bool:
+    # a publisher added by the owner on another instance; remembered locally once confirmed
+    try:
+        redis = await get_redis()
+        if not await redis.sismember(f"chat:channel_publishers:{channel.name}", username):
+            return False
+    except Exception as e:
+        log.error("redis_error", op="channel_publishers", channel=channel.name, error=str(e))
+        return False
+    channel.publishers.add(username)
+    return True
+
+async def fanout_listener():
+    global _fanout_listener
+    pubsub = None
+    try:
+        redis = await get_redis()
+        pubsub = redis.pubsub()
+        await pubsub.psubscribe("chat:room:*", "chat:channel:*")
+        async for message in pubsub.listen():
+            if message.get("type") != "pmessage" or not message.get("data"):
+                continue
+            header, frame = parse_redis_message(message["data"])
+            if frame is None or header.get("origin") == INSTANCE_ID:
+                continue
+            entry = {k: v for k, v in frame.items() if k != "type"}
+            if message.get("channel", "").startswith("chat:channel:"):
+                channel = channels.get(frame.get("channel"))
+                if channel is not None:
+                    channel.store(entry, CHANNEL_HISTORY_SIZE)
+                    broadcast_channel(channel, frame)
+                continue
+            room = rooms.get(frame.get("room"))
+            if room is None:
+                # nobody here is in it
+                continue
+            room.store(entry, ROOM_HISTORY_SIZE)
+            await fan_out(room, frame, frame.get("sender_username"))
+    except Exception as e:
+        redis_errors["subscribe"] += 1
+        log.error("redis_error", op="fanout_listener", error=str(e))
+    finally:
+        _fanout_listener = None
+        if pubsub is not None:
+            try:
+                await pubsub.close()
+            except Exception:
+                pass
+
+def start_fanout_listener():
+    # started once this instance has a room member or channel subscriber; posts from other instances arrive through it
+    global _fanout_listener
+    if USE_REDIS and _fanout_listener is None:
+        _fanout_listener = asyncio.create_task(fanout_listener())
 
 def _other_user_from_chat_key(chat_key: str, me: str):
     parts = chat_key.split('_')
@@ -83,33 +609,680 @@ def _other_user_from_chat_key(chat_key: str, me: str):
         return "_".join(parts_copy)
     return None
 
-@app.websocket("/ws/{username}")
-async def ws_endpoint(ws: WebSocket, username: str):
-    await ws.accept()
+async def sync_quota():
+    # batched: one pipelined INCRBY per user with new usage, and everyone adopts the shared totals
+    try:
+        pending = user_limits.take_unsynced()
+        if pending:
+            redis = await get_redis()
+            pipe = redis.pipeline(transaction=False)
+            for username, (day, used) in pending.items():
+                key = f"chat:quota:{username}:{day}"
+                pipe.incrby(key, used)
+                pipe.expire(key, 2 * 86400)
+            totals = (await pipe.execute())[::2]
+            for (username, (day, _)), total in zip(pending.items(), totals):
+                user_limits.set_used(username, day, int(total))
+    except Exception as e:
+        log.error("redis_error", op="quota_sync", error=str(e))
+    finally:
+        timers.call_later(QUOTA_SYNC_SECONDS, lambda: asyncio.get_running_loop().create_task(sync_quota()))
 
-    if username in connections:
-        await ws.send_text(json.dumps({"type":"register_failed", "reason":"username_taken"}))
-        await ws.close()
+def start_quota_sync():
+    global _quota_sync_started
+    if USE_REDIS and USER_DAILY_QUOTA_BYTES and not _quota_sync_started:
+        _quota_sync_started = True
+        timers.call_later(QUOTA_SYNC_SECONDS, lambda: asyncio.get_running_loop().create_task(sync_quota()))
+
+def history_page(history: List[Dict], before_seq=None, after_seq=None) -> List[Dict]:
+    # history is append-only in seq order, so seq bounds are a bisect away
+    seqs = [m.get("seq", 0) for m in history]
+    lo, hi = 0, len(history)
+    if isinstance(after_seq, int):
+        lo = bisect_right(seqs, after_seq)
+        return history[lo:lo + HISTORY_PAGE_SIZE]
+    if isinstance(before_seq, int):
+        hi = bisect_left(seqs, before_seq)
+    return history[max(lo, hi - HISTORY_PAGE_SIZE):hi]
+
+def _entry_size(entry: Dict) -> int:
+    # rough wire size: the ciphertext dominates, the rest is a couple hundred bytes
+    body = entry.get("payload")
+    if body is None:
+        body = entry.get("ct") or b""
+    return len(body) + 200
+
+def chunk_messages(messages: List[Dict], budget: int):
+    """Yield (chunk, approx_bytes) runs of messages, each at most ~budget unless one message is bigger."""
+    chunk, size = [], 0
+    for entry in messages:
+        n = _entry_size(entry)
+        if chunk and size + n > budget:
+            yield chunk, size
+            chunk, size = [], 0
+        chunk.append(entry)
+        size += n
+    if chunk:
+        yield chunk, size
+
+def history_frames(target: Dict, messages: List[Dict], last_seq: int) -> List[Dict]:
+    # target is {"with_user": peer} or {"room": name};
+    # every chunk but the last says more=True, so clients render once at the end
+    frames = [{"type": "chat_history", **target, "messages": chunk, "last_seq": last_seq, "more": True}
+              for chunk, _ in chunk_messages(messages, HISTORY_CHUNK_BYTES)]
+    if not frames:
+        return [{"type": "chat_history", **target, "messages": [], "last_seq": last_seq}]
+    del frames[-1]["more"]
+    return frames
+
+def chats_frames(user_chats: Dict[str, List[Dict]]) -> List[Dict]:
+    # the on-connect {"chats": {peer: [...]}} dump, packed into frames of ~HISTORY_CHUNK_BYTES
+    frames, current, size = [], {}, 0
+    for peer, messages in user_chats.items():
+        for chunk, n in chunk_messages(messages, HISTORY_CHUNK_BYTES):
+            if current and size + n > HISTORY_CHUNK_BYTES:
+                frames.append({"type": "chat_history", "chats": current, "more": True})
+                current, size = {}, 0
+            current.setdefault(peer, []).extend(chunk)
+            size += n
+    if current:
+        frames.append({"type": "chat_history", "chats": current})
+    return frames
+
+@dataclass
+class Client:
+    """Per-connection state handed to every message handler."""
+    ws: WebSocket
+    username: str
+    session: object
+
+def release_connection(username: str, ws: WebSocket, session) -> bool:
+    # frees the slot but keeps the session, so the client can still resume
+    if ws.state.reaped or connections.get(username) not in (ws, None):
+        # reaped already, or a resumed connection took this username over
+        return False
+    connections.pop(username, None)
+    session.meta = meta.pop(username, None)
+    sessions.detach(username, session)
+    return True
+
+async def drop_connection(username: str, ws: WebSocket, session):
+    if release_connection(username, ws, session):
+        await broadcast_user_list()
+
+def send_ping(ws: WebSocket):
+    ws.state.outbox.put(ws.state.codec.encode({"type": "ping"}), "control")
+
+async def reap_zombies(zombies):
+    # the receive loop of a vanished client never returns on its own: release its slot here and cancel
+    # the loop; one roster broadcast for the whole batch
+    released = 0
+    for username, ws in zombies:
+        if not release_connection(username, ws, ws.state.session):
+            continue
+        ws.state.reaped = True
+        ws.state.outbox.close()
+        ws.state.task.cancel()
+        released += 1
+    if released:
+        log.info("reaped", count=released, connections=len(connections))
+        await broadcast_user_list()
+
+# inbound frames refused before reaching a handler, by reason (oversized_frame, oversized_ct, malformed_json, ...)
+inbound_rejects: Dict[str, int] = {}
+# upgrade requests refused before accept, by reason
+admission_rejects: Dict[str, int] = {}
+_admission_cache = [0.0, b""]
+
+def retry_after(reason: str, username: str = None) -> int:
+    holder = connections.get(username) if reason == "username_taken" else None
+    if holder is not None:
+        # the name frees up once its holder is reaped, if it has gone silent
+        return max(1, math.ceil(heartbeat.timeout - (time.monotonic() - holder.state.last_seen)))
+    return ADMISSION_RETRY_SECONDS
+
+async def admission_check(username: str, resume_token) -> str:
+    """Why a connection for username would be refused right now, or None."""
+    for attempt in (0, 1):
+        # a client resuming its own session may replace its old socket; anyone else needs a free name
+        taking_over = username in connections
+        resuming = sessions.owns(username, resume_token)
+        if taking_over and not resuming:
+            reason = "username_taken"
+        elif len(connections) - taking_over >= MAX_USERS:
+            reason = "server_full"
+        elif resuming:
+            # already has a session here; shedding it would only throw that state away
+            return None
+        else:
+            return load_shedder.admit()
+        # zombies may be holding the name or the slots
+        if attempt or not await heartbeat.reap_now():
+            return reason
+
+async def deny(ws: WebSocket, reason: str, status: int, retry: int):
+    # refuse the upgrade with a plain HTTP response where the server supports it, so a rejected
+    # client costs no WebSocket handshake, frame or close
+    admission_rejects[reason] = admission_rejects.get(reason, 0) + 1
+    body = {"type": "register_failed", "reason": reason, "retry_after": retry}
+    if "websocket.http.response" in ws.scope.get("extensions", {}):
+        await ws.send_denial_response(Response(json.dumps(body), status, {"Retry-After": str(retry)},
+                                               media_type="application/json"))
+    else:
+        # a close before accept is answered with 403
+        await ws.close(1013)
+
+heartbeat = Heartbeat(PING_INTERVAL_SECONDS, IDLE_TIMEOUT_SECONDS, REAP_BATCH_SIZE, connections, send_ping, reap_zombies, timers)
+
+@handlers.on("register")
+async def handle_register(client: Client, m):
+    ws, username = client.ws, client.username
+    if m.username is not None and m.username != username:
+        await send_frame(ws, {"type":"register_failed", "reason":"username_mismatch"})
+        await close_socket(ws)
+        await drop_connection(username, ws, client.session)
+        raise StopConnection()
+
+    label = m.label or ("Anon-" + secrets.token_hex(3) if m.anonymous else username)
+
+    meta[username] = {"label": label, "anonymous": m.anonymous}
+
+    try:
+        await send_frame(ws, {"type":"register_ok", "username": username, "label": label, "passphrase": DEFAULT_PASSPHRASE})
+    except Exception:
+        pass
+
+    # Resend passphrase after registration to avoid races
+    try:
+        await send_passphrase(ws)
+    except Exception:
+        pass
+
+    await broadcast_user_list()
+
+async def reack_duplicate(client: Client, client_id) -> bool:
+    # Resend of something we already stored and forwarded: just re-ack it
+    original_ack = sent_dedup.get(client.username, client_id) if client_id else None
+    if original_ack is None:
+        return False
+    try:
+        await send_frame(client.ws, original_ack)
+    except Exception:
+        pass
+    return True
+
+@handlers.on("message")
+async def handle_message(client: Client, m):
+    ws, username = client.ws, client.username
+    sender_username = m.sender_username or username
+    recipient = m.recipient
+    sender_display = meta.get(sender_username, {}).get("label", sender_username)
+    client_id = m.cid
+
+    if await reack_duplicate(client, client_id):
         return
 
-    if len(connections) >= MAX_USERS:
-        await ws.send_text(json.dumps({"type":"register_failed", "reason":"server_full"}))
-        await ws.close()
+    chat_key = get_chat_key(sender_username, recipient)
+    message_id = message_ids.next_id()
+    seq = conversation_seq.next_seq(chat_key)
+
+    if isinstance(m, MessageEnvelope):
+        # stored and forwarded as the sender's bytes, nested under "payload"
+        entry = {"payload": m.payload}
+    else:
+        entry = {"iv": m.iv, "ct": m.ct, "aad": m.aad, "timestamp": m.timestamp}
+    entry.update({
+        "id": message_id,
+        "seq": seq,
+        "sender": sender_display,
+        "sender_username": sender_username,
+        "recipient": recipient,
+    })
+    try:
+        chat_history.setdefault(chat_key, []).append(entry)
+        if len(chat_history[chat_key]) > 100:
+            chat_history[chat_key] = chat_history[chat_key][-100:]
+    except Exception as e:
+        log.error("store_failed", error=str(e))
+
+    forwarded = {**entry, "type": "message"}
+
+    ack = ack_frame(message_id, client_id, "accepted", seq)
+    if client_id:
+        sent_dedup.remember(username, client_id, ack)
+    try:
+        await send_frame(ws, ack)
+    except Exception:
+        pass
+
+    if USE_REDIS and recipient not in connections:
+        # Publish for cross-instance delivery; the receiving instance sends the delivered ack. A detached
+        # session here only gets it if no instance has them live: it may be left over from a user who
+        # has since reconnected elsewhere
+        try:
+            if await publish_frame(recipient, forwarded, {"ack_to": username, "id": message_id, "cid": client_id}):
+                return
+        except Exception as e:
+            log.error("redis_error", op="publish", user=username, error=str(e))
+            if sessions.get(recipient) is None:
+                await send_ack(username, ack_frame(message_id, client_id, "failed"))
+                return
+    # Local users, including ones inside their resume grace window; "delivered" only once the frame
+    # has been written, not while it waits for the recipient's credit
+    status = await deliver(recipient, forwarded,
+                           on_sent=ack_when_sent(username, ack_frame(message_id, client_id, "delivered")))
+    if status != "sending":
+        await send_ack(username, ack_frame(message_id, client_id, status))
+
+@handlers.on("get_chat_history")
+async def handle_get_chat_history(client: Client, m):
+    ws, username = client.ws, client.username
+    other_user = m.with_user
+    if other_user:
+        chat_key = get_chat_key(username, other_user)
+        last_seq = conversation_seq.current(chat_key)
+
+        def build():
+            page = history_page(chat_history.get(chat_key, []), m.before_seq, m.after_seq)
+            return history_frames({"with_user": other_user}, page, last_seq)
+
+        # unchanged until the next message in this conversation bumps last_seq
+        try:
+            await send_cached(ws, ("chat_history", chat_key, other_user, m.before_seq, m.after_seq), last_seq, build, "bulk")
+        except Exception:
+            pass
+
+def member_room(client: Client, name: str):
+    room = rooms.get(name)
+    return room if room is not None and client.username in room.members else None
+
+@handlers.on("join_room")
+async def handle_join_room(client: Client, m):
+    if not m.room:
+        await send_error(client.ws, "invalid_room")
+        return
+    try:
+        room, changed = rooms.join(m.room, client.username)
+    except ValueError as e:
+        await send_error(client.ws, str(e))
+        return
+    start_fanout_listener()
+    try:
+        await send_frame(client.ws, {"type": "room_joined", "room": room.name,
+                                     "members": sorted(room.members), "last_seq": room.last_seq})
+    except Exception:
+        pass
+    if changed:
+        await broadcast_room_members(room)
+
+@handlers.on("leave_room")
+async def handle_leave_room(client: Client, m):
+    room = rooms.leave(m.room, client.username)
+    if room is None:
+        await send_error(client.ws, "not_in_room")
+        return
+    try:
+        await send_frame(client.ws, {"type": "room_left", "room": room.name})
+    except Exception:
+        pass
+    await broadcast_room_members(room)
+
+@handlers.on("room_message")
+async def handle_room_message(client: Client, m):
+    ws, username = client.ws, client.username
+    room = member_room(client, m.room)
+    if room is None:
+        await send_error(ws, "not_in_room")
+        return
+    client_id = m.cid
+    if await reack_duplicate(client, client_id):
+        return
+
+    try:
+        seq = await next_post_seq(f"chat:room_seq:{room.name}", room)
+    except Exception as e:
+        log.error("redis_error", op="room_seq", room=room.name, error=str(e))
+        await send_error(ws, "room_unavailable")
+        return
+    message_id = message_ids.next_id()
+    if isinstance(m, RoomMessageEnvelope):
+        entry = {"payload": m.payload}
+    else:
+        entry = {"iv": m.iv, "ct": m.ct, "aad": m.aad, "timestamp": m.timestamp}
+    entry.update({
+        "id": message_id,
+        "seq": seq,
+        "sender": meta.get(username, {}).get("label", username),
+        "sender_username": username,
+        "room": room.name,
+    })
+    # stored once for the whole room
+    room.store(entry, ROOM_HISTORY_SIZE)
+
+    ack = ack_frame(message_id, client_id, "accepted", seq)
+    if client_id:
+        sent_dedup.remember(username, client_id, ack)
+    try:
+        await send_frame(ws, ack)
+    except Exception:
+        pass
+
+    # members get it as a "message" frame carrying "room" instead of "recipient"
+    forwarded = {**entry, "type": "message"}
+    # delivered once the first member here has been written to, or as soon as another instance takes it
+    delivered = ack_when_sent(username, ack_frame(message_id, client_id, "delivered"))
+    counts = await fan_out(room, forwarded, username, delivered)
+    remote = 0
+    if USE_REDIS:
+        try:
+            # our own listener gets it too, so other instances are receivers - 1
+            remote = await publish_room(room.name, forwarded) - 1
+        except Exception as e:
+            log.error("redis_error", op="room_publish", room=room.name, error=str(e))
+    if remote > 0:
+        delivered()
+    elif not counts.get("sending"):
+        await send_ack(username, ack_frame(message_id, client_id, "queued" if counts.get("queued") else "offline"))
+
+@handlers.on("get_room_history")
+async def handle_get_room_history(client: Client, m):
+    room = member_room(client, m.room)
+    if room is None:
+        await send_error(client.ws, "not_in_room")
+        return
+    last_seq = room.last_seq
+
+    def build():
+        page = history_page(room.history, m.before_seq, m.after_seq)
+        return history_frames({"room": room.name}, page, last_seq)
+
+    # epoch: a room recreated under the same name starts its seqs over
+    try:
+        await send_cached(client.ws, ("room_history", room.name, m.before_seq, m.after_seq),
+                          (room.epoch, last_seq), build, "bulk")
+    except Exception:
+        pass
+
+def channel_info(channel, username: str) -> Dict:
+    return {"channel": channel.name, "last_seq": channel.last_seq, "publisher": username in channel.publishers}
+
+@handlers.on("create_channel")
+async def handle_create_channel(client: Client, m):
+    if not m.channel:
+        await send_error(client.ws, "invalid_channel")
+        return
+    if USE_REDIS and channels.get(m.channel) is None:
+        # claimed for every instance first, so the same name can't be created elsewhere by someone else
+        try:
+            claimed = await claim_channel(m.channel, client.username)
+        except Exception as e:
+            log.error("redis_error", op="channel_claim", channel=m.channel, error=str(e))
+            await send_error(client.ws, "channel_unavailable")
+            return
+        if not claimed:
+            await send_error(client.ws, "channel_exists")
+            return
+    try:
+        # the owner publishes and is subscribed to what it publishes
+        channel = channels.create(m.channel, client.username)
+        channels.subscribe(m.channel, client.username)
+    except ValueError as e:
+        await send_error(client.ws, str(e))
+        return
+    start_fanout_listener()
+    try:
+        await send_frame(client.ws, {"type": "subscribed", **channel_info(channel, client.username)})
+    except Exception:
+        pass
+
+@handlers.on("add_publisher")
+async def handle_add_publisher(client: Client, m):
+    channel = channels.get(m.channel)
+    if channel is None or channel.owner != client.username:
+        await send_error(client.ws, "not_channel_owner")
         return
+    if USE_REDIS:
+        try:
+            await register_publisher(channel.name, m.username)
+        except Exception as e:
+            log.error("redis_error", op="channel_publishers", channel=channel.name, error=str(e))
+            await send_error(client.ws, "channel_unavailable")
+            return
+    channel.publishers.add(m.username)
+    try:
+        await send_frame(client.ws, {"type": "publisher_added", "channel": channel.name, "username": m.username})
+    except Exception:
+        pass
+
+@handlers.on("subscribe")
+async def handle_subscribe(client: Client, m):
+    if not m.channel:
+        await send_error(client.ws, "invalid_channel")
+        return
+    remote_owner = None
+    if USE_REDIS and channels.get(m.channel) is None:
+        # only a channel some instance registered can be followed, and the copy gets its real owner
+        try:
+            remote_owner = await registered_owner(m.channel)
+        except Exception as e:
+            log.error("redis_error", op="channel_lookup", channel=m.channel, error=str(e))
+            await send_error(client.ws, "channel_unavailable")
+            return
+    try:
+        channel = channels.subscribe(m.channel, client.username, remote_owner)
+    except ValueError as e:
+        await send_error(client.ws, str(e))
+        return
+    start_fanout_listener()
+    try:
+        await send_frame(client.ws, {"type": "subscribed", **channel_info(channel, client.username)})
+    except Exception:
+        pass
+    if isinstance(m.after_seq, int) and m.after_seq < channel.last_seq:
+        # the subscriber's cursor is behind: the first page of what it missed
+        await send_channel_history(client, channel, None, m.after_seq)
 
+@handlers.on("unsubscribe")
+async def handle_unsubscribe(client: Client, m):
+    if channels.unsubscribe(m.channel, client.username) is None:
+        await send_error(client.ws, "not_subscribed")
+        return
     try:
-        await ws.send_text(json.dumps({
-            "type": "passphrase",
-            "passphrase": DEFAULT_PASSPHRASE
-        }))
+        await send_frame(client.ws, {"type": "unsubscribed", "channel": m.channel})
+    except Exception:
+        pass
+
+@handlers.on("publish")
+async def handle_publish(client: Client, m):
+    ws, username = client.ws, client.username
+    channel = channels.get(m.channel)
+    if channel is None or (username not in channel.publishers
+                           and not (USE_REDIS and await registered_publisher(channel, username))):
+        await send_error(ws, "not_a_publisher")
+        return
+    client_id = m.cid
+    if await reack_duplicate(client, client_id):
+        return
+
+    try:
+        seq = await next_post_seq(f"chat:channel_seq:{channel.name}", channel)
     except Exception as e:
-        print(f"[server] failed to send passphrase to {username}: {e}")
+        log.error("redis_error", op="channel_seq", channel=channel.name, error=str(e))
+        await send_error(ws, "channel_unavailable")
+        return
+    message_id = message_ids.next_id()
+    if isinstance(m, PublishEnvelope):
+        entry = {"payload": m.payload}
+    else:
+        entry = {"iv": m.iv, "ct": m.ct, "aad": m.aad, "timestamp": m.timestamp}
+    entry.update({
+        "id": message_id,
+        "seq": seq,
+        "sender": meta.get(username, {}).get("label", username),
+        "sender_username": username,
+        "channel": channel.name,
+    })
+    channel.store(entry, CHANNEL_HISTORY_SIZE)
+
+    ack = ack_frame(message_id, client_id, "accepted", seq)
+    if client_id:
+        sent_dedup.remember(username, client_id, ack)
+    try:
+        await send_frame(ws, ack)
+    except Exception:
+        pass
+
+    broadcast_channel(channel, {**entry, "type": "broadcast"})
+    if USE_REDIS:
+        try:
+            await publish_channel(channel.name, {**entry, "type": "broadcast"})
+        except Exception as e:
+            log.error("redis_error", op="channel_publish", channel=channel.name, error=str(e))
+
+async def send_channel_history(client: Client, channel, before_seq, after_seq):
+    last_seq = channel.last_seq
+
+    def build():
+        page = history_page(channel.history, before_seq, after_seq)
+        return history_frames({"channel": channel.name}, page, last_seq)
+
+    try:
+        await send_cached(client.ws, ("channel_history", channel.name, before_seq, after_seq),
+                          (channel.epoch, last_seq), build, "bulk")
+    except Exception:
+        pass
+
+@handlers.on("get_channel_history")
+async def handle_get_channel_history(client: Client, m):
+    channel = channels.get(m.channel)
+    if channel is None or (client.username not in channel.members and client.username not in channel.publishers):
+        await send_error(client.ws, "not_subscribed")
+        return
+    await send_channel_history(client, channel, m.before_seq, m.after_seq)
+
+@handlers.on("typing")
+async def handle_typing(client: Client, m):
+    ephemeral_stats.received += 1
+    if (m.to is None) == (m.room is None):
+        await send_error(client.ws, "invalid_typing")
+        return
+    if m.room is not None:
+        if member_room(client, m.room) is None:
+            ephemeral_stats.dropped += 1
+            return
+        typing_events.offer((client.username, "room", m.room), m.active)
+    elif m.to != client.username:
+        typing_events.offer((client.username, "user", m.to), m.active)
+
+@handlers.on("update_label")
+async def handle_update_label(client: Client, m):
+    ws, username = client.ws, client.username
+    # runtime label change without reconnecting
+    label = m.label or ("Anon-" + secrets.token_hex(3) if m.anonymous else username)
+    meta[username] = {"label": label, "anonymous": m.anonymous}
+    try:
+        await send_frame(ws, {"type": "update_ok", "label": label, "anonymous": m.anonymous})
+    except Exception:
+        pass
+    await broadcast_user_list()
+
+@handlers.on("get_passphrase")
+async def handle_get_passphrase(client: Client, m):
+    try:
+        await send_passphrase(client.ws)
+    except Exception:
+        pass
+
+@handlers.on("ping")
+async def handle_ping(client: Client, m):
+    await send_frame(client.ws, {"type": "pong"})
+
+@handlers.on("pong")
+async def handle_pong(client: Client, m):
+    # the receive loop already refreshed last_seen
+    pass
+
+@handlers.on("credit")
+async def handle_credit(client: Client, m):
+    # the first grant switches this connection to credit-based delivery of chat messages
+    if not 0 < m.grant <= MAX_CREDIT_GRANT:
+        await send_error(client.ws, "invalid_grant")
+        return
+    client.ws.state.outbox.grant(m.grant)
+
+@app.websocket("/ws/{username}")
+async def ws_endpoint(ws: WebSocket, username: str):
+    # Binary (MessagePack) or JSON framing, picked from the client's Sec-WebSocket-Protocol offer
+    negotiated = negotiate(ws.scope.get("subprotocols", []))
+    codec = negotiated or JSON
+    ws.state.codec = codec
+    ws.state.outbox = None
+    ws.state.reaped = False
+    heartbeat.start()
+    load_shedder.start()
+    start_quota_sync()
+
+    resume_token = ws.query_params.get("resume")
+    reason = await admission_check(username, resume_token)
+    if reason is not None:
+        await deny(ws, reason, 409 if reason == "username_taken" else 503, retry_after(reason, username))
+        return
+    await ws.accept(subprotocol=negotiated.subprotocol if negotiated else None)
+
+    # only reachable through a race with another connection during accept
+    taking_over = username in connections
+    if len(connections) - taking_over >= MAX_USERS:
+        await send_frame(ws, {"type":"register_failed", "reason":"server_full"})
         await ws.close()
         return
 
+    # a valid token may replace its own stale socket even when its replay can't be served (cursor out of
+    # the buffer, other wire format); the client then gets a fresh session and a full resync
+    owner = sessions.owns(username, resume_token)
+    resumed = None
+    if owner:
+        try:
+            resume_cursor = int(ws.query_params.get("cursor", "0"))
+        except ValueError:
+            resume_cursor = -1
+        resumed = sessions.resume(username, resume_token, resume_cursor, codec)
+
+    if taking_over:
+        if not owner:
+            await send_frame(ws, {"type":"register_failed", "reason":"username_taken"})
+            await ws.close()
+            return
+        # The old socket is a zombie the client has already given up on; this one replaces it. Its own
+        # teardown must not release the slot or the session this connection now holds
+        stale = connections.pop(username)
+        stale.state.reaped = True
+        try:
+            await stale.close()
+        except Exception:
+            pass
+
+    ws.state.outbox = Outbox(lambda data: write_encoded(ws, data), codec, ws.query_params.get("batch") == "1",
+                             BATCH_MAX_FRAMES, BATCH_MAX_DELAY_MS / 1000, outbox_stats, MAX_HELD_MESSAGES)
+
+    if resumed is None:
+        try:
+            await send_passphrase(ws)
+        except Exception as e:
+            log.warning("send_failed", frame="passphrase", user=username, error=str(e))
+            await ws.close()
+            return
+        session = sessions.start(username, codec)
+        meta[username] = {"label": username, "anonymous": False}
+    else:
+        session, missed = resumed
+        meta[username] = session.meta or meta.get(username) or {"label": username, "anonymous": False}
+
+    ws.state.session = session
+    ws.state.task = asyncio.current_task()
+    ws.state.last_seen = time.monotonic()
     connections[username] = ws
-    meta[username] = {"label": username, "anonymous": False}
-    print(f"[server] {username} connected — total {len(connections)}")
+    connection_events["resumes" if resumed else "connects"] += 1
+    log.info("resumed" if resumed else "connected", user=username, connections=len(connections))
 
     # If Redis is enabled, subscribe to this user's delivery channel
     redis_task = None
@@ -128,10 +1301,28 @@ async def ws_endpoint(ws: WebSocket, username: str):
                         data = message.get("data")
                         if not data:
                             continue
-                        try:
-                            await ws.send_text(data)
-                        except Exception:
-                            break
+                        header, frame = parse_redis_message(data)
+                        if frame is None:
+                            continue
+                        if header.get("ephemeral"):
+                            send_ephemeral(username, frame)
+                            continue
+                        if frame.get("type") == "ack":
+                            # the outcome of one of our user's messages, from the recipient's instance
+                            settle_ack(username, frame)
+                        ack_to = header.get("ack_to")
+                        on_sent = None
+                        if ack_to:
+                            on_sent = ack_when_sent(ack_to, ack_frame(header.get("id"), header.get("cid"), "delivered"))
+                        status = await deliver(username, frame, on_sent=on_sent)
+                        if status == "failed":
+                            if ws.state.outbox.closed:
+                                break
+                            # out of credit with a full backlog but still connected: skip this frame (the
+                            # sender is told it failed and resends) and keep the subscription
+                            redis_skipped["backlog_full"] += 1
+                        if ack_to and status != "sending":
+                            await send_ack(ack_to, ack_frame(header.get("id"), header.get("cid"), status))
                 finally:
                     try:
                         await pubsub.unsubscribe(f"chat:deliver:{username}")
@@ -140,175 +1331,126 @@ async def ws_endpoint(ws: WebSocket, username: str):
 
             redis_task = asyncio.create_task(redis_consumer())
         except Exception as e:
-            print(f"[server] failed to init redis subscriber for {username}: {e}")
-
-    user_chats = {}
-    try:
-        for chat_key, history in chat_history.items():
-            other_user = _other_user_from_chat_key(chat_key, username)
-            if other_user:
-                user_chats[other_user] = history[-20:]
-    except Exception as e:
-        print(f"[server] error preparing user chats for {username}: {e}")
+            redis_errors["subscribe"] += 1
+            log.error("redis_error", op="subscribe", user=username, error=str(e))
 
-    if user_chats:
+    if resumed is None:
         try:
-            await ws.send_text(json.dumps({"type": "chat_history", "chats": user_chats}))
+            await send_frame(ws, {"type": "session", "token": session.token, "cursor": session.cursor})
         except Exception:
             pass
 
-    await broadcast_user_list()
+        user_chats = {}
+        try:
+            for chat_key, history in chat_history.items():
+                other_user = _other_user_from_chat_key(chat_key, username)
+                if other_user:
+                    user_chats[other_user] = history[-20:]
+        except Exception as e:
+            log.error("history_failed", user=username, error=str(e))
 
-    try:
-        while True:
-            data = await ws.receive_text()
+        if user_chats:
             try:
-                msg = json.loads(data)
+                for frame in chats_frames(user_chats):
+                    await send_frame(ws, frame, "bulk")
             except Exception:
-                try:
-                    await ws.send_text(json.dumps({"type":"error", "reason":"malformed_json"}))
-                except Exception:
-                    pass
-                continue
-
-            mtype = msg.get("type")
-
-            if mtype == "register":
-                incoming_username = msg.get("username", username)
-                if incoming_username != username:
-                    await ws.send_text(json.dumps({"type":"register_failed", "reason":"username_mismatch"}))
-                    await ws.close()
-                    return
-
-                anon_flag = bool(msg.get("anonymous", False))
-                label = msg.get("label") or ("Anon-" + secrets.token_hex(3) if anon_flag else username)
+                pass
 
-                meta[username] = {"label": label, "anonymous": anon_flag}
+        await broadcast_user_list()
+    else:
+        # Only the events missed while away, then the roster if it changed meanwhile
+        try:
+            await send_frame(ws, {"type": "resumed", "cursor": session.cursor, "replayed": len(missed)})
+            for data, metered in missed:
+                await send_encoded(ws, data, "chat", metered)
+        except Exception:
+            pass
+        if not taking_over:
+            await broadcast_user_list()
+        elif session.roster_version != roster_version:
+            try:
+                await send_cached(ws, ("user_list",), roster_version,
+                                  lambda: {"type": "user_list", "users": build_user_list()}, "presence")
+                session.roster_version = roster_version
+            except Exception:
+                pass
 
-                try:
-                    await ws.send_text(json.dumps({"type":"register_ok", "username": username, "label": label, "passphrase": DEFAULT_PASSPHRASE}))
-                except Exception:
-                    pass
+    # rooms outlive connections: tell the client which it is in (members, newest seq) so it can catch up
+    # and forget any it remembers but is no longer in
+    my_rooms = rooms.of(username)
+    my_channels = channels.of(username)
+    if my_rooms or my_channels:
+        start_fanout_listener()
+    try:
+        await send_frame(ws, {"type": "rooms", "rooms": [
+            {"room": r.name, "members": sorted(r.members), "last_seq": r.last_seq} for r in my_rooms]}, "presence")
+        # channel subscribers hold only a cursor; last_seq tells them whether to page the history
+        await send_frame(ws, {"type": "channels", "channels": [channel_info(c, username) for c in my_channels]}, "presence")
+    except Exception:
+        pass
 
-                # Resend passphrase after registration to avoid races
+    client = Client(ws, username, session)
+    try:
+        while True:
+            data = await receive_frame(ws)
+            ws.state.last_seen = time.monotonic()
+            try:
+                # nothing bigger than the largest legal message is decoded at all (uvicorn already refuses
+                # frames over ws_max_size); no header over the control limit is decoded either, and only
+                # message types may carry a payload or be a larger flat frame
+                size = wire_size(data)
+                if size > MAX_FRAME_BYTES:
+                    raise SchemaError("oversized_frame")
+                # decode the header + compiled schema check; m is a typed struct from schemas.py
+                # (an envelope's payload is checked by the codec and attached to m as received)
+                header, payload = codec.decode_envelope(data, MAX_CONTROL_FRAME_BYTES, FRAME_LIMITS)
+                mtype, m = parse_inbound(header, payload, size)
+            except (CodecError, SchemaError) as e:
+                inbound_rejects[str(e)] = inbound_rejects.get(str(e), 0) + 1
                 try:
-                    await ws.send_text(json.dumps({
-                        "type": "passphrase",
-                        "passphrase": DEFAULT_PASSPHRASE
-                    }))
+                    await send_frame(ws, {"type":"error", "reason":str(e)})
                 except Exception:
                     pass
-
-                await broadcast_user_list()
                 continue
 
-            if mtype == "message":
-                sender_username = msg.get("sender_username") or username
-                recipient = msg.get("recipient")
-                sender_display = meta.get(sender_username, {}).get("label", sender_username)
-
-                if not recipient or not isinstance(recipient, str):
+            if mtype in RATE_LIMITED_TYPES:
+                limited, wait = user_limits.charge(username, size)
+                if limited is not None:
+                    # cid tells the client which send to retry, after retry_after seconds
                     try:
-                        await ws.send_text(json.dumps({"type":"error", "reason":"invalid_recipient"}))
+                        await send_frame(ws, {"type": "rate_limited", "reason": limited, "cid": m.cid,
+                                              "retry_after": round(wait, 3)})
                     except Exception:
                         pass
                     continue
 
+            if not await handlers.dispatch(mtype, client, m):
                 try:
-                    chat_key = get_chat_key(sender_username, recipient)
-                    entry = {
-                        "sender": sender_display,
-                        "sender_username": sender_username,
-                        "recipient": recipient,
-                        "iv": msg.get("iv"),
-                        "ct": msg.get("ct"),
-                        "aad": msg.get("aad"),
-                        "timestamp": msg.get("timestamp")
-                    }
-                    chat_history.setdefault(chat_key, []).append(entry)
-                    if len(chat_history[chat_key]) > 100:
-                        chat_history[chat_key] = chat_history[chat_key][-100:]
-                except Exception as e:
-                    print(f"[server] error storing message: {e}")
-
-                forwarded = {
-                    "type": "message",
-                    "sender": sender_display,
-                    "sender_username": sender_username,
-                    "recipient": recipient,
-                    "iv": msg.get("iv"),
-                    "ct": msg.get("ct"),
-                    "aad": msg.get("aad"),
-                    "timestamp": msg.get("timestamp")
-                }
-
-                is_local = recipient in connections
-                if is_local:
-                    try:
-                        await connections[recipient].send_text(json.dumps(forwarded))
-                    except Exception as e:
-                        print(f"[server] forward error to {recipient}: {e}")
-                        try:
-                            await ws.send_text(json.dumps({"type":"error", "reason":"delivery_failed", "recipient": recipient}))
-                        except Exception:
-                            pass
-                else:
-                    if USE_REDIS:
-                        # Publish for cross-instance delivery; don't mark offline since remote instance may deliver
-                        try:
-                            redis = await get_redis()
-                            await redis.publish(f"chat:deliver:{recipient}", json.dumps(forwarded))
-                        except Exception as e:
-                            print(f"[server] redis publish error: {e}")
-                    else:
-                        try:
-                            await ws.send_text(json.dumps({"type":"error", "reason":"recipient_offline", "recipient": recipient}))
-                        except Exception:
-                            pass
-                continue
-
-            if mtype == "get_chat_history":
-                other_user = msg.get("with_user")
-                if other_user and isinstance(other_user, str):
-                    chat_key = get_chat_key(username, other_user)
-                    history = chat_history.get(chat_key, [])
-                    try:
-                        await ws.send_text(json.dumps({
-                            "type": "chat_history",
-                            "with_user": other_user,
-                            "messages": history[-20:]
-                        }))
-                    except Exception:
-                        pass
-                continue
-
-            if mtype == "get_passphrase":
-                try:
-                    await ws.send_text(json.dumps({
-                        "type": "passphrase",
-                        "passphrase": DEFAULT_PASSPHRASE
-                    }))
+                    await send_frame(ws, {"type":"error", "reason":"unknown_type"})
                 except Exception:
                     pass
-                continue
 
+    except StopConnection:
+        pass
+    except asyncio.CancelledError:
+        if not ws.state.reaped:
+            raise
+        # reap_zombies() already released the slot; returning lets the server drop the socket
+        log.info("zombie_reaped", user=username, idle_timeout=heartbeat.timeout)
     except WebSocketDisconnect:
-        print(f"[server] {username} disconnected")
-        connections.pop(username, None)
-        meta.pop(username, None)
-        await broadcast_user_list()
+        log.info("disconnected", user=username)
+        await drop_connection(username, ws, session)
     except Exception as exc:
-        print(f"[server] exception for {username}: {exc}")
-        traceback.print_exc()
+        log.exception("connection_error", user=username, error=str(exc))
         try:
-            if username in connections:
-                await connections[username].close()
+            await ws.close()
         except Exception:
             pass
-        connections.pop(username, None)
-        meta.pop(username, None)
-        await broadcast_user_list()
+        await drop_connection(username, ws, session)
     finally:
+        connection_events["disconnects"] += 1
+        if ws.state.outbox is not None:
+            ws.state.outbox.close()
         if redis_task:
             try:
                 redis_task.cancel()
@@ -320,16 +1462,206 @@ async def ws_endpoint(ws: WebSocket, username: str):
             except Exception:
                 pass
 
+@app.get("/admission")
+async def admission(request: Request):
+    # cheap pre-flight for clients backing off: is there room, and (with ?username=) is the name free
+    limited, retry = ip_limiter.check(request.client.host if request.client else "unknown")
+    if limited is not None:
+        return {"open": False, "reason": limited, "retry_after": retry or ADMISSION_RETRY_SECONDS,
+                "users": len(connections), "max_users": MAX_USERS}
+    now = time.monotonic()
+    if now >= _admission_cache[0]:
+        _admission_cache[0] = now + ADMISSION_CACHE_SECONDS
+        reason = "server_full" if len(connections) >= MAX_USERS else "overloaded" if load_shedder.shedding else None
+        _admission_cache[1] = json.dumps({"open": reason is None, "reason": reason,
+                                          "retry_after": ADMISSION_RETRY_SECONDS if reason else 0,
+                                          "users": len(connections), "max_users": MAX_USERS}).encode()
+    username = request.query_params.get("username")
+    if username is None:
+        return Response(_admission_cache[1], media_type="application/json",
+                        headers={"Cache-Control": f"max-age={math.ceil(ADMISSION_CACHE_SECONDS)}"})
+    # taken is only reported for a name held by someone else; a full server is reported from the cache
+    if username in connections and not sessions.owns(username, request.query_params.get("resume")):
+        return {"open": False, "reason": "username_taken", "retry_after": retry_after("username_taken", username),
+                "users": len(connections), "max_users": MAX_USERS}
+    return Response(_admission_cache[1], media_type="application/json", headers={"Cache-Control": "no-store"})
+
+@app.get("/stats/admission")
+async def admission_stats():
+    # upgrade requests refused before accept, by reason; ip_limits are refused by the middleware before that
+    return {"rejected": admission_rejects, "ip_limits": ip_limiter.snapshot(),
+            "users": len(connections), "max_users": MAX_USERS}
+
+@app.get("/stats/inbound")
+async def inbound_stats():
+    # frames refused before any handler ran, by reason: oversized_* (frame, ct, aad, label, payload, ...)
+    # and malformed/invalid ones
+    return {"rejected": inbound_rejects, "max_frame_bytes": MAX_FRAME_BYTES}
+
+@app.get("/stats/load")
+async def load_stats():
+    # what the admission controller sees (loop lag, outbound backlog, RSS), its limits, whether it is
+    # shedding and how many connections it admitted or shed, next to the connection count they came with
+    return {**load_shedder.snapshot(), "connections": len(connections), "max_users": MAX_USERS}
+
+@app.get("/stats/rate_limits")
+async def rate_limit_stats():
+    # messages let through and refused by reason (messages, bytes, quota)
+    return {**user_limits.snapshot(), "message_rate": USER_MESSAGE_RATE, "byte_rate": USER_BYTE_RATE,
+            "daily_quota_bytes": USER_DAILY_QUOTA_BYTES}
+
+@app.get("/stats/logging")
+async def logging_stats():
+    # records written, waiting for the writer thread, dropped on a full queue, sampled out, and
+    # suppressed by rate limit per event
+    return {**log.snapshot(), "max_queue": LOG_QUEUE_SIZE, "sample": log.sample, "rate_limits": LOG_RATE_LIMITS}
+
+def history_totals(histories) -> tuple:
+    entries = size = 0
+    for history in histories:
+        entries += len(history)
+        size += sum(_entry_size(entry) for entry in history)
+    return entries, size
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # Prometheus text format, read from the counters the server keeps anyway
+    out = Exposition("chat_")
+    out.family("connections", "gauge", "Open WebSocket connections.").sample("connections", len(connections))
+    out.family("detached_sessions", "gauge", "Sessions waiting for a resume.").sample("detached_sessions", len(sessions.detached))
+    out.family("connection_events_total", "counter", "Connects, resumes and disconnects.")
+    for event, n in connection_events.items():
+        out.sample("connection_events_total", n, event=event)
+    out.family("zombies_reaped_total", "counter", "Silent connections reaped by the heartbeat.")
+    out.sample("zombies_reaped_total", heartbeat.stats.zombies_reaped)
+    out.family("admission_rejected_total", "counter", "Upgrades refused before accept, by reason.")
+    for reason, n in {**admission_rejects, **ip_limiter.rejected}.items():
+        out.sample("admission_rejected_total", n, reason=reason)
+
+    out.family("messages_in_total", "counter", "Inbound frames handled, by type.")
+    for mtype, st in handlers.stats.items():
+        out.sample("messages_in_total", st.count, type=mtype)
+    out.family("handler_errors_total", "counter", "Handlers that raised, by type.")
+    for mtype, st in handlers.stats.items():
+        out.sample("handler_errors_total", st.errors, type=mtype)
+    out.family("inbound_rejected_total", "counter", "Inbound frames refused before a handler, by reason.")
+    for reason, n in {**inbound_rejects, **{"rate_" + k: v for k, v in user_limits.rejected.items()}}.items():
+        out.sample("inbound_rejected_total", n, reason=reason)
+    out.family("handler_seconds", "histogram", "Time in the handler per inbound type (store and forward for messages).")
+    for mtype, st in handlers.stats.items():
+        if st.count:
+            out.histogram("handler_seconds", st.latency, type=mtype)
+
+    out.family("messages_out_total", "counter", "Frames queued to clients, by type.")
+    for kind, n in {**frames_out, "broadcast": fanout_stats.deliveries, "typing": ephemeral_stats.sent}.items():
+        out.sample("messages_out_total", n, type=kind)
+    out.family("outbox_queue_seconds", "histogram", "Queued until written to the socket, by lane.")
+    for lane, hist in outbox_stats.latency.items():
+        out.histogram("outbox_queue_seconds", hist, lane=lane)
+    outboxes = [ws.state.outbox for ws in connections.values() if ws.state.outbox is not None]
+    out.family("outbox_queued", "gauge", "Frames waiting in connection outboxes.").sample("outbox_queued", sum(o.queued for o in outboxes))
+    out.family("outbox_max_queued", "gauge", "Deepest connection outbox.").sample("outbox_max_queued", max((o.queued for o in outboxes), default=0))
+    out.family("outbox_held", "gauge", "Frames held for lack of flow-control credit.").sample("outbox_held", sum(o.held for o in outboxes))
+    out.family("presence_broadcast_seconds", "histogram", "One user_list broadcast to every connection.")
+    out.histogram("presence_broadcast_seconds", presence_broadcast_latency)
+    out.family("channel_fanout_seconds", "histogram", "Channel publish until the last subscriber's copy was written.")
+    for bucket, hist in fanout_stats.latency.items():
+        if hist.count:
+            out.histogram("channel_fanout_seconds", hist, subscribers=bucket)
+
+    out.family("redis_publish_seconds", "histogram", "Redis PUBLISH round trip.").histogram("redis_publish_seconds", redis_publish_latency)
+    out.family("redis_delivery_seconds", "histogram", "Publish on one instance until received by a subscriber.")
+    out.histogram("redis_delivery_seconds", redis_delivery_latency)
+    out.family("redis_errors_total", "counter", "Failed Redis publishes and subscriptions.")
+    for op, n in redis_errors.items():
+        out.sample("redis_errors_total", n, op=op)
+    out.family("redis_deliveries_skipped_total", "counter", "Frames from other instances a connected user's outbox refused.")
+    for reason, n in redis_skipped.items():
+        out.sample("redis_deliveries_skipped_total", n, reason=reason)
+
+    out.family("history_entries", "gauge", "Stored messages, by kind of conversation.")
+    totals = {"direct": history_totals(chat_history.values()),
+              "room": history_totals(r.history for r in rooms.rooms.values()),
+              "channel": history_totals(c.history for c in channels.channels.values())}
+    for kind, (entries, _) in totals.items():
+        out.sample("history_entries", entries, kind=kind)
+    out.family("history_bytes", "gauge", "Approximate size of stored messages, by kind of conversation.")
+    for kind, (_, size) in totals.items():
+        out.sample("history_bytes", size, kind=kind)
+
+    out.family("loop_lag_seconds", "gauge", "Smoothed event-loop lag seen by admission control.")
+    out.sample("loop_lag_seconds", load_shedder.inputs["lag"])
+    out.family("timers_pending", "gauge", "Timers on the shared wheel.").sample("timers_pending", len(timers))
+    out.family("timer_tick_seconds", "histogram", "Cost of one timer-wheel tick.").histogram("timer_tick_seconds", timers.stats.tick_cost)
+    out.family("log_records_total", "counter", "Log records written, dropped on a full queue, sampled out or rate limited.")
+    for outcome, n in (("written", log.written), ("dropped", log.dropped), ("sampled_out", log.sampled_out),
+                       ("rate_limited", sum(log.rate_limited.values()))):
+        out.sample("log_records_total", n, outcome=outcome)
+    return Response(out.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
+@app.get("/stats/handlers")
+async def handler_stats():
+    # per message type: count, errors, rate and latency histogram since startup
+    return handlers.snapshot()
+
+@app.get("/stats/outbox")
+async def outbox_stats_endpoint():
+    # WebSocket messages written vs frames they carried (>1 only with ?batch=1), queue latency per lane,
+    # and what is sitting in queues right now, including messages held for lack of credit
+    stats = outbox_stats.snapshot()
+    outboxes = [ws.state.outbox for ws in connections.values() if ws.state.outbox is not None]
+    stats["backlog"] = {
+        "queued": sum(o.queued for o in outboxes),
+        "max_queued": max((o.queued for o in outboxes), default=0),
+        "held_for_credit": sum(o.held for o in outboxes),
+        "credit_connections": sum(1 for o in outboxes if o.credit is not None),
+        "stalled_connections": sum(1 for o in outboxes if o.held),
+    }
+    stats["redis_skipped"] = redis_skipped
+    return stats
+
+@app.get("/stats/channels")
+async def channel_stats():
+    # publishes, frames queued to subscribers, skips for lagging subscribers, and the time from
+    # publish until the last subscriber's copy was written, by subscriber count
+    stats = fanout_stats.snapshot()
+    stats["channels"] = len(channels.channels)
+    stats["subscriptions"] = sum(len(c.members) for c in channels.channels.values())
+    return stats
+
+@app.get("/stats/ephemeral")
+async def ephemeral_stats_endpoint():
+    # typing events received, frames sent for them, folded by coalescing, and dropped
+    return {**ephemeral_stats.snapshot(), "tracked_pairs": len(typing_events)}
+
+@app.get("/stats/heartbeat")
+async def heartbeat_stats():
+    # pings sent to quiet connections, slots recovered from silent ones, and what one sweep costs
+    return {**heartbeat.stats.snapshot(), "connections": len(connections),
+            "ping_interval_seconds": heartbeat.interval, "idle_timeout_seconds": heartbeat.timeout}
+
+@app.get("/stats/timers")
+async def timer_stats():
+    # timers pending on the shared wheel, how many fired or were cancelled, and what each tick cost
+    return {**timers.stats.snapshot(), "pending": len(timers), "tick_seconds": timers.tick,
+            "detached_sessions": len(sessions.detached)}
+
+@app.get("/stats/frame_cache")
+async def frame_cache_stats():
+    # hits/misses per cached frame kind (passphrase, user_list, chat_history, room_members, room_history, channel_history)
+    return frame_cache.snapshot()
+
 @app.get("/")
 async def root():
     return {"service": "chat-server", "websocket_path": "/ws/{username}", "max_users": MAX_USERS}
 
 if __name__ == "__main__":
-    print(f"[server] starting WITHOUT TLS on {SERVER_HOST}:{SERVER_PORT}")
+    log.info("starting", host=SERVER_HOST, port=SERVER_PORT, tls=False,
+             wire_formats=[c.subprotocol for c in CODECS], json_backend=JSON.backend)
     uvicorn.run(
         app,
         host=SERVER_HOST,
@@ -337,4 +1669,7 @@ if __name__ == "__main__":
         reload=RELOAD,
         proxy_headers=PROXY_HEADERS,
         forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+        # frames past this are refused by the protocol layer (close 1009) before the app sees them;
+        # the slack lets frames just over the limit get an oversized_frame error instead
+        ws_max_size=2 * MAX_FRAME_BYTES,
     )
@@ -0,0 +1,314 @@
+# server/schemas.py
+"""
+Inbound message schemas. Each client message type is declared once as a
+slotted dataclass; at import time we generate (exec) a straight-line
+validator per type from those declarations, so checking a frame is a handful
+of type/len comparisons with no per-field loop or reflection. Frames with
+unknown keys, wrong types or oversized fields are rejected before any
+handler runs.
+
+A message can also arrive as an envelope: a routing header validated here
+plus an opaque payload (see codec.RawPayload): the codec checks it is one
+flat map, here it is only size-checked.
+"""
+
+import math
+import os
+from dataclasses import dataclass, field, fields, MISSING
+from typing import Callable, Dict, Optional, Union
+
+MAX_NAME_LEN = 64
+MAX_LABEL_LEN = int(os.getenv("MAX_LABEL_LEN", "64"))
+MAX_CID_LEN = 64
+MAX_TIMESTAMP_LEN = 40
+MAX_IV_BYTES = 32
+MAX_CT_BYTES = int(os.getenv("MAX_CT_BYTES", str(64 * 1024)))
+MAX_AAD_LEN = int(os.getenv("MAX_AAD_LEN", "1024"))
+# iv + ct + aad + timestamp as the client encoded them
+MAX_PAYLOAD_BYTES = int(os.getenv("MAX_PAYLOAD_BYTES", str(96 * 1024)))
+# Whole inbound frames, checked before they are decoded: the largest legal message (ct base64-encoded
+# in JSON, plus header), and everything that isn't a message
+MAX_FRAME_BYTES = int(os.getenv("MAX_FRAME_BYTES", str(MAX_PAYLOAD_BYTES * 4 // 3 + 4096)))
+MAX_CONTROL_FRAME_BYTES = int(os.getenv("MAX_CONTROL_FRAME_BYTES", "4096"))
+
+
+# Clients send either an ISO string or Date.now() (milliseconds, a number)
+Timestamp = Union[str, int, float]
+
+
+class SchemaError(ValueError):
+    """Raised with the reason code sent back to the client, e.g. invalid_recipient."""
+
+
+def _limit(n: int):
+    return {"max_len": n}
+
+
+@dataclass(slots=True)
+class Register:
+    username: Optional[str] = field(default=None, metadata=_limit(MAX_NAME_LEN))
+    anonymous: bool = False
+    label: Optional[str] = field(default=None, metadata=_limit(MAX_LABEL_LEN))
+
+
+@dataclass(slots=True)
+class Message:
+    recipient: str = field(metadata=_limit(MAX_NAME_LEN))
+    iv: bytes = field(metadata=_limit(MAX_IV_BYTES))
+    ct: bytes = field(metadata=_limit(MAX_CT_BYTES))
+    aad: Optional[str] = field(default=None, metadata=_limit(MAX_AAD_LEN))
+    cid: Optional[str] = field(default=None, metadata=_limit(MAX_CID_LEN))
+    sender_username: Optional[str] = field(default=None, metadata=_limit(MAX_NAME_LEN))
+    # display label the browser clients attach; the server uses its own roster label
+    sender: Optional[str] = field(default=None, metadata=_limit(MAX_LABEL_LEN))
+    timestamp: Optional[Timestamp] = field(default=None, metadata=_limit(MAX_TIMESTAMP_LEN))
+
+
+@dataclass(slots=True)
+class MessageEnvelope:
+    recipient: str = field(metadata=_limit(MAX_NAME_LEN))
+    cid: Optional[str] = field(default=None, metadata=_limit(MAX_CID_LEN))
+    sender_username: Optional[str] = field(default=None, metadata=_limit(MAX_NAME_LEN))
+    # not read from the header; parse_inbound attaches the RawPayload
+    payload: object = field(default=None, metadata={"wire": False})
+
+
+@dataclass(slots=True)
+class RoomMessage:
+    room: str = field(metadata=_limit(MAX_NAME_LEN))
+    iv: bytes = field(metadata=_limit(MAX_IV_BYTES))
+    ct: bytes = field(metadata=_limit(MAX_CT_BYTES))
+    aad: Optional[str] = field(default=None, metadata=_limit(MAX_AAD_LEN))
+    cid: Optional[str] = field(default=None, metadata=_limit(MAX_CID_LEN))
+    sender_username: Optional[str] = field(default=None, metadata=_limit(MAX_NAME_LEN))
+    sender: Optional[str] = field(default=None, metadata=_limit(MAX_LABEL_LEN))
+    timestamp: Optional[Timestamp] = field(default=None, metadata=_limit(MAX_TIMESTAMP_LEN))
+
+
+@dataclass(slots=True)
+class RoomMessageEnvelope:
+    room: str = field(metadata=_limit(MAX_NAME_LEN))
+    cid: Optional[str] = field(default=None, metadata=_limit(MAX_CID_LEN))
+    sender_username: Optional[str] = field(default=None, metadata=_limit(MAX_NAME_LEN))
+    payload: object = field(default=None, metadata={"wire": False})
+
+
+@dataclass(slots=True)
+class JoinRoom:
+    room: str = field(metadata=_limit(MAX_NAME_LEN))
+
+
+@dataclass(slots=True)
+class LeaveRoom:
+    room: str = field(metadata=_limit(MAX_NAME_LEN))
+
+
+@dataclass(slots=True)
+class GetRoomHistory:
+    room: str = field(metadata=_limit(MAX_NAME_LEN))
+    before_seq: Optional[int] = None
+    after_seq: Optional[int] = None
+
+
+@dataclass(slots=True)
+class Publish:
+    channel: str = field(metadata=_limit(MAX_NAME_LEN))
+    iv: bytes = field(metadata=_limit(MAX_IV_BYTES))
+    ct: bytes = field(metadata=_limit(MAX_CT_BYTES))
+    aad: Optional[str] = field(default=None, metadata=_limit(MAX_AAD_LEN))
+    cid: Optional[str] = field(default=None, metadata=_limit(MAX_CID_LEN))
+    sender_username: Optional[str] = field(default=None, metadata=_limit(MAX_NAME_LEN))
+    sender: Optional[str] = field(default=None, metadata=_limit(MAX_LABEL_LEN))
+    timestamp: Optional[Timestamp] = field(default=None, metadata=_limit(MAX_TIMESTAMP_LEN))
+
+
+@dataclass(slots=True)
+class PublishEnvelope:
+    channel: str = field(metadata=_limit(MAX_NAME_LEN))
+    cid: Optional[str] = field(default=None, metadata=_limit(MAX_CID_LEN))
+    sender_username: Optional[str] = field(default=None, metadata=_limit(MAX_NAME_LEN))
+    payload: object = field(default=None, metadata={"wire": False})
+
+
+@dataclass(slots=True)
+class CreateChannel:
+    channel: str = field(metadata=_limit(MAX_NAME_LEN))
+
+
+@dataclass(slots=True)
+class AddPublisher:
+    channel: str = field(metadata=_limit(MAX_NAME_LEN))
+    username: str = field(metadata=_limit(MAX_NAME_LEN))
+
+
+@dataclass(slots=True)
+class Subscribe:
+    channel: str = field(metadata=_limit(MAX_NAME_LEN))
+    # last seq the subscriber has; posts after it are sent as channel history
+    after_seq: Optional[int] = None
+
+
+@dataclass(slots=True)
+class Unsubscribe:
+    channel: str = field(metadata=_limit(MAX_NAME_LEN))
+
+
+@dataclass(slots=True)
+class GetChannelHistory:
+    channel: str = field(metadata=_limit(MAX_NAME_LEN))
+    before_seq: Optional[int] = None
+    after_seq: Optional[int] = None
+
+
+@dataclass(slots=True)
+class Typing:
+    # exactly one of to (a user) or room
+    to: Optional[str] = field(default=None, metadata=_limit(MAX_NAME_LEN))
+    room: Optional[str] = field(default=None, metadata=_limit(MAX_NAME_LEN))
+    active: bool = True
+
+
+@dataclass(slots=True)
+class GetChatHistory:
+    with_user: str = field(metadata=_limit(MAX_NAME_LEN))
+    before_seq: Optional[int] = None
+    after_seq: Optional[int] = None
+
+
+@dataclass(slots=True)
+class UpdateLabel:
+    label: Optional[str] = field(default=None, metadata=_limit(MAX_LABEL_LEN))
+    anonymous: bool = False
+
+
+@dataclass(slots=True)
+class GetPassphrase:
+    pass
+
+
+@dataclass(slots=True)
+class Ping:
+    # the client checking the server is still there; answered with pong
+    pass
+
+
+@dataclass(slots=True)
+class Pong:
+    # reply to the server's ping; like any inbound frame it marks the connection alive
+    pass
+
+
+@dataclass(slots=True)
+class Credit:
+    # how many more chat messages the client is ready to receive
+    grant: int
+
+
+SCHEMAS: Dict[str, type] = {
+    "register": Register,
+    "message": Message,
+    "get_chat_history": GetChatHistory,
+    "update_label": UpdateLabel,
+    "get_passphrase": GetPassphrase,
+    "credit": Credit,
+    "room_message": RoomMessage,
+    "join_room": JoinRoom,
+    "leave_room": LeaveRoom,
+    "get_room_history": GetRoomHistory,
+    "create_channel": CreateChannel,
+    "add_publisher": AddPublisher,
+    "subscribe": Subscribe,
+    "unsubscribe": Unsubscribe,
+    "publish": Publish,
+    "get_channel_history": GetChannelHistory,
+    "typing": Typing,
+    "ping": Ping,
+    "pong": Pong,
+}
+
+# Types that may carry an opaque payload after their header
+ENVELOPE_SCHEMAS: Dict[str, type] = {
+    "message": MessageEnvelope,
+    "room_message": RoomMessageEnvelope,
+    "publish": PublishEnvelope,
+}
+
+# Per-type frame size limit; types not listed are held to MAX_CONTROL_FRAME_BYTES. Only the listed types
+# may carry an envelope payload or send a header over that limit (checked by the codec before decoding)
+FRAME_LIMITS: Dict[str, int] = {"message": MAX_FRAME_BYTES, "room_message": MAX_FRAME_BYTES, "publish": MAX_FRAME_BYTES}
+
+_TYPE_CHECKS = {
+    str: "type(v) is str",
+    bytes: "type(v) is bytes",
+    bool: "type(v) is bool",
+    int: "type(v) is int",
+    # numbers as JSON.parse and MessagePack can carry them back out (bool is not an int here)
+    Timestamp: "type(v) is str or (type(v) is int and -2 ** 63 <= v < 2 ** 64) or (type(v) is float and isfinite(v))",
+}
+
+
+def _unwrap_optional(annotation):
+    args = getattr(annotation, "__args__", None)
+    if args and type(None) in args:
+        rest = tuple(a for a in args if a is not type(None))
+        return (rest[0] if len(rest) == 1 else Union[rest]), True
+    return annotation, False
+
+
+def compile_validator(cls: type) -> Callable[[Dict], object]:
+    """Generate a validator turning a decoded frame dict into an instance of cls."""
+    wire_fields = [f for f in fields(cls) if f.metadata.get("wire", True)]
+    names = [f.name for f in wire_fields]
+    lines = [
+        "def validate(d):",
+        "    if not allowed.issuperset(d): raise SchemaError('unknown_field')",
+    ]
+    for f in wire_fields:
+        base, optional = _unwrap_optional(f.type)
+        required = f.default is MISSING
+        lines.append("    v = d.get(%r)" % f.name)
+        if required:
+            lines.append("    if v is None: raise SchemaError('invalid_%s')" % f.name)
+        else:
+            lines.append("    if v is None: v = %r" % f.default)
+        guard = "v is not None and " if optional or not required else ""
+        lines.append("    if %snot (%s): raise SchemaError('invalid_%s')" % (guard, _TYPE_CHECKS[base], f.name))
+        if "max_len" in f.metadata:
+            # a union may admit unsized values; only its strings are length-checked
+            sized = guard if base in (str, bytes) else guard + "type(v) is str and "
+            lines.append("    if %slen(v) > %d: raise SchemaError('oversized_%s')" % (sized, f.metadata["max_len"], f.name))
+        lines.append("    %s = v" % f.name)
+    lines.append("    return cls(%s)" % ", ".join("%s=%s" % (n, n) for n in names))
+    namespace = {"SchemaError": SchemaError, "isfinite": math.isfinite, "cls": cls, "allowed": frozenset(names) | {"type"}}
+    exec("\n".join(lines), namespace)
+    return namespace["validate"]
+
+
+VALIDATORS: Dict[str, Callable[[Dict], object]] = {name: compile_validator(cls) for name, cls in SCHEMAS.items()}
+ENVELOPE_VALIDATORS: Dict[str, Callable[[Dict], object]] = {name: compile_validator(cls) for name, cls in ENVELOPE_SCHEMAS.items()}
+
+
+def parse_inbound(msg: Dict, payload=None, size: int = None):
+    """
+    Validate a decoded client frame (and envelope payload, if any); returns (type, struct) or raises SchemaError.
+    size is the frame's length on the wire, held to its type's limit.
+    """
+    mtype = msg.get("type")
+    if type(mtype) is not str:
+        raise SchemaError("unknown_type")
+    if size is not None and size > FRAME_LIMITS.get(mtype, MAX_CONTROL_FRAME_BYTES):
+        raise SchemaError("oversized_frame")
+    if payload is None:
+        validator = VALIDATORS.get(mtype)
+    else:
+        validator = ENVELOPE_VALIDATORS.get(mtype)
+        if validator is None:
+            raise SchemaError("unexpected_payload" if mtype in VALIDATORS else "unknown_type")
+        if len(payload) > MAX_PAYLOAD_BYTES:
+            raise SchemaError("oversized_payload")
+    if validator is None:
+        raise SchemaError("unknown_type")
+    struct = validator(msg)
+    if payload is not None:
+        struct.payload = payload
+    return mtype, struct
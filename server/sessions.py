@@ -0,0 +1,129 @@
+# server/sessions.py
+import secrets
+import time
+from collections import deque, OrderedDict
+from typing import Deque, Dict, List, Optional, Tuple, Union
+
+
+class Session:
+    """
+    Per-user event stream. Every replayable frame delivered to the user gets
+    the next cursor value ("ev") and is kept, already encoded with the
+    connection's codec, in a bounded replay buffer so a reconnecting client
+    can be sent only what it missed.
+    """
+
+    def __init__(self, username: str, buffer_size: int, codec):
+        self.username = username
+        self.token = secrets.token_urlsafe(18)
+        self.codec = codec
+        self.cursor = 0
+        # (ev, encoded, counts against flow-control credit)
+        self.replay: Deque[Tuple[int, Union[str, bytes], bool]] = deque(maxlen=buffer_size)
+        self.detached_at: Optional[float] = None
+        self.expiry = None  # wheel timer ending the grace window while detached
+        # roster version last sent to this user, and their label while detached
+        self.roster_version = 0
+        self.meta = None
+
+    def stamp(self, frame: Dict, encoded: Union[str, bytes, None] = None) -> Union[str, bytes]:
+        """
+        frame encoded with the next "ev", not yet recorded: record() it once the
+        connection has taken it. encoded, if given, is frame already encoded with
+        this codec (once for many users).
+        """
+        # ev goes last so a spliced-in message payload can't shadow it
+        if encoded is None:
+            return self.codec.encode({**frame, "ev": self.cursor + 1})
+        return self.codec.append_field(encoded, "ev", self.cursor + 1)
+
+    def record(self, frame: Dict, stamped: Union[str, bytes]) -> None:
+        """Keep a stamp()ed frame for replay; its ev becomes the cursor."""
+        self.cursor += 1
+        self.replay.append((self.cursor, stamped, frame.get("type") == "message"))
+
+    def events_after(self, cursor: int) -> Optional[List[Tuple[Union[str, bytes], bool]]]:
+        """Frames after cursor, or None if some of them already fell out of the buffer."""
+        if cursor > self.cursor or cursor < 0:
+            return None
+        if cursor == self.cursor:
+            return []
+        if not self.replay or self.replay[0][0] > cursor + 1:
+            return None
+        return [(encoded, metered) for ev, encoded, metered in self.replay if ev > cursor]
+
+
+class SessionStore:
+    def __init__(self, grace_seconds: float, buffer_size: int, max_detached: int, timers=None):
+        self.grace_seconds = grace_seconds
+        # with a timer wheel a detached session is dropped when its grace window ends; without one,
+        # expired sessions are only swept out on the next resume
+        self.timers = timers
+        self.buffer_size = buffer_size
+        self.max_detached = max_detached
+        self.active = {}
+        self.detached: "OrderedDict[str, Session]" = OrderedDict()
+
+    def get(self, username: str) -> Optional[Session]:
+        return self.active.get(username) or self.detached.get(username)
+
+    def start(self, username: str, codec) -> Session:
+        self._forget(username)
+        session = Session(username, self.buffer_size, codec)
+        self.active[username] = session
+        return session
+
+    def owns(self, username: str, token: Optional[str]) -> bool:
+        """Whether token is username's current session token (read-only, for admission checks)."""
+        session = self.get(username)
+        return session is not None and bool(token) and secrets.compare_digest(session.token, token)
+
+    def resume(self, username: str, token: str, cursor: int, codec) -> Optional[Tuple[Session, list]]:
+        """Reattach a session within its grace window; returns the session and frames to replay."""
+        self.expire()
+        session = self.get(username)
+        if not self.owns(username, token):
+            return None
+        if session.codec is not codec:
+            # buffered frames are encoded for the old wire format
+            return None
+        missed = session.events_after(cursor)
+        if missed is None:
+            return None
+        self._forget(username)
+        session.detached_at = None
+        self.active[username] = session
+        return session, missed
+
+    def detach(self, username: str, session: Session) -> None:
+        if self.active.get(username) is not session:
+            return
+        del self.active[username]
+        session.detached_at = time.monotonic()
+        self.detached[username] = session
+        if self.timers is not None:
+            session.expiry = self.timers.call_later(self.grace_seconds, self._expire_one, username, session)
+        while len(self.detached) > self.max_detached:
+            self._forget(next(iter(self.detached)))
+
+    def _forget(self, username: str) -> None:
+        session = self.detached.pop(username, None)
+        if session is not None and session.expiry is not None:
+            session.expiry.cancel()
+            session.expiry = None
+
+    def _expire_one(self, username: str, session: Session) -> None:
+        session.expiry = None
+        if self.detached.get(username) is session:
+            del self.detached[username]
+
+    def expire(self) -> int:
+        cutoff = time.monotonic() - self.grace_seconds
+        expired = 0
+        while self.detached:
+            session = next(iter(self.detached.values()))
+            if session.detached_at > cutoff:
+                break
+            self._forget(next(iter(self.detached)))
+            expired += 1
+        return expired
@@ -0,0 +1,6 @@
+# server/tests/conftest.py
+import os
+import sys
+
+# server modules import each other as siblings, as when run with python server/s1.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,44 @@
+# server/tests/test_channels.py
+import pytest
+
+from channels import ChannelStore
+
+
+def test_followed_copy_cannot_be_claimed_locally():
+    store = ChannelStore(max_subscribers=10, history_size=10)
+    store.subscribe("news", "mallory", remote_owner="alice")
+    with pytest.raises(ValueError, match="channel_exists"):
+        store.create("news", "mallory")
+    channel = store.get("news")
+    assert channel.owner == "alice"
+    assert channel.publishers == {"alice"}
+
+
+def test_owner_may_recreate_a_followed_copy():
+    store = ChannelStore(max_subscribers=10, history_size=10)
+    followed = store.subscribe("news", "bob", remote_owner="alice")
+    assert store.create("news", "alice") is followed
+
+
+def test_unknown_channel_needs_a_registered_owner():
+    store = ChannelStore(max_subscribers=10, history_size=10)
+    with pytest.raises(ValueError, match="unknown_channel"):
+        store.subscribe("news", "bob")
+    assert store.get("news") is None
+
+
+def test_local_channel_is_not_taken_over():
+    store = ChannelStore(max_subscribers=10, history_size=10)
+    store.create("news", "alice")
+    with pytest.raises(ValueError, match="channel_exists"):
+        store.create("news", "mallory")
+    # subscribing never changes the owner
+    assert store.subscribe("news", "mallory", remote_owner="mallory").owner == "alice"
+
+
+def test_subscriber_limit():
+    store = ChannelStore(max_subscribers=1, history_size=10)
+    store.create("news", "alice")
+    store.subscribe("news", "alice")
+    with pytest.raises(ValueError, match="channel_full"):
+        store.subscribe("news", "bob")
@@ -0,0 +1,226 @@
+# server/tests/test_codec.py
+import json
+
+import pytest
+
+from codec import MSGPACK, RAW_MARK, CodecError, JsonCodec, RawPayload, available_json_backends, negotiate, wire_size
+
+msgpack = pytest.importorskip("msgpack")
+
+IV = b"\x01" * 12
+CT = bytes(range(256))
+HEADER = {"type": "message", "recipient": "bob", "cid": "c1"}
+
+
+@pytest.fixture(params=available_json_backends())
+def codec(request):
+    return JsonCodec(request.param)
+
+
+def json_envelope(payload_text: str, header=HEADER) -> str:
+    return json.dumps(header) + "\n" + payload_text
+
+
+def msgpack_envelope(payload: bytes, header=HEADER) -> bytes:
+    return msgpack.packb(header, use_bin_type=True) + payload
+
+
+def json_payload() -> str:
+    return json.dumps({"iv": "AQEBAQEBAQEBAQEB", "ct": "AAEC", "aad": None, "timestamp": "2026-01-01T00:00:00Z"})
+
+
+def test_json_envelope_is_kept_verbatim_and_spliced(codec):
+    text = json_payload()
+    header, raw = codec.decode_envelope(json_envelope(text))
+    assert header == HEADER
+    assert isinstance(raw, RawPayload) and raw.data == text
+    frame = json.loads(codec.encode({"type": "message", "id": 7, "payload": raw}))
+    assert frame["payload"] == json.loads(text)
+    assert frame["id"] == 7
+
+
+def test_single_line_is_a_plain_frame(codec):
+    header, raw = codec.decode_envelope(json.dumps({"type": "ping"}))
+    assert header == {"type": "ping"} and raw is None
+
+
+@pytest.mark.parametrize("payload", [
+    '{"iv":"AA=="}]}{}',          # closes the outer frame early, then another object
+    '{"iv":"AA=="}{"ct":"AA=="}',  # two objects
+    '{"iv":"AA==",}',
+    '{"iv":"AA=="',
+    '["iv"]',
+    '"iv"',
+    '{"iv":{"nested":1}}',
+    '{"iv":[1,2]}',
+    '{"aad":NaN}',
+    '{"aad":Infinity}',
+    '{"aad":"\\ud800"}',
+    '{}garbage',
+    '',
+])
+def test_json_envelope_refuses_malformed_payload(codec, payload):
+    with pytest.raises(CodecError):
+        codec.decode_envelope(json_envelope(payload))
+
+
+def test_refused_payload_never_reaches_a_frame(codec):
+    # the reported case: accepted before, then broke the recipient's frame and every history reply
+    with pytest.raises(CodecError) as e:
+        codec.decode_envelope('{"type":"message","recipient":"bob"}\n{"iv":"AA=="}]}{}')
+    assert str(e.value) == "malformed_payload"
+
+
+def test_batches_and_histories_with_payloads_parse(codec):
+    raws = [codec.decode_envelope(json_envelope(json_payload()))[1] for _ in range(3)]
+    history = codec.encode({"type": "chat_history", "messages": [{"id": i, "payload": r} for i, r in enumerate(raws)]})
+    batch = codec.encode_batch([history, codec.encode({"type": "message", "payload": raws[0]})])
+    decoded = json.loads(batch)
+    assert [m["id"] for m in decoded["events"][0]["messages"]] == [0, 1, 2]
+    assert decoded["events"][1]["payload"]["ct"] == "AAEC"
+
+
+def test_client_string_equal_to_the_splice_mark_is_refused(codec):
+    raw = codec.decode_envelope(json_envelope(json_payload()))[1]
+    with pytest.raises(CodecError):
+        codec.encode({"type": "message", "sender": RAW_MARK, "payload": raw})
+
+
+def test_append_field(codec):
+    encoded = codec.encode({"type": "message", "id": 1})
+    assert json.loads(codec.append_field(encoded, "ev", 5)) == {"type": "message", "id": 1, "ev": 5}
+    assert json.loads(codec.append_field("{}", "ev", 5)) == {"ev": 5}
+
+
+def test_msgpack_envelope_is_kept_verbatim_and_spliced():
+    payload = msgpack.packb({"iv": IV, "ct": CT, "aad": None}, use_bin_type=True)
+    header, raw = MSGPACK.decode_envelope(msgpack_envelope(payload))
+    assert header == HEADER and raw.data == payload
+    frame = msgpack.unpackb(MSGPACK.encode({"type": "message", "payload": raw}), raw=False)
+    assert frame["payload"] == {"iv": IV, "ct": CT, "aad": None}
+
+
+@pytest.mark.parametrize("payload", [
+    b"\x82\xa2iv",                                                    # truncated map
+    msgpack.packb({"iv": IV}, use_bin_type=True) + b"\xc0",           # trailing data
+    msgpack.packb({"iv": IV}, use_bin_type=True) * 2,                 # two maps
+    msgpack.packb([IV], use_bin_type=True),
+    msgpack.packb({"iv": {"nested": 1}}, use_bin_type=True),
+    msgpack.packb({1: IV}, use_bin_type=True),
+    msgpack.packb({"iv": msgpack.ExtType(5, b"x")}, use_bin_type=True),
+    msgpack.packb({"aad": float("nan")}, use_bin_type=True),
+    b"\x81\xa2iv\xa3\xff\xfe\xfd",                                    # invalid UTF-8 string
+])
+def test_msgpack_envelope_refuses_malformed_payload(payload):
+    with pytest.raises(CodecError) as e:
+        MSGPACK.decode_envelope(msgpack_envelope(payload))
+    assert str(e.value) == "malformed_payload"
+
+
+def test_payloads_transcode_both_ways(codec):
+    from_json = codec.decode_envelope(json_envelope(json_payload()))[1]
+    frame = msgpack.unpackb(MSGPACK.encode({"type": "message", "payload": from_json}), raw=False)
+    assert frame["payload"]["iv"] == IV and frame["payload"]["ct"] == b"\x00\x01\x02"
+
+    payload = msgpack.packb({"iv": IV, "ct": CT, "aad": "x"}, use_bin_type=True)
+    from_msgpack = MSGPACK.decode_envelope(msgpack_envelope(payload))[1]
+    frame = json.loads(codec.encode({"type": "message", "payload": from_msgpack}))
+    assert frame["payload"]["aad"] == "x"
+    assert from_msgpack.encoded_for(codec) is from_msgpack.encoded_for(codec)  # transcoded once
+
+
+def test_payload_is_not_base64_decoded_on_arrival(codec):
+    raw = codec.decode_envelope(json_envelope('{"iv":"not base64!","ct":"AAEC"}'))[1]
+    assert json.loads(codec.encode({"payload": raw})) == {"payload": {"iv": "not base64!", "ct": "AAEC"}}
+    # a MessagePack recipient still gets a well-formed frame; only decrypting it fails
+    frame = msgpack.unpackb(MSGPACK.encode({"payload": raw}), raw=False)
+    assert frame["payload"] == {"iv": "not base64!", "ct": b"\x00\x01\x02"}
+
+
+def test_out_of_range_int_is_refused_or_transcodes(codec):
+    # stdlib JSON keeps the exact int, which MessagePack can't hold; orjson reads it as a float
+    try:
+        raw = codec.decode_envelope(json_envelope('{"n":18446744073709551616}'))[1]
+    except CodecError:
+        return
+    assert msgpack.unpackb(raw.encoded_for(MSGPACK), raw=False) == {"n": 2.0 ** 64}
+
+
+def test_msgpack_batch_and_append_field():
+    payload = msgpack.packb({"iv": IV, "ct": CT}, use_bin_type=True)
+    raw = MSGPACK.decode_envelope(msgpack_envelope(payload))[1]
+    message = MSGPACK.append_field(MSGPACK.encode({"type": "message", "payload": raw}), "ev", 3)
+    batch = msgpack.unpackb(MSGPACK.encode_batch([message, MSGPACK.encode({"type": "ping"})]), raw=False)
+    assert batch["type"] == "batch"
+    assert batch["events"][0] == {"type": "message", "payload": {"iv": IV, "ct": CT}, "ev": 3}
+    assert batch["events"][1] == {"type": "ping"}
+
+
+MESSAGE_TYPES = {"message", "room_message", "publish"}
+LIMIT = 256
+
+
+def test_wire_size_counts_bytes():
+    assert wire_size("abc") == 3
+    assert wire_size("é" * 10) == 20
+    assert wire_size(b"\xc3\xa9") == 2
+
+
+@pytest.mark.parametrize("frame", [
+    json.dumps({"type": "typing", "to": "x" * LIMIT}),                    # big control frame
+    json.dumps({"to": "x" * LIMIT, "type": "message"}),                  # type not leading
+    json.dumps({"type": "message", "cid": "x" * LIMIT}) + "\n{}",        # big header on an envelope
+    "x" * (LIMIT + 1),
+])
+def test_json_long_header_is_refused_unparsed(codec, frame):
+    codec._loads = None  # any parse would fail with malformed_json
+    with pytest.raises(CodecError) as e:
+        codec.decode_envelope(frame, LIMIT, MESSAGE_TYPES)
+    assert str(e.value) == "oversized_frame"
+
+
+def test_json_long_flat_message_and_envelope_pass(codec):
+    flat = json.dumps({"type": "message", "recipient": "bob", "ct": "AAAA" * LIMIT})
+    assert codec.decode_envelope(flat, LIMIT, MESSAGE_TYPES)[0]["recipient"] == "bob"
+    envelope = json_envelope(json.dumps({"iv": "AQEBAQEBAQEBAQEB", "ct": "AAAA" * LIMIT}))
+    header, raw = codec.decode_envelope(envelope, LIMIT, MESSAGE_TYPES)
+    assert header == HEADER and raw is not None
+
+
+def test_payload_on_other_types_is_refused_before_parsing(codec):
+    with pytest.raises(CodecError) as e:
+        codec.decode_envelope(json_envelope("not even json", {"type": "typing"}), LIMIT, MESSAGE_TYPES)
+    assert str(e.value) == "unexpected_payload"
+    with pytest.raises(CodecError) as e:
+        codec.decode_envelope(json_envelope("{}", {"type": ["message"]}), LIMIT, MESSAGE_TYPES)
+    assert str(e.value) == "unexpected_payload"
+
+
+@pytest.mark.parametrize("frame, reason", [
+    (msgpack.packb({"type": "typing", "to": "x" * LIMIT}, use_bin_type=True), "oversized_frame"),
+    (msgpack.packb({"to": "x" * LIMIT, "type": "message"}, use_bin_type=True), "oversized_frame"),
+    (msgpack_envelope(b"\x80", {"type": "typing", "to": "x" * LIMIT}), "oversized_frame"),
+    # a message may be a long flat frame, so this one is parsed whole and refused as such
+    (msgpack_envelope(b"\x80", {"type": "message", "cid": "x" * LIMIT}), "malformed_msgpack"),
+])
+def test_msgpack_long_first_object_is_refused(frame, reason):
+    with pytest.raises(CodecError) as e:
+        MSGPACK.decode_envelope(frame, LIMIT, MESSAGE_TYPES)
+    assert str(e.value) == reason
+
+
+def test_msgpack_long_flat_message_and_envelope_pass():
+    flat = msgpack.packb({"type": "message", "recipient": "bob", "ct": CT * 4}, use_bin_type=True)
+    assert MSGPACK.decode_envelope(flat, LIMIT, MESSAGE_TYPES)[0]["ct"] == CT * 4
+    payload = msgpack.packb({"iv": IV, "ct": CT * 4}, use_bin_type=True)
+    header, raw = MSGPACK.decode_envelope(msgpack_envelope(payload), LIMIT, MESSAGE_TYPES)
+    assert header == HEADER and raw.data == payload
+    with pytest.raises(CodecError) as e:
+        MSGPACK.decode_envelope(msgpack_envelope(payload, {"type": "typing"}), LIMIT, MESSAGE_TYPES)
+    assert str(e.value) == "unexpected_payload"
+
+
+def test_negotiate():
+    assert negotiate([]) is None
+    assert negotiate(["chat.json.v1"]).name == "json"
+    assert negotiate(["chat.json.v1", "chat.msgpack.v1"]) is MSGPACK
@@ -0,0 +1,21 @@
+# server/tests/test_dedup.py
+from dedup import DedupWindow
+
+
+def test_update_changes_the_reack_but_is_not_a_hit():
+    window = DedupWindow()
+    window.remember("alice", "c1", {"type": "ack", "cid": "c1", "status": "accepted", "seq": 4})
+    window.update("alice", "c1", status="delivered")
+    window.update("alice", "unknown", status="delivered")
+    assert window.hits == 0
+    assert window.get("alice", "c1") == {"type": "ack", "cid": "c1", "status": "delivered", "seq": 4}
+    assert window.get("alice", "unknown") is None
+
+
+def test_forget_lets_a_resend_in_again():
+    window = DedupWindow()
+    window.remember("alice", "c1", {"status": "accepted"})
+    window.forget("alice", "c1")
+    window.forget("bob", "c1")
+    assert window.get("alice", "c1") is None
+    assert len(window) == 0
@@ -0,0 +1,30 @@
+# server/tests/test_schemas.py
+import pytest
+
+from schemas import MAX_TIMESTAMP_LEN, SchemaError, VALIDATORS
+
+FRAMES = {
+    "message": {"recipient": "bob", "iv": bytes(12), "ct": b"\0"},
+    "room_message": {"room": "lobby", "iv": bytes(12), "ct": b"\0"},
+    "publish": {"channel": "news", "iv": bytes(12), "ct": b"\0"},
+}
+
+
+@pytest.mark.parametrize("kind", sorted(FRAMES))
+@pytest.mark.parametrize("timestamp", [1760000000000, 1760000000000.5, "2025-10-09T08:53:20.000Z", None])
+def test_timestamp_may_be_a_string_or_a_number(kind, timestamp):
+    frame = dict(FRAMES[kind], timestamp=timestamp)
+    assert VALIDATORS[kind](frame).timestamp == timestamp
+
+
+@pytest.mark.parametrize("kind", sorted(FRAMES))
+@pytest.mark.parametrize("timestamp", [True, float("nan"), float("inf"), 2 ** 64, [1], {"ms": 1}])
+def test_timestamp_rejects_other_values(kind, timestamp):
+    with pytest.raises(SchemaError, match="invalid_timestamp"):
+        VALIDATORS[kind](dict(FRAMES[kind], timestamp=timestamp))
+
+
+def test_only_string_timestamps_are_length_checked():
+    with pytest.raises(SchemaError, match="oversized_timestamp"):
+        VALIDATORS["message"](dict(FRAMES["message"], timestamp="x" * (MAX_TIMESTAMP_LEN + 1)))
+    assert VALIDATORS["message"](dict(FRAMES["message"], timestamp=10 ** 18)).timestamp == 10 ** 18
@@ -0,0 +1,127 @@
+# server/timers.py
+import asyncio
+import math
+import time
+from typing import Callable, Dict, List, Optional
+
+from jsonlog import log
+from metrics import Histogram
+
+
+class TimerStats:
+    __slots__ = ("scheduled", "fired", "cancelled", "ticks", "late_ticks", "tick_cost")
+
+    def __init__(self):
+        self.scheduled = 0
+        self.fired = 0
+        self.cancelled = 0
+        self.ticks = 0
+        self.late_ticks = 0  # slots processed in catch-up after the loop was stalled past their time
+        self.tick_cost = Histogram()  # seconds spent per wake-up, callbacks included
+
+    def snapshot(self) -> Dict:
+        return {
+            "scheduled": self.scheduled,
+            "fired": self.fired,
+            "cancelled": self.cancelled,
+            "ticks": self.ticks,
+            "late_ticks": self.late_ticks,
+            "tick_cost_seconds": self.tick_cost.snapshot(),
+        }
+
+
+class Timer:
+    __slots__ = ("wheel", "slot", "rounds", "callback", "args")
+
+    def __init__(self, wheel: "TimerWheel", slot: Dict, rounds: int, callback: Callable, args: tuple):
+        self.wheel = wheel
+        self.slot = slot
+        self.rounds = rounds  # full turns of the wheel left before it is due
+        self.callback = callback
+        self.args = args
+
+    def cancel(self) -> None:
+        if self.slot is not None:
+            del self.slot[self]
+            self.slot = None
+            self.wheel._count -= 1
+            self.wheel.stats.cancelled += 1
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel: one task for every server-side timeout instead of an
+    asyncio timer or sleeping task each. A timer goes into the slot its
+    deadline hashes to (with the number of whole turns still to wait), so
+    call_later() and cancel() are O(1); each tick walks one slot.
+
+    Timers fire on the first tick at or after their deadline, so up to one
+    tick late. The task only runs while timers are pending.
+    """
+
+    def __init__(self, tick: float = 0.05, slots: int = 512, stats: Optional[TimerStats] = None):
+        self.tick = tick
+        self._slots: List[Dict[Timer, None]] = [{} for _ in range(slots)]
+        self._cursor = 0  # slot handled at _next_at
+        self._next_at = 0.0
+        self._count = 0
+        self._task: Optional[asyncio.Task] = None
+        self.stats = stats or TimerStats()
+
+    def call_later(self, delay: float, callback: Callable, *args) -> Timer:
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.get_loop() is not loop:
+            self._next_at = time.monotonic() + self.tick
+            self._task = loop.create_task(self._run())
+        ticks = max(0, math.ceil((time.monotonic() + delay - self._next_at) / self.tick))
+        rounds, offset = divmod(ticks, len(self._slots))
+        slot = self._slots[(self._cursor + offset) % len(self._slots)]
+        timer = Timer(self, slot, rounds, callback, args)
+        slot[timer] = None
+        self._count += 1
+        self.stats.scheduled += 1
+        return timer
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _advance(self) -> None:
+        slot = self._slots[self._cursor]
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        due = []
+        for timer in slot:
+            if timer.rounds:
+                timer.rounds -= 1
+            else:
+                due.append(timer)
+        for timer in due:
+            del slot[timer]
+            timer.slot = None
+        self._count -= len(due)
+        for timer in due:
+            self.stats.fired += 1
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                log.exception("timer_failed", callback=getattr(timer.callback, "__qualname__", repr(timer.callback)))
+
+    async def _run(self):
+        try:
+            while self._count:
+                delay = self._next_at - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                started = time.perf_counter()
+                now = time.monotonic()
+                behind = -1
+                while self._next_at <= now:
+                    # moved on first, so timers scheduled by callbacks count from the next slot
+                    self._next_at += self.tick
+                    self._advance()
+                    behind += 1
+                    self.stats.ticks += 1
+                self.stats.late_ticks += max(behind, 0)
+                self.stats.tick_cost.observe(time.perf_counter() - started)
+        finally:
+            if self._task is asyncio.current_task():
+                self._task = None